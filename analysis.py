@@ -0,0 +1,105 @@
+# Post-processing of the feed port: resonance and S11 bandwidths
+#
+# Works on plain NumPy arrays (freq, s11_dB, Zin), so it can be used both by the
+# simulation scripts and on results loaded from disk without openEMS.
+
+import numpy as np
+
+# S11 thresholds (dB) at which bandwidths are reported; the first one is the reference
+# used to shade the band of the resonance in the reflection plot
+cutoff_db_resonance = -4
+cutoff_dbs = [cutoff_db_resonance, -1, -2, -3]
+
+
+def resonance_index(s11_dB):
+    """
+    Index of the S11 minimum.
+    """
+    return int(np.argmin(s11_dB))
+
+
+def band_edges(s11_dB, idx, cutoff_dbs):
+    """
+    Edges of the bands around the resonance where S11 stays below each cutoff.
+
+    The edges are the first samples at or above the cutoff on either side of `idx`
+    (or the ends of the frequency range).
+
+    :param s11_dB: S11 in dB
+    :param idx: index of the resonance
+    :param cutoff_dbs: thresholds in dB
+    :return: arrays of lower and upper edge indices, one per threshold
+    """
+    s11_dB = np.asarray(s11_dB)
+    above = s11_dB[None, :] >= np.asarray(cutoff_dbs, dtype=float)[:, None]
+
+    left = above[:, idx::-1]
+    lower = np.where(left.any(axis=1), idx - np.argmax(left, axis=1), 0)
+
+    right = above[:, idx:]
+    upper = np.where(right.any(axis=1), idx + np.argmax(right, axis=1), len(s11_dB) - 1)
+    return lower, upper
+
+
+def sample(freq, s11_dB, Zin, i):
+    """
+    Summary of the port at one frequency index, rounded for display.
+    """
+    return {
+        "idx": int(i),
+        "freq": round(freq[i] / 1e6, 1),
+        "s11": round(s11_dB[i], 1),
+        "r": round(np.real(Zin[i]), 1),
+    }
+
+
+def bandwidths(freq, s11_dB, Zin, cutoff_dbs=cutoff_dbs, idx=None):
+    """
+    Bandwidths around the resonance for several S11 thresholds.
+
+    :param idx: index of the resonance, the S11 minimum by default
+    :return: dict cutoff_db -> {"lower": sample, "upper": sample, "bandwidth": MHz}
+    """
+    if idx is None:
+        idx = resonance_index(s11_dB)
+    lower, upper = band_edges(s11_dB, idx, cutoff_dbs)
+    results = {}
+    for cutoff_db, lo, hi in zip(cutoff_dbs, lower, upper):
+        results[cutoff_db] = {
+            "lower": sample(freq, s11_dB, Zin, lo),
+            "upper": sample(freq, s11_dB, Zin, hi),
+            "bandwidth": round((freq[hi] - freq[lo]) / 1e6, 1),
+        }
+    return results
+
+
+def interest_band(freq, s11_dB, Zin, lower, upper):
+    """
+    Port summary at the edges and the center of a band of interest.
+
+    :param lower: lower frequency of the band (Hz)
+    :param upper: upper frequency of the band (Hz)
+    :return: dict "lower"/"center"/"upper" -> sample, each with the band's "bandwidth" in MHz
+    """
+    results = {}
+    bandwidth = round((upper - lower) / 1e6, 1)
+    for kf, f in [("lower", lower), ("center", (lower + upper) / 2), ("upper", upper)]:
+        results[kf] = sample(freq, s11_dB, Zin, np.argmin(np.abs(freq - f)))
+        results[kf]["bandwidth"] = bandwidth
+    return results
+
+
+def resonance_frequency(freq, s11_dB):
+    """
+    Frequency of the S11 minimum, refined between samples by a parabola through the
+    minimum and its two neighbours.
+
+    :return: frequency (Hz)
+    """
+    idx = resonance_index(s11_dB)
+    if idx == 0 or idx == len(s11_dB) - 1:
+        return float(freq[idx])
+    y0, y1, y2 = s11_dB[idx - 1], s11_dB[idx], s11_dB[idx + 1]
+    denom = y0 - 2 * y1 + y2
+    shift = 0.5 * (y0 - y2) / denom if denom > 0 else 0.0
+    return float(freq[idx] + shift * (freq[idx + 1] - freq[idx]))
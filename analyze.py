@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# Analysis of existing result directories, without the FDTD engine
+#
+# The simulation scripts write `sim_info.json` into their result directory with everything
+# the post-processing needs besides the probe and dump files: excitation band, port
+# resistance, symmetry planes, NF2FF box, far-field angles and S11 thresholds. From that,
+# the feed port is evaluated with NumPy (port_data.py), the resonance and bandwidths are
+# extracted (also from the fitted ring-down, resonance_fit.py), the far-field is computed
+# from the recorded NF2FF box (reusing the result of a previous identical call) and the
+# figures are rendered headless, so changing a plot or a threshold does not need a new
+# simulation. Many directories are analysed in parallel.
+#
+# Usage:
+#   ./analyze.py results/yagi_trena
+#   ./analyze.py -j 8 --cutoff -3 -6 -10 --no-nf2ff results/*
+
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analysis
+import hairpin
+import pattern_metrics
+import plots
+import port_data
+import resonance_fit
+import result_store
+import symmetry
+
+# name of the file describing a result directory
+info_file = "sim_info.json"
+
+# number of frequencies at which the feed port is evaluated
+n_freq = 2001
+
+# prefix of the far-field results reused between calls, one file per NF2FF box, frequencies,
+# angles and radius
+nf2ff_outfile = "nf2ff_analyze"
+
+
+def write_info(sim_path, name, f0, fc, Z_ref, planes=(), nf2ff=None, nf2ff_radius=1.0, theta=None, phi=None,
+               cutoff_dbs=analysis.cutoff_dbs, interest_band=None, hairpin=None, freq_scale=1.0):
+    """
+    Describe a result directory for `analyze_dir`.
+
+    :param name: antenna name, used in the figure titles
+    :param f0: center of the excitation band (Hz)
+    :param fc: half width of the excitation band (Hz)
+    :param Z_ref: resistance of the simulated port (of the reduced model with symmetry)
+    :param planes: symmetry planes of the run
+    :param nf2ff: NF2FF box returned by `fdtd.CreateNF2FFBox`, if recorded
+    :param nf2ff_radius: radius of the far-field (m)
+    :param theta: far-field theta angles (degrees)
+    :param phi: far-field phi angles (degrees)
+    :param cutoff_dbs: S11 thresholds of the bandwidths, the first one shades the resonance
+    :param interest_band: (lower, upper) frequencies of the band of interest (Hz)
+    :param hairpin: dict with the `length`, `D` and `d` (mm) of a hairpin left out of the
+                    model, applied to the feed impedance by `analyze_dir` (hairpin.py)
+    :param freq_scale: the run was restored from an electrically scaled model at
+                       f0 / freq_scale, its probes and dumps are evaluated at freq / freq_scale
+                       (freq_scaling.py)
+    """
+    info = {
+        "name": name,
+        "f0": f0,
+        "fc": fc,
+        "Z_ref": Z_ref,
+        "planes": [list(p) for p in planes],
+        "cutoff_dbs": list(cutoff_dbs),
+        "interest_band": list(interest_band) if interest_band is not None else None,
+        "nf2ff": None,
+        "hairpin": hairpin,
+        "freq_scale": freq_scale,
+    }
+    if nf2ff is not None:
+        info["nf2ff"] = {
+            "name": nf2ff.name,
+            "start": [float(x) for x in nf2ff.start],
+            "stop": [float(x) for x in nf2ff.stop],
+            "directions": [bool(x) for x in nf2ff.directions],
+            "mirror": [int(x) for x in nf2ff.mirror],
+            "radius": float(nf2ff_radius),
+            "theta": [float(x) for x in theta],
+            "phi": [float(x) for x in phi],
+        }
+    with open(os.path.join(sim_path, info_file), "w") as f:
+        json.dump(info, f, indent=2)
+
+
+def load_info(sim_path):
+    with open(os.path.join(sim_path, info_file)) as f:
+        info = json.load(f)
+    info["planes"] = [tuple(p) for p in info["planes"]]
+    return info
+
+
+def farfield_file(box, freq):
+    """
+    Name of the cached far-field of an NF2FF box at the frequencies `freq`.
+
+    :param box: "nf2ff" entry of `sim_info.json`
+    """
+    key = json.dumps([box["name"], box["start"], box["stop"], box["theta"], box["phi"], box["radius"],
+                      [float(f) for f in np.atleast_1d(freq)]], default=float)
+    return "{}_{}.h5".format(nf2ff_outfile, hashlib.sha1(key.encode()).hexdigest()[:12])
+
+
+def calc_farfield(sim_path, box, freq, read_cached=True):
+    """
+    Far-field of the recorded NF2FF box of a result directory.
+
+    A result is only reused for the same frequencies, angles and radius (`farfield_file`).
+
+    :param box: "nf2ff" entry of `sim_info.json`
+    :param freq: frequencies to analyse (Hz)
+    """
+    from CSXCAD import ContinuousStructure
+    from openEMS.nf2ff import nf2ff
+
+    # the recording box only has to be known by name and extent to read its dumps back
+    res = nf2ff(ContinuousStructure(), box["name"], box["start"], box["stop"], directions=box["directions"],
+                mirror=box["mirror"])
+    return res.CalcNF2FF(sim_path, freq, np.array(box["theta"]), np.array(box["phi"]), radius=box["radius"],
+                         outfile=farfield_file(box, freq), read_cached=read_cached)
+
+
+def analyze_dir(sim_path, cutoff_dbs=None, nf2ff=True, fmt="svg"):
+    """
+    Evaluate the feed port, bandwidths and far-field of a result directory and render its
+    figures into it.
+
+    :param cutoff_dbs: S11 thresholds, those of `sim_info.json` by default
+    :param nf2ff: compute the far-field if the NF2FF box was recorded
+    :return: summary dict, also written to `analysis.json`, and added to the result store
+             (result_store.py) under `store_id`
+    """
+    info = load_info(sim_path)
+    cutoff_dbs = list(cutoff_dbs or info["cutoff_dbs"])
+    freq = np.linspace(info["f0"] - info["fc"], info["f0"] + info["fc"], n_freq)
+
+    # frequencies of the probes and dumps, those of the original band for a rescaled run
+    scale = info.get("freq_scale", 1.0)
+    port = port_data.calc_port(sim_path, freq / scale, info["Z_ref"])
+    Zin = port.Zin * symmetry.impedance_factor(info["planes"])
+    P_acc = port.P_acc * symmetry.power_factor(info["planes"])
+    s11 = port.s11
+    # the probes only see the bare antenna when the hairpin is applied afterwards
+    stub = info.get("hairpin")
+    if stub:
+        Zin = hairpin.apply(freq, Zin, **stub)
+        s11 = hairpin.reflection(Zin, info["Z_ref"] * symmetry.impedance_factor(info["planes"]))
+    s11_dB = 20.0 * np.log10(np.abs(s11))
+    np.savez(os.path.join(sim_path, "port.npz"), freq=freq, Zin=Zin, s11=s11, P_acc=P_acc)
+
+    idx = analysis.resonance_index(s11_dB)
+    results = analysis.bandwidths(freq, s11_dB, Zin, cutoff_dbs, idx)
+    if info["interest_band"]:
+        results["interest"] = analysis.interest_band(freq, s11_dB, Zin, *info["interest_band"])
+    summary = {
+        "sim_path": sim_path,
+        "resonance": analysis.sample(freq, s11_dB, Zin, idx),
+        "bandwidths": {str(k): v for k, v in results.items()},
+    }
+    if stub:
+        # the zoom and the ring-down fit work on the probes, i.e. without the hairpin
+        f_res, band_edges = analysis.resonance_frequency(freq, s11_dB), None
+    else:
+        # resonance and threshold crossings zoomed in beyond the grid of `freq`
+        fine = port_data.refine(sim_path, freq[0] / scale, freq[-1] / scale, info["Z_ref"], cutoff_dbs=cutoff_dbs)
+        f_res = fine.f_res * scale
+        band_edges = {k: (lo * scale, hi * scale) for k, (lo, hi) in fine.bandwidths.items()}
+        summary["band_edges"] = {str(k): v for k, v in band_edges.items()}
+        # resonance of the run continued by its fitted ring-down, trustworthy for truncated runs
+        try:
+            fit = resonance_fit.fit_port(sim_path, info["f0"] / scale, info["fc"] / scale, info["Z_ref"],
+                                         freq=freq / scale)
+            Zin_fit = fit.Zin * symmetry.impedance_factor(info["planes"])
+            summary["ringdown"] = {"f_res": fit.f_res * scale, "Q": fit.Q, "Zin": [Zin_fit.real, Zin_fit.imag],
+                                   "confidence": fit.confidence}
+        except ValueError as e:
+            print("{}: {}".format(sim_path, e))
+    summary["f_res"] = f_res
+
+    plots.plot_impedance(os.path.join(sim_path, "fig_impedance." + fmt), freq, Zin)
+    plots.plot_reflection(os.path.join(sim_path, "fig_reflection." + fmt), freq, s11_dB, Zin, results, cutoff_dbs,
+                          cutoff_dbs[0], title=info["name"])
+
+    metrics = None
+    box = info["nf2ff"]
+    if nf2ff and box is not None:
+        # far-field over the band below the reference threshold, as in the simulation scripts
+        lower, upper = results[cutoff_dbs[0]]["lower"]["idx"], results[cutoff_dbs[0]]["upper"]["idx"]
+        nf2ff_res = calc_farfield(sim_path, box, freq[lower:upper + 1] / scale)
+        nf2ff_res.freq = np.asarray(nf2ff_res.freq) * scale
+        theta, phi = np.array(box["theta"]), np.array(box["phi"])
+        metrics = pattern_metrics.metrics(nf2ff_res, freq, P_acc, theta, phi)
+        pattern_metrics.save(os.path.join(sim_path, "pattern_metrics.npz"), metrics)
+        summary["farfield"] = {"Prad": float(nf2ff_res.Prad[0])}
+        for key in ["freq", "Dmax_dBi", "gain_dBi", "efficiency", "hpbw_E", "hpbw_H", "fb_dB", "sll_dB"]:
+            summary["farfield"][key] = float(getattr(metrics, key)[0])
+        plots.plot_directivity(os.path.join(sim_path, "fig_directivity." + fmt), theta, phi, nf2ff_res)
+        if len(nf2ff_res.freq) > 1:
+            plots.plot_directivity_freq(os.path.join(sim_path, "fig_directivity_freq." + fmt), nf2ff_res)
+
+    # the parameters are known for runs of the simulation scripts and the sweep
+    params = {}
+    if os.path.exists(os.path.join(sim_path, "params.json")):
+        with open(os.path.join(sim_path, "params.json")) as f:
+            params = json.load(f)
+    summary["store_id"] = result_store.record(info["name"], params, freq, Zin, s11, cutoff_dbs, band_edges=band_edges,
+                                              farfield=metrics, f_res=f_res, sim_path=os.path.abspath(sim_path))
+
+    with open(os.path.join(sim_path, "analysis.json"), "w") as f:
+        json.dump(summary, f, indent=2, default=float)
+    return summary
+
+
+def analyze_dirs(sim_paths, jobs=os.cpu_count(), cutoff_dbs=None, nf2ff=True, fmt="svg"):
+    """
+    Analyse many result directories in parallel.
+
+    :return: list of `analyze_dir` summaries, in the order of `sim_paths`
+    """
+    n = len(sim_paths)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(analyze_dir, sim_paths, [cutoff_dbs] * n, [nf2ff] * n, [fmt] * n))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse result directories without running the simulation")
+    parser.add_argument("sim_paths", nargs="+", help="result directories with a " + info_file)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-c", "--cutoff", type=float, nargs="+", help="S11 thresholds (dB), the first one shaded")
+    parser.add_argument("--no-nf2ff", action="store_true", help="skip the far-field")
+    parser.add_argument("-f", "--format", default="svg", help="image format (svg, png, pdf)")
+    args = parser.parse_args()
+
+    for s in analyze_dirs(args.sim_paths, args.jobs, args.cutoff, not args.no_nf2ff, args.format):
+        res = s["resonance"]
+        print("{}: resonance at {} MHz with {} dB at {} Ohm".format(s["sim_path"], res["freq"], res["s11"], res["r"]))
+        if "farfield" in s:
+            print("    D_max = {:.2f} dBi, efficiency {:.1%}".format(s["farfield"]["Dmax_dBi"], s["farfield"]["efficiency"]))
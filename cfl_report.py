@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# Which feature of the model sets the FDTD timestep
+#
+# The timestep of the Yee scheme follows from the smallest cell along each axis
+# (cost_estimator.cfl_timestep), and the run time from the cells times the timesteps. This
+# script builds the Yagi-Uda of yagi_trena.py on a mesh that records every AddLine,
+# SetLines and SmoothMeshLines call with its file, line and source text. The smallest cells
+# along x, y and z are traced back to the calls that placed their lines, to the primitives
+# whose bounding box edges they lie on, or to the smoothing between them. For each of these
+# features the required lines it alone accounts for are removed, the mesh is graded again
+# (mesh_planner.graded_lines) and the timestep, the number of cells and the projected
+# speedup are reported, i.e. what coarsening the feature or modelling it differently buys.
+# Lines on the edges and the center of the port, on the axes of wires and cylinders and at
+# the origin or the center of the domain are required by any model: they are never removed,
+# and features placing nothing else are reported as required instead of projected.
+#
+# Usage:
+#   ./cfl_report.py                       the model with the settings of yagi_trena.py
+#   ./cfl_report.py -n 5                  trace the 5 smallest cells along every axis
+#   ./cfl_report.py --element-model wire
+
+import os
+import sys
+import argparse
+import linecache
+
+import numpy as np
+
+import cost_estimator
+import mesh_planner
+
+_AXES = "xyz"
+
+# number of smallest cells traced along every axis
+n_cells = 3
+
+# mesh lines closer than this (drawing units) are the same line
+tolerance = 1e-6
+
+
+def _axis(axis):
+    return _AXES[axis] if isinstance(axis, int) else axis.lower()
+
+
+def _site():
+    # file, line and source text of the caller of the traced grid method
+    f = sys._getframe(2)
+    return "{}:{}: {}".format(os.path.basename(f.f_code.co_filename), f.f_lineno,
+                              linecache.getline(f.f_code.co_filename, f.f_lineno).strip())
+
+
+class MeshTrace:
+    """
+    Mesh lines placed on a grid and the calls that placed them.
+    """
+
+    def __init__(self):
+        # axis -> list of (position, site)
+        self.added = {axis: [] for axis in _AXES}
+        # axis -> list of (site, max_res, ratio)
+        self.smooth = {axis: [] for axis in _AXES}
+
+    def add(self, axis, values, site):
+        self.added[_axis(axis)] += [(float(v), site) for v in np.atleast_1d(values)]
+
+
+class _TracedGrid:
+    # CSRectGrid proxy recording the calls that place lines
+    def __init__(self, grid, trace):
+        self._grid = grid
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._grid, name)
+
+    def AddLine(self, axis, values):
+        self._trace.add(axis, values, _site())
+        return self._grid.AddLine(axis, values)
+
+    def SetLines(self, axis, values):
+        # only the lines that were not there before are placed by this call
+        old = np.asarray(self._grid.GetLines(axis), dtype=float)
+        new = [v for v in np.atleast_1d(values) if not np.any(np.abs(old - v) <= tolerance)]
+        self._trace.add(axis, new, _site())
+        return self._grid.SetLines(axis, values)
+
+    def SmoothMeshLines(self, axis, max_res, ratio=1.5):
+        site = _site()
+        for a in (_AXES if axis == "all" else [_axis(axis)]):
+            self._trace.smooth[a].append((site, max_res, ratio))
+        return self._grid.SmoothMeshLines(axis, max_res, ratio=ratio)
+
+
+def build_traced(module, **kwargs):
+    """
+    Call `module.build_model(**kwargs)` on a mesh that records its lines.
+
+    :param module: simulation module creating its `ContinuousStructure` in `build_model`
+    :return: tuple ``(model, trace)``
+    """
+    trace = MeshTrace()
+
+    class TracedCSX(module.ContinuousStructure):
+        def GetGrid(self):
+            return _TracedGrid(super().GetGrid(), trace)
+
+    original = module.ContinuousStructure
+    module.ContinuousStructure = TracedCSX
+    try:
+        model = module.build_model(**kwargs)
+    finally:
+        module.ContinuousStructure = original
+    return model, trace
+
+
+def primitive_edges(csx):
+    """
+    Bounding box edges of all primitives of a model.
+
+    :return: dict axis -> list of (position, label)
+    """
+    edges = {axis: [] for axis in _AXES}
+    for prop in csx.GetAllProperties():
+        if prop.GetTypeString() in mesh_planner.skip_types:
+            continue
+        for n_prim, prim in enumerate(prop.GetAllPrimitives()):
+            label = "{} #{} ({})".format(prop.GetName(), n_prim, type(prim).__name__)
+            start, stop = np.asarray(prim.GetBoundBox(), dtype=float)
+            for n, axis in enumerate(_AXES):
+                edges[axis] += [(start[n], label), (stop[n], label)]
+    return edges
+
+
+def required_lines(csx, lines):
+    """
+    Lines no coarsening may remove: the edges and center of the port along every axis, the
+    axes of wires and cylinders, the origin and the center of the domain.
+
+    :param lines: final mesh lines per axis
+    :return: dict axis -> list of (position, reason)
+    """
+    required = {axis: [(0.0, "origin"), ((l[0] + l[-1]) / 2, "domain center")] for axis, l in zip(_AXES, lines)}
+    for prop in csx.GetAllProperties():
+        port = prop.GetTypeString() in mesh_planner.port_types
+        for prim in prop.GetAllPrimitives():
+            wire = hasattr(prim, "GetWireRadius") or hasattr(prim, "GetRadius")
+            if not (port or wire):
+                continue
+            start, stop = np.sort(np.asarray(prim.GetBoundBox(), dtype=float), axis=0)
+            along = np.argmax(stop - start)
+            for n, axis in enumerate(_AXES):
+                if port:
+                    required[axis] += [(start[n], "port"), ((start[n] + stop[n]) / 2, "port"), (stop[n], "port")]
+                elif n != along:
+                    required[axis].append(((start[n] + stop[n]) / 2, "wire axis"))
+    return required
+
+
+def _sources(x, entries):
+    return sorted({label for pos, label in entries if abs(pos - x) <= tolerance})
+
+
+def _cost(lines, unit):
+    lines = [np.asarray(l, dtype=float) * unit for l in lines]
+    dt = cost_estimator.cfl_timestep(lines)
+    cells = cost_estimator.cell_count(lines)
+    return dt, cells
+
+
+def analyse(csx, trace, n_cells=n_cells, max_res=None, ratio=1.4):
+    """
+    Trace the smallest cells of a model and project the cost without each feature.
+
+    :param csx: model built by `build_traced`
+    :param trace: its `MeshTrace`
+    :param max_res: maximum cell size of the regraded meshes, that of the last
+                    SmoothMeshLines call along every axis by default
+    :return: dict with the timestep `dt` and number of `cells` of the model, per axis the
+             `smallest` cells (lower line, upper line, width, sources of both lines: calls,
+             primitives and why it is required), and per feature the projected `dt`, `cells`
+             and `speedup`; features placing only required lines (`required_lines`) are
+             listed in `required` instead
+    """
+    grid = csx.GetGrid()
+    unit = grid.GetDeltaUnit()
+    lines = [np.asarray(grid.GetLines(axis), dtype=float) for axis in _AXES]
+    dt, cells = _cost(lines, unit)
+    edges = primitive_edges(csx)
+    required = required_lines(csx, lines)
+
+    res = {"dt": dt, "cells": cells, "smallest": {}, "features": {}, "required": []}
+    fixed, sources, features = [], [], set()
+    for n, axis in enumerate(_AXES):
+        smooth = trace.smooth[axis]
+        axis_res = max_res or (smooth[-1][1] if smooth else np.max(np.diff(lines[n])))
+        axis_ratio = smooth[-1][2] if smooth else ratio
+
+        def line_sources(x):
+            placed = _sources(x, trace.added[axis])
+            prims = _sources(x, edges[axis])
+            if not placed:
+                placed = ["smoothing ({})".format(smooth[-1][0]) if smooth else "unknown"]
+            return placed, prims, _sources(x, required[axis])
+
+        widths = np.diff(lines[n])
+        res["smallest"][axis] = []
+        for k in np.argsort(widths, kind="stable")[:n_cells]:
+            lo, hi = lines[n][k], lines[n][k + 1]
+            cell = {"lower": lo, "upper": hi, "width": widths[k], "sources": [line_sources(lo), line_sources(hi)]}
+            res["smallest"][axis].append(cell)
+            for placed, prims, _ in cell["sources"]:
+                features.update(p for p in placed if not p.startswith(("smoothing", "unknown")))
+                features.update(prims)
+
+        # required lines within the final domain, with the calls and primitives behind each
+        lo, hi = lines[n][0] - tolerance, lines[n][-1] + tolerance
+        pos = sorted({round(p, 9) for p, _ in trace.added[axis] if lo <= p <= hi})
+        fixed.append((np.array(pos), axis_res, axis_ratio))
+        sources.append([(set(_sources(p, trace.added[axis])), set(_sources(p, edges[axis])),
+                         bool(_sources(p, required[axis]))) for p in pos])
+
+    def dropped(drop):
+        # per axis, the lines only this call places or on the edges of only this primitive;
+        # the domain keeps its boundaries and the required lines
+        out = []
+        for (pos, _, _), src in zip(fixed, sources):
+            mask = np.array([not req and (placed == {drop} or prims == {drop}) for placed, prims, req in src],
+                            dtype=bool).reshape(len(pos))
+            if len(mask):
+                mask[[0, -1]] = False
+            out.append(mask)
+        return out
+
+    def regraded(drop=None):
+        out = []
+        masks = dropped(drop) if drop is not None else [np.zeros(len(pos), dtype=bool) for pos, _, _ in fixed]
+        for (pos, axis_res, axis_ratio), mask in zip(fixed, masks):
+            p = pos[~mask]
+            out.append(mesh_planner.graded_lines(p, np.full(len(p), axis_res), axis_res, axis_ratio))
+        return _cost(out, unit)
+
+    dt_base, cells_base = regraded()
+    for feature in sorted(features):
+        if not any(mask.any() for mask in dropped(feature)):
+            # all its lines are required, there is nothing to coarsen
+            res["required"].append(feature)
+            continue
+        dt_new, cells_new = regraded(feature)
+        res["features"][feature] = {
+            "dt": dt * dt_new / dt_base,
+            "cells": int(round(cells * cells_new / cells_base)),
+            "speedup": (cells_base / dt_base) / (cells_new / dt_new),
+        }
+    return res
+
+
+def print_report(res):
+    """
+    Print the result of `analyse`.
+    """
+    print("=" * 80)
+    print("timestep {:.4g} s (CFL), {:.3g} cells".format(res["dt"], res["cells"]))
+    for axis, cells in res["smallest"].items():
+        print("")
+        print("{}: smallest cells".format(axis))
+        for cell in cells:
+            print("  {:.4g} between {:.4g} and {:.4g}".format(cell["width"], cell["lower"], cell["upper"]))
+            for x, (placed, prims, reasons) in zip([cell["lower"], cell["upper"]], cell["sources"]):
+                print("    line {:.4g}: {}".format(x, "; ".join(placed)))
+                if prims:
+                    print("      on the edge of {}".format(", ".join(prims)))
+                if reasons:
+                    print("      required: {}".format(", ".join(reasons)))
+    print("")
+    print("projected without the lines of each feature (coarsened or modelled differently):")
+    for feature, r in sorted(res["features"].items(), key=lambda kv: -kv[1]["speedup"]):
+        print("  x{:5.2f}  timestep {:.4g} s, {:.3g} cells: {}".format(r["speedup"], r["dt"], r["cells"], feature))
+    for feature in res["required"]:
+        print("  required (port, wire axis or domain center), not projected: {}".format(feature))
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trace the cells that set the FDTD timestep of yagi_trena.py")
+    parser.add_argument("-n", "--cells", type=int, default=n_cells, help="smallest cells traced per axis")
+    parser.add_argument("--element-model", help="element model of yagi_trena.py (polygon or wire)")
+    args = parser.parse_args()
+
+    import yagi_trena as yagi
+
+    kwargs = dict(record_nf2ff=False)
+    if args.element_model:
+        kwargs["element_model"] = args.element_model
+    (fdtd, csx, feed, nf2ff), trace = build_traced(yagi, **kwargs)
+    print_report(analyse(csx, trace, args.cells, ratio=1.4))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Cost estimate of an openEMS run before starting it
+#
+# From the CSX model and its mesh: number of cells, CFL timestep, expected number of
+# timesteps, engine memory and wall time, plus the memory the NF2FF post-processing needs.
+# The wall time uses the throughput (cells x timesteps per second) measured by earlier runs
+# on this machine, which the scripts record after every simulation; `./cost_estimator.py`
+# measures it with a small benchmark simulation when no run has been recorded yet.
+#
+# Usage:
+#   ./cost_estimator.py          benchmark the engine on this machine
+#   ./cost_estimator.py -n 120   ... with a 120^3 cells benchmark box
+
+import os
+import json
+import math
+import time
+import socket
+import argparse
+import tempfile
+
+import numpy as np
+
+import nf2ff_chunked
+
+C0 = 299792458.0
+
+# throughput and timestep measurements, per host
+calibration_file = os.path.abspath(os.path.join("results", "cost_calibration.json"))
+
+# engine memory per cell: E and H fields plus the four sets of update coefficients, 3
+# float components each, and a margin for the mesh, the boundaries and the probes
+bytes_per_cell = (2 + 4) * 3 * 4
+engine_overhead = 1.1
+
+# used until a run or the benchmark has been recorded on this machine
+default_throughput = 50e6
+
+# simulated timesteps relative to the length of the excitation signal, used until a run of
+# the same model has been recorded
+default_decay_ratio = 10.0
+
+# weight of a new measurement in the running average of the calibration
+calibration_weight = 0.5
+
+
+def mesh_lines(csx):
+    """
+    Mesh lines of a model along x, y and z, in meters.
+    """
+    mesh = csx.GetGrid()
+    unit = mesh.GetDeltaUnit()
+    return [np.asarray(mesh.GetLines(axis), dtype=float) * unit for axis in "xyz"]
+
+
+def cell_count(lines):
+    return int(np.prod([len(l) - 1 for l in lines]))
+
+
+def cfl_timestep(lines):
+    """
+    Largest stable timestep of the Yee scheme on a rectilinear mesh (Courant criterion on
+    the smallest cell).
+
+    :param lines: mesh lines along x, y and z in meters
+    :return: seconds
+    """
+    d = np.array([np.min(np.diff(l)) for l in lines])
+    return 1.0 / (C0 * math.sqrt(np.sum(1.0 / d ** 2)))
+
+
+def excitation_timesteps(fc, dt):
+    """
+    Length of the Gaussian excitation of `SetGaussExcite(f0, fc)` in timesteps.
+    """
+    return int(math.ceil(2 * 9 / (2 * math.pi * fc) / dt))
+
+
+def nf2ff_surface_samples(lines, start, stop, directions=(True,) * 6, opt_resolution=None):
+    """
+    Number of field samples the NF2FF box records on its faces.
+
+    :param lines: mesh lines along x, y and z in drawing units
+    :param start: box corner, drawing units
+    :param stop: opposite box corner, drawing units
+    :param directions: which of the 6 faces (xmin, xmax, ymin, ...) are recorded
+    :param opt_resolution: resolution the dumps are subsampled to, per axis
+    """
+    counts = []
+    for n, l in enumerate(lines):
+        lo, hi = sorted((start[n], stop[n]))
+        k = int(np.count_nonzero((l >= lo) & (l <= hi)))
+        if opt_resolution is not None:
+            k = min(k, int(math.ceil((hi - lo) / opt_resolution[n])) + 1)
+        counts.append(max(k, 1))
+    total = 0
+    for n in range(3):
+        face = counts[(n + 1) % 3] * counts[(n + 2) % 3]
+        total += face * (int(bool(directions[2 * n])) + int(bool(directions[2 * n + 1])))
+    return total
+
+
+def load_calibration():
+    if not os.path.exists(calibration_file):
+        return {}
+    with open(calibration_file) as f:
+        return json.load(f).get(socket.gethostname(), {})
+
+
+def _update_calibration(**values):
+    data = {}
+    if os.path.exists(calibration_file):
+        with open(calibration_file) as f:
+            data = json.load(f)
+    host = data.setdefault(socket.gethostname(), {})
+    for key, value in values.items():
+        # "decay_ratio/<model>" is stored as host["decay_ratio"]["<model>"]
+        node = host
+        *path, leaf = key.split("/")
+        for p in path:
+            node = node.setdefault(p, {})
+        if leaf in node:
+            value = (1 - calibration_weight) * node[leaf] + calibration_weight * value
+        node[leaf] = value
+    os.makedirs(os.path.dirname(calibration_file), exist_ok=True)
+    with open(calibration_file + ".tmp", "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(calibration_file + ".tmp", calibration_file)
+
+
+def simulated_timesteps(sim_path, dt, port_nr=1):
+    """
+    Number of timesteps a finished run simulated, from the time signal of a lumped port.
+    """
+    t = np.loadtxt(os.path.join(sim_path, "port_ut{}".format(port_nr)), comments="%", usecols=0)
+    return int(round(t[-1] / dt))
+
+
+def record_run(name, sim_path, csx, fc, seconds):
+    """
+    Record the throughput and the number of timesteps of a finished run.
+
+    :param name: model name, runs of the same model share their timestep calibration
+    :param sim_path: simulation directory of the run
+    :param csx: the simulated model
+    :param fc: excitation bandwidth given to `SetGaussExcite`
+    :param seconds: wall time of `fdtd.Run`
+    """
+    lines = mesh_lines(csx)
+    dt = cfl_timestep(lines)
+    timesteps = simulated_timesteps(sim_path, dt)
+    _update_calibration(**{
+        "throughput": cell_count(lines) * timesteps / seconds,
+        "decay_ratio/" + name: timesteps / excitation_timesteps(fc, dt),
+    })
+
+
+def estimate(name, csx, fc, nr_ts, nf2ff=None, opt_resolution=None, n_freq=1, n_theta=0, n_phi=0):
+    """
+    Estimate the cost of a run.
+
+    :param name: model name, as passed to `record_run`
+    :param csx: model with its mesh
+    :param fc: excitation bandwidth given to `SetGaussExcite`
+    :param nr_ts: maximum number of timesteps
+    :param nf2ff: NF2FF box of the model, if recorded
+    :param opt_resolution: dump resolution of the NF2FF box, per axis in drawing units
+    :param n_freq: number of frequencies the far-field is calculated for
+    :param n_theta: number of theta angles
+    :param n_phi: number of phi angles
+    :return: dict of estimates
+    """
+    lines = mesh_lines(csx)
+    calibration = load_calibration()
+    cells = cell_count(lines)
+    dt = cfl_timestep(lines)
+    excitation = excitation_timesteps(fc, dt)
+    decay_ratio = calibration.get("decay_ratio", {}).get(name, default_decay_ratio)
+    timesteps = int(min(nr_ts, excitation * decay_ratio))
+    throughput = calibration.get("throughput", default_throughput)
+
+    res = {
+        "cells": cells,
+        "shape": tuple(len(l) for l in lines),
+        "dt": dt,
+        "excitation_timesteps": excitation,
+        "timesteps": timesteps,
+        "engine_bytes": int(cells * bytes_per_cell * engine_overhead),
+        "seconds": cells * timesteps / throughput,
+        "calibrated": "throughput" in calibration,
+    }
+    if nf2ff is not None:
+        unit = csx.GetGrid().GetDeltaUnit()
+        n_surface = nf2ff_surface_samples([l / unit for l in lines], nf2ff.start, nf2ff.stop,
+                                          getattr(nf2ff, "directions", (True,) * 6), opt_resolution)
+        per_freq = nf2ff_chunked.freq_bytes(n_surface, n_theta, n_phi)
+        res["nf2ff_bytes_per_freq"] = per_freq
+        res["nf2ff_bytes"] = per_freq * n_freq
+        res["nf2ff_chunk"] = nf2ff_chunked.chunk_size(per_freq)
+    return res
+
+
+def _size(n):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if n < 1024:
+            return "{:.1f} {}".format(n, unit)
+        n /= 1024
+    return "{:.1f} TiB".format(n)
+
+
+def report(name, csx, fc, nr_ts, nf2ff=None, opt_resolution=None, n_freq=1, n_theta=0, n_phi=0):
+    """
+    Print the estimate of `estimate` (same arguments).
+    """
+    res = estimate(name, csx, fc, nr_ts, nf2ff, opt_resolution, n_freq, n_theta, n_phi)
+    print("=" * 80)
+    print("Dry run of {}".format(name))
+    print("mesh:        {} x {} x {} lines, {:.3g} cells".format(*res["shape"], res["cells"]))
+    print("timestep:    {:.4g} s (CFL), excitation {} timesteps".format(res["dt"], res["excitation_timesteps"]))
+    print("timesteps:   ~{} (max. {})".format(res["timesteps"], int(nr_ts)))
+    print("memory:      ~{} for the engine".format(_size(res["engine_bytes"])))
+    print("wall time:   ~{:.1f} min{}".format(
+        res["seconds"] / 60, "" if res["calibrated"] else " (uncalibrated, run ./cost_estimator.py)"))
+    if nf2ff is not None:
+        print("NF2FF:       {} per frequency, {} for {} frequencies x {} theta x {} phi".format(
+            _size(res["nf2ff_bytes_per_freq"]), _size(res["nf2ff_bytes"]), n_freq, n_theta, n_phi))
+        print("             nf2ff_chunked runs chunks of {} frequencies within {}".format(
+            res["nf2ff_chunk"], _size(nf2ff_chunked.nf2ff_mem_budget)))
+    print("=" * 80)
+    return res
+
+
+def benchmark(n=80, nr_ts=2000, verbose=True):
+    """
+    Measure the engine throughput on this machine with an empty box of n^3 cells and record it.
+
+    :return: cells x timesteps per second
+    """
+    from CSXCAD import ContinuousStructure
+    from openEMS import openEMS
+
+    fdtd = openEMS(NrTS=nr_ts, EndCriteria=0)
+    fdtd.SetGaussExcite(1e9, 0.5e9)
+    fdtd.SetBoundaryCond(["PEC"] * 6)
+    csx = ContinuousStructure()
+    fdtd.SetCSX(csx)
+    mesh = csx.GetGrid()
+    mesh.SetDeltaUnit(1e-3)
+    for axis in "xyz":
+        mesh.SetLines(axis, np.linspace(-n / 2, n / 2, n + 1) * 5)
+    fdtd.AddLumpedPort(1, 50, [-5, -5, -5], [5, 5, 5], "z", 1.0)
+
+    with tempfile.TemporaryDirectory() as sim_path:
+        start = time.time()
+        fdtd.Run(sim_path, verbose=0, cleanup=True)
+        seconds = time.time() - start
+
+    throughput = n ** 3 * nr_ts / seconds
+    _update_calibration(throughput=throughput)
+    if verbose:
+        print("{} cells x {} timesteps in {:.1f} s: {:.1f} MC/s".format(n ** 3, nr_ts, seconds, throughput / 1e6))
+    return throughput
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the openEMS throughput on this machine")
+    parser.add_argument("-n", type=int, default=80, help="cells per side of the benchmark box")
+    parser.add_argument("-t", "--timesteps", type=int, default=2000, help="number of timesteps")
+    args = parser.parse_args()
+
+    benchmark(args.n, args.timesteps)
@@ -2,7 +2,9 @@
 # Adapted from https://gist.github.com/oberstet/f492fe987d5d746cba5b0880e9f33d5b
 
 import os
+import sys
 import math
+import time
 from pprint import pprint, pformat
 
 import numpy as np
@@ -14,6 +16,18 @@ from CSXCAD.CSProperties import CSPropMetal
 from openEMS import openEMS
 from openEMS.physical_constants import C0
 
+import analyze
+import cost_estimator
+import domain
+import early_stop
+import engine_tuner
+import fdtd_cache
+import freq_scaling
+import mesh_planner
+import result_store
+import symmetry
+import vtk_export
+
 # enable NF2FF recording, computation and plotting
 enable_nf2ff = False
 
@@ -23,6 +37,17 @@ enable_show_plots = False
 # fire up AppCSXCAD for viewing the model before running it
 enable_appcsxcad = False
 
+# reuse the results of an identical earlier simulation instead of running it again
+enable_cache = True
+
+# derive the mesh from the primitives of the model (mesh_planner.py) instead of the hand
+# placed lines below
+enable_mesh_planner = False
+
+# only build the model and print the estimated cost of the simulation, also enabled by
+# passing --dry-run
+enable_dry_run = "--dry-run" in sys.argv
+
 # all units are in mm
 unit = 1e-3
 
@@ -42,6 +67,46 @@ f0 = 145.825e6
 # excitation bandwidth
 fc = 0.15 * f0  # +/- ~15% => ~30% BW total < 20% BW max. for center-fed dipole
 
+# reuse a registered run of another band when this model is an electrical scaling of it
+# (freq_scaling.py): an exact scaling is restored from the FDTD cache and evaluated at the
+# scaled frequencies, otherwise the closest run is rescaled as a prediction, the model is
+# simulated and the error of the prediction is reported; needs `enable_cache`
+enable_freq_scaling = False
+
+# the dipole length follows lambda0, but the gap, wire radius, port overlap and mesh
+# resolution are fixed; with `enable_exact_scaling` they take their values at `scaling_f0`
+# scaled to f0, so the models of all bands are exact electrical scalings of each other
+enable_exact_scaling = False
+scaling_f0 = 145.825e6
+length_scale = scaling_f0 / f0 if enable_exact_scaling else 1.0
+
+# FDTD engine settings: maximum number of timesteps, energy decay end criteria and
+# boundary conditions (xmin, xmax, ymin, ymax, zmin, zmax)
+nr_ts = 100000
+end_criteria = 1e-4
+boundary_cond = ["MUR", "MUR", "MUR", "MUR", "MUR", "MUR"]
+
+# stop the simulation as soon as S11 and Zin in `early_stop_band` (Hz) stop changing, and
+# abort diverging runs (early_stop.py)
+enable_early_stop = False
+early_stop_band = (0.98 * f0, 1.02 * f0)
+
+# simulate only a part of the domain bounded by symmetry planes (symmetry.py)
+# the round wire dipole is mirror-symmetric about z=0 (PEC, currents cross it) and
+# about x=0 and y=0 (PMC, currents lie in them), an eighth of the domain is simulated
+enable_symmetry = False
+symmetry_planes = [("z", "PEC"), ("x", "PMC"), ("y", "PMC")]
+sim_planes = symmetry_planes if enable_symmetry else []
+
+# PML boundaries of `pml_cells` cells instead of `boundary_cond`, on a domain sized from the
+# bounding box of the dipole: `domain_clearance` wavelengths (at f0) from the element tips to
+# the boundary, PML included, on every side instead of the `sim_box` cube (domain.py)
+enable_tight_domain = False
+pml_cells = 8
+domain_clearance = 0.25
+if enable_tight_domain:
+    boundary_cond = domain.pml_boundary(pml_cells)
+
 # length factor to apply to reach fixed point of resonance frequency
 # being identical to excitation frequency
 # "Found resonance frequency at 500 MHz with -44 dB at 71 Ohm"
@@ -79,11 +144,11 @@ lambda0 = opt_factor * C0 / f0 / unit
 dipole_length = lambda0 / 2
 
 # gap in between the two dipole arms (the lumped port will fill that)
-dipole_gap = 1.0
+dipole_gap = 1.0 * length_scale
 
 # dipole_wire_radius = 0.001
 # dipole_wire_radius = 1.0
-dipole_wire_radius = 2.0
+dipole_wire_radius = 2.0 * length_scale
 
 # Radiation resistance (ohms) of center-fed half-wave dipole
 # https://en.wikipedia.org/wiki/Radiation_resistance#Radiation_resistance_of_common_antennas
@@ -98,22 +163,26 @@ feed_radius = dipole_wire_radius / math.sqrt(2)
 
 # Overlap of lumped port (dipole feed) with the actual dipole arms excited
 # Note: MUST be non-zero, and actually >>0, not sure ..
-feed_overlap = 0.1
+feed_overlap = 0.1 * length_scale
 # feed_overlap = 0.5
 # feed_overlap = 1.0
 
-max_res = math.floor(C0 / (f0 + fc) / unit / 20)
+max_res = math.floor(C0 / ((f0 + fc) * length_scale) / unit / 20) * length_scale
 sim_box = np.array([1, 1, 1]) * 2.0 * lambda0
 # nf_ff_transition_distance = math.ceil(lambda0 / (2 * math.pi))
 nf_ff_transition_distance = 2 * lambda0
 
+# far-field angles (degrees), the far field is calculated at phi=0 degrees and at phi=90 degrees
+nf2ff_theta = np.arange(-180.0, 180.0, 1.0)
+nf2ff_phi = np.arange(-90, 90, 2)
+
 output_dir = os.path.abspath(os.path.join("results", "dipole"))
 if not os.path.isdir(output_dir):
     os.mkdir(output_dir)
 
-fdtd = openEMS(NrTS=100000, EndCriteria=1e-4)
+fdtd = openEMS(NrTS=nr_ts, EndCriteria=end_criteria)
 fdtd.SetGaussExcite(f0, fc)
-fdtd.SetBoundaryCond(["MUR", "MUR", "MUR", "MUR", "MUR", "MUR"])
+fdtd.SetBoundaryCond(symmetry.boundary(boundary_cond, sim_planes))
 
 csx = ContinuousStructure()
 fdtd.SetCSX(csx)
@@ -122,29 +191,32 @@ mesh.SetDeltaUnit(unit)
 
 # create mesh and geometry for dipole; the dipole is oriented along the Z-axis (!)
 
-# **!: dense mesh in port region
-mesh.AddLine("z", np.linspace(-dipole_gap / 2 - feed_overlap, dipole_gap / 2 + feed_overlap, 5))
-
-# **!: dense mesh around ends of dipole arms
-mesh.AddLine("z",
-             np.linspace(-dipole_length / 2 - 5 * dipole_wire_radius, -dipole_length / 2 + 5 * dipole_wire_radius, 11))
-mesh.AddLine("z",
-             np.linspace(dipole_length / 2 - 5 * dipole_wire_radius, dipole_length / 2 + 5 * dipole_wire_radius, 11))
-# mesh.AddLine("z", [-dipole_gap / 2 - dipole_length / 2, dipole_gap / 2 + dipole_length / 2])
-mesh.AddLine("z", [-sim_box[0] / 2, 0, sim_box[0] / 2])
-mesh.SmoothMeshLines("z", max_res, ratio=1.4)
-
-mesh.AddLine("y", [-sim_box[1] / 2, 0, sim_box[1] / 2])
-mesh.SmoothMeshLines("y", max_res, ratio=1.4)
-
-mesh.AddLine("x", [-sim_box[2] / 2, 0, sim_box[2] / 2])
-mesh.SmoothMeshLines("x", max_res, ratio=1.4)
-
-arm1: CSPropMetal = csx.AddMetal("arm1")
-# port gap is part of the total dipole length (!):
-arm1.AddWire([[0, 0], [0, 0], [-dipole_gap / 2, -dipole_length / 2]], radius=dipole_wire_radius)
-# arm1.AddWire([[0, 0], [0, 0], [-dipole_gap / 2, -dipole_gap / 2 - dipole_length / 2]], radius=dipole_wire_radius)
-arm1.SetColor("#ff0000", 50)
+if not enable_mesh_planner:
+    # **!: dense mesh in port region
+    mesh.AddLine("z", np.linspace(-dipole_gap / 2 - feed_overlap, dipole_gap / 2 + feed_overlap, 5))
+
+    # **!: dense mesh around ends of dipole arms
+    mesh.AddLine("z",
+                 np.linspace(-dipole_length / 2 - 5 * dipole_wire_radius, -dipole_length / 2 + 5 * dipole_wire_radius, 11))
+    mesh.AddLine("z",
+                 np.linspace(dipole_length / 2 - 5 * dipole_wire_radius, dipole_length / 2 + 5 * dipole_wire_radius, 11))
+    # mesh.AddLine("z", [-dipole_gap / 2 - dipole_length / 2, dipole_gap / 2 + dipole_length / 2])
+    mesh.AddLine("z", [-sim_box[0] / 2, 0, sim_box[0] / 2])
+
+    mesh.AddLine("y", [-sim_box[1] / 2, 0, sim_box[1] / 2])
+
+    mesh.AddLine("x", [-sim_box[2] / 2, 0, sim_box[2] / 2])
+    # with a tight domain the lines are smoothed once its boundaries are known (domain.fit_mesh)
+    if not enable_tight_domain:
+        mesh.SmoothMeshLines("all", max_res, ratio=1.4)
+
+# the lower arm is the image of the upper one with a PEC plane at z=0
+if not symmetry.mirrored([0, 0, -dipole_length / 2], [0, 0, -dipole_gap / 2], sim_planes):
+    arm1: CSPropMetal = csx.AddMetal("arm1")
+    # port gap is part of the total dipole length (!):
+    arm1.AddWire([[0, 0], [0, 0], [-dipole_gap / 2, -dipole_length / 2]], radius=dipole_wire_radius)
+    # arm1.AddWire([[0, 0], [0, 0], [-dipole_gap / 2, -dipole_gap / 2 - dipole_length / 2]], radius=dipole_wire_radius)
+    arm1.SetColor("#ff0000", 50)
 
 arm2: CSPropMetal = csx.AddMetal("arm2")
 # port gap is part of the total dipole length (!):
@@ -152,11 +224,13 @@ arm2.AddWire([[0, 0], [0, 0], [dipole_gap / 2, dipole_length / 2]], radius=dipol
 # arm2.AddWire([[0, 0], [0, 0], [dipole_gap / 2, dipole_gap / 2 + dipole_length / 2]], radius=dipole_wire_radius)
 arm2.SetColor("#ff0000", 50)
 
+feed_start, feed_stop = symmetry.clip_box([-feed_radius, -feed_radius, -dipole_gap / 2 - feed_overlap],
+                                          [feed_radius, feed_radius, dipole_gap / 2 + feed_overlap], sim_planes)
 feed = fdtd.AddLumpedPort(
     1,
-    feed_resistance,
-    [-feed_radius, -feed_radius, -dipole_gap / 2 - feed_overlap],
-    [feed_radius, feed_radius, dipole_gap / 2 + feed_overlap],
+    feed_resistance / symmetry.impedance_factor(sim_planes),
+    feed_start,
+    feed_stop,
     "z",
     1.0,
     priority=5,
@@ -179,11 +253,26 @@ if enable_nf2ff:
     # add the NF2FF recording box
     start = [-nf_ff_transition_distance / 2] * 3
     stop = [nf_ff_transition_distance / 2] * 3
-    nf2ff = fdtd.CreateNF2FFBox("nf2ff-box", start=start, stop=stop, opt_resolution=[mesh_res_farfield] * 3)
+    # on the symmetry planes the box is open and mirrored, so the far-field is the one of the full dipole
+    nf2ff = fdtd.CreateNF2FFBox("nf2ff-box", opt_resolution=[mesh_res_farfield] * 3,
+                                **symmetry.nf2ff_args(start, stop, sim_planes))
 
     # smooth out mesh for far-field
     # mesh.SmoothMeshLines("all", mesh_res_farfield, 1.4)
 
+box_start, box_stop = -sim_box / 2, sim_box / 2
+if enable_tight_domain:
+    nf2ff_box = (nf2ff.start, nf2ff.stop) if enable_nf2ff else ()
+    box_start, box_stop = domain.tight_bounds(csx, domain_clearance * C0 / f0 / unit, max_res, pml_cells,
+                                              *nf2ff_box)
+if enable_mesh_planner:
+    mesh_planner.plan(csx, max_res, ratio=1.4,
+                      extra={axis: [box_start[n], 0, box_stop[n]] for n, axis in enumerate("xyz")}, verbose=False)
+elif enable_tight_domain:
+    domain.fit_mesh(mesh, box_start, box_stop, max_res, ratio=1.4)
+symmetry.clip_mesh(mesh, sim_planes)
+mesh_planner.print_size(mesh)
+
 #########################################################################################
 # fire up AppCSXCAD for viewing the model before running it
 #
@@ -192,19 +281,74 @@ csx.Write2XML(output_fn)
 if enable_appcsxcad:
     os.system('{} "{}"'.format(AppCSXCAD_BIN, output_fn))
 
+# frequencies at which the feed port is evaluated
+freq = np.linspace(f0 - fc, f0 + fc, 2001)
+
 #########################################################################################
+# estimate the cost of the simulation, stop here for a dry run
 #
-fdtd.Run(output_dir, verbose=3, cleanup=True)
+if enable_dry_run:
+    # the far-field frequencies depend on the S11 band, so all port frequencies give an upper bound
+    cost_estimator.report("dipole", csx, fc, nr_ts, nf2ff if enable_nf2ff else None,
+                          [mesh_res_farfield] * 3 if enable_nf2ff else None, len(freq),
+                          len(nf2ff_theta), len(nf2ff_phi))
+    sys.exit(0)
+
+#########################################################################################
+#
+start_time = time.time()
+fdtd_settings = dict(f0=f0, fc=fc, NrTS=nr_ts, EndCriteria=end_criteria, boundary=boundary_cond)
+engine_run = engine_tuner.runner(fdtd)
+run = engine_run
+if enable_early_stop:
+    # no decision before the end of the Gaussian excitation
+    Z_ref = feed_resistance / symmetry.impedance_factor(sim_planes)
+    monitor = early_stop.S11Monitor(np.linspace(*early_stop_band, 201), Z_ref, min_time=9 / (math.pi * fc))
+    run = lambda sim_path, verbose: early_stop.run_monitored(fdtd, sim_path, monitor, verbose, run=engine_run)
+    fdtd_settings["early_stop"] = [list(early_stop_band), early_stop.s11_tolerance, early_stop.zin_tolerance,
+                                   early_stop.stable_checks]
+
+# the probes and dumps of a run restored from another band are evaluated at freq / freq_scale
+freq_scale = 1.0
+scaled = None
+if enable_freq_scaling:
+    scaling_sig = freq_scaling.signature(
+        csx, f0,
+        dict(dipole_length=dipole_length, dipole_gap=dipole_gap, dipole_wire_radius=dipole_wire_radius,
+             feed_radius=feed_radius, feed_overlap=feed_overlap, max_res=max_res, sim_box=sim_box[0]),
+        dict(fc=fc / f0, Z_ref=feed_resistance, NrTS=nr_ts, EndCriteria=end_criteria, boundary=boundary_cond,
+             planes=sim_planes, early_stop=enable_early_stop, nf2ff=enable_nf2ff),
+    )
+    scaled = freq_scaling.lookup(scaling_sig, f0)
+if scaled is not None and scaled["exact"] and freq_scaling.restore(scaled, output_dir):
+    print("Exact scaling of the run at {} MHz, skipping simulation".format(round(scaled["f0"] / 1e6, 3)))
+    freq_scale = scaled["scale"]
+    cached = True
+elif enable_cache:
+    cached = fdtd_cache.run_cached(fdtd, output_dir, output_fn, verbose=3, run=run, **fdtd_settings)
+else:
+    run(output_dir, 3)
+    cached = False
+if not cached:
+    cost_estimator.record_run("dipole", output_dir, csx, fc, time.time() - start_time)
 
 # Found resonance frequency at 446.2 MHz with -42.5 dB at 71.1 Ohm
 # Dipole (lambda/2) length is 289.8 mm
-freq = np.linspace(f0 - fc, f0 + fc, 2001)
-feed.CalcPort(output_dir, freq)
+feed.CalcPort(output_dir, freq / freq_scale)
 
-Zin = feed.uf_tot / feed.if_tot
+# impedance and accepted power of the full dipole when only a part of it is simulated
+Zin = feed.uf_tot / feed.if_tot * symmetry.impedance_factor(sim_planes)
+P_acc = feed.P_acc * symmetry.power_factor(sim_planes)
 s11 = feed.uf_ref / feed.uf_inc
 s11_dB = 20.0 * np.log10(np.abs(s11))
 
+if enable_freq_scaling and freq_scale == 1.0:
+    # how well the closest registered run predicted this one
+    if scaled is not None:
+        freq_scaling.print_error(scaled, freq_scaling.prediction_error(scaled, freq, Zin, s11))
+    if enable_cache:
+        freq_scaling.register(scaling_sig, f0, fdtd_cache.cache_key(output_fn, **fdtd_settings), freq, Zin, s11)
+
 # Found resonance frequency at 446.1 MHz with -42.4 dB at 71.0 Ohm
 # Dipole (lambda/2) length is 289.8 mm
 print(s11_dB)
@@ -216,6 +360,16 @@ cutoff_db_resonance = -10.0
 cutoff_dbs = [cutoff_db_resonance, -15.0, -20.0, -25.0, -30.0, -40.0, -50.0]
 cutoff_dbs_results = {}
 
+# everything analyze.py needs to reprocess the results without the engine
+analyze.write_info(output_dir, "Center-fed Lambda/2 Dipole", f0, fc,
+                   feed_resistance / symmetry.impedance_factor(sim_planes), sim_planes,
+                   nf2ff if enable_nf2ff else None, nf_ff_transition_distance, nf2ff_theta, nf2ff_phi, cutoff_dbs,
+                   interest_band=(446.0e6, 446.2e6), freq_scale=freq_scale)
+
+# keep the port and bandwidths in the result store
+result_store.record("Center-fed Lambda/2 Dipole", dict(f0=f0, dipole_length=dipole_length, dipole_gap=dipole_gap,
+                    dipole_wire_radius=dipole_wire_radius), freq, Zin, s11, cutoff_dbs, sim_path=output_dir)
+
 idx = np.where((s11_dB < cutoff_db_resonance) & (s11_dB == np.min(s11_dB)))[0]
 if not len(idx) == 1:
     print("No resonance frequency found for far-field calculation!")
@@ -445,9 +599,8 @@ pyplot.savefig('fig_reflection.svg')
 # compute far-field from recording box and generate plots
 #
 if enable_nf2ff:
-    # Calculate the far field at phi=0 degrees and at phi=90 degrees
-    theta = np.arange(-180.0, 180.0, 1.0)
-    phi = np.arange(-90, 90, 2)
+    theta = nf2ff_theta
+    phi = nf2ff_phi
     print("=" * 80)
     print("\n")
     print("Calculating the 3D far field...")
@@ -509,13 +662,14 @@ if enable_nf2ff:
 
     nf2ff_res = nf2ff.CalcNF2FF(
         sim_path=output_dir,
-        freq=freqs_of_interest,
+        freq=freqs_of_interest / freq_scale,
         theta=theta,
         phi=phi,
         radius=nf2ff_radius,
         read_cached=True,
         verbose=True,
     )
+    nf2ff_res.freq = np.asarray(nf2ff_res.freq) * freq_scale
 
     Dmax_dB = 10 * np.log10(nf2ff_res.Dmax[0])
     E_norm = 20.0 * np.log10(nf2ff_res.E_norm[0] / np.max(nf2ff_res.E_norm[0])) + 10 * np.log10(nf2ff_res.Dmax[0])
@@ -524,7 +678,7 @@ if enable_nf2ff:
     # Display power and directivity
     print("Radiated power: P_rad = {} W".format(nf2ff_res.Prad[0]))
     print("Directivity: D_max = {} dBi".format(Dmax_dB))
-    print("Efficiency: nu_rad = {} %".format(100 * nf2ff_res.Prad[0] / np.interp(f0, freq, feed.P_acc)))
+    print("Efficiency: nu_rad = {} %".format(100 * nf2ff_res.Prad[0] / np.interp(f0, freq, P_acc)))
     print("Theta_HPBW = {} °".format(theta_HPBW))
 
     E_norm = 20.0 * np.log10(nf2ff_res.E_norm[0] / np.max(nf2ff_res.E_norm[0])) + 10 * np.log10(nf2ff_res.Dmax[0])
@@ -555,73 +709,12 @@ if enable_show_plots:
 
 
 #########################################################################################
-#########################################################################################
-
-
-def generatorFunc_DumpFF2VTK(farfield, t, a, filename):
-    """
-    Create `.vtk` file from openEMS far-field dump.
-
-    @see https://github.com/thliebig/openEMS-Project/discussions/151
-
-    :param farfield: 2D array of values of field
-    :param t: theta angles in radians
-    :param a: phi angles in radians
-    :param filename: output file name
-    :return:
-    """
-
-    with open(filename, "w") as outFile:
-        outFile.write(f"# vtk DataFile Version 3.0\n")
-        outFile.write(f"Structured Grid by python-interface of openEMS\n")
-        outFile.write(f"ASCII\n")
-        outFile.write(f"DATASET STRUCTURED_GRID\n")
-
-        outFile.write(f"DIMENSIONS 1 {len(t)} {len(a)}\n")
-        outFile.write(f"POINTS {len(t) * len(a)} double\n")
-
-        for na in range(len(a)):
-            for nt in range(len(t)):
-                val1 = farfield[nt][na] * math.sin(t[nt]) * math.cos(a[na])
-                val2 = farfield[nt][na] * math.sin(t[nt]) * math.sin(a[na])
-                val3 = farfield[nt][na] * math.cos(t[nt])
-                outFile.write(f"{val1} {val2} {val3}\n")
-
-        outFile.write(f"\n\n")
-        outFile.write(f"POINT_DATA {len(t) * len(a)}\n")
-        outFile.write(f"SCALARS gain double 1\n")
-        outFile.write(f"LOOKUP_TABLE default\n")
-        for na in range(len(a)):
-            for nt in range(len(t)):
-                outFile.write(f"{farfield[nt][na]}\n")
-
-
-#########################################################################################
-# dump radiation field to vtk file
+# dump all radiation patterns of the analyzed frequency into one binary VTK file
 #
 if enable_nf2ff:
-    # Dump radiation field to vtk file
-    #
-    # AttributeError: 'nf2ff' object has no attribute 'P_rad'
-    # AttributeError: 'nf2ff' object has no attribute 'Prad'
-    #
-    # directivity = nf2ff.P_rad[0]/nf2ff.Prad*4*pi
-    # directivity = nf2ff.Prad[0] / nf2ff.Prad * 4 * math.pi
-    # directivity_CPRH = np.abs(nf2ff.E_cprh[0]) ** 2 / np.max(nf2ff.E_norm[0][:]) ** 2 * nf2ff.Dmax[0]
-    # directivity_CPLH = np.abs(nf2ff.E_cplh[0]) ** 2 / np.max(nf2ff.E_norm[0][:]) ** 2 * nf2ff.Dmax[0]
-
-    # use E_norm, E_CPRH, E_CPLH defined above ^
-    directivity = E_norm
-    directivity_CPRH = E_CPRH
-    directivity_CPLH = E_CPLH
-
-    generatorFunc_DumpFF2VTK(directivity, nf2ff.theta, nf2ff.phi, os.path.join(output_dir, "3D_Pattern.vtk"))
-    generatorFunc_DumpFF2VTK(directivity_CPRH, nf2ff.theta, nf2ff.phi, os.path.join(output_dir, "3D_Pattern_CPRH.vtk"))
-    generatorFunc_DumpFF2VTK(directivity_CPLH, nf2ff.theta, nf2ff.phi, os.path.join(output_dir, "3D_Pattern_CPLH.vtk"))
-
-    # AttributeError: 'nf2ff' object has no attribute 'Dmax'
-    # E_far_normalized = E_norm / np.max(E_norm) * nf2ff.Dmax[0]
-    E_far_normalized = E_norm / np.max(E_norm) * nf2ff_res.Dmax[0]
-
-    generatorFunc_DumpFF2VTK(E_far_normalized, nf2ff.theta, nf2ff.phi,
-                             os.path.join(output_dir, "3D_Pattern_E_norm.vtk"))
+    vtk_export.write_vts(
+        os.path.join(output_dir, "3D_Pattern.vts"),
+        theta,
+        phi,
+        vtk_export.pattern_arrays(nf2ff_res, [0]),
+    )
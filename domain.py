@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Simulation domain sized from the antenna, with PML boundaries
+#
+# With `MUR` boundaries the domain has to be a generous cube (2 lambda0 wide) for the
+# reflections to stay small. A PML absorbs well much closer to the antenna, so the domain
+# is sized from the bounding box of the antenna instead: a clearance of a fraction of the
+# wavelength at f0 from the element tips on every side, with the PML inside that budget
+# (openEMS places the PML inside the mesh, on the outermost cells), and the NF2FF box kept a
+# few cells clear of the absorber.
+#
+# Usage:
+#   ./domain.py results/yagi_trena other/yagi_trena   compare the S11 of two runs
+
+import argparse
+
+import numpy as np
+
+import analysis
+import port_data
+from mesh_planner import skip_types
+
+# deviation of |S11| (linear) accepted between the tight domain and the reference one,
+# evaluated where the reference S11 is below `compare_below_db`; a difference in dB would be
+# dominated by the depth of the notch, which hardly matters
+s11_tolerance = 0.05
+compare_below_db = -3.0
+
+# cells between the NF2FF box and the PML
+nf2ff_gap_cells = 4
+
+# free cells at least between the antenna and the PML, for a clearance shorter than the PML
+antenna_gap_cells = 4
+
+
+def pml_boundary(cells=8):
+    """
+    Boundary conditions with a PML of `cells` cells on all six sides.
+    """
+    return ["PML_{}".format(cells)] * 6
+
+
+def antenna_bounds(csx, skip_types=skip_types):
+    """
+    Bounding box of all primitives of a model, except for dump and probe boxes.
+
+    :return: arrays start, stop in drawing units
+    """
+    boxes = [np.asarray(prim.GetBoundBox(), dtype=float)
+             for prop in csx.GetAllProperties() if prop.GetTypeString() not in skip_types
+             for prim in prop.GetAllPrimitives()]
+    boxes = np.array(boxes)
+    return np.min(boxes.min(axis=1), axis=0), np.max(boxes.max(axis=1), axis=0)
+
+
+def tight_bounds(csx, clearance, max_res, pml_cells=8, nf2ff_start=None, nf2ff_stop=None):
+    """
+    Extent of a domain just large enough for the antenna and its NF2FF box.
+
+    :param csx: model with all primitives added
+    :param clearance: distance from the antenna to the domain boundary, PML included,
+                      drawing units
+    :param max_res: largest cell size, used for the PML and the gaps
+    :param pml_cells: cells of PML on every side
+    :param nf2ff_start: corner of the NF2FF box, if recorded
+    :param nf2ff_stop: opposite corner of the NF2FF box
+    :return: arrays start, stop in drawing units
+    """
+    pml = pml_cells * max_res
+    start, stop = antenna_bounds(csx)
+    margin = max(clearance, pml + antenna_gap_cells * max_res)
+    start, stop = start - margin, stop + margin
+    if nf2ff_start is not None:
+        box = np.sort([nf2ff_start, nf2ff_stop], axis=0)
+        start = np.minimum(start, box[0] - nf2ff_gap_cells * max_res - pml)
+        stop = np.maximum(stop, box[1] + nf2ff_gap_cells * max_res + pml)
+    return start, stop
+
+
+def fit_mesh(mesh, start, stop, max_res, ratio=1.4):
+    """
+    Restrict the mesh to the box `start`-`stop`, with lines on its boundaries, and smooth it.
+
+    Call it on the required lines only, before any smoothing: the lines graded towards the
+    boundaries of another domain would be kept. Lines closer than max_res / 2 to a boundary
+    are dropped, so that no sliver cell is left next to it.
+    """
+    for n, axis in enumerate("xyz"):
+        lines = [x for x in mesh.GetLines(axis) if start[n] + max_res / 2 <= x <= stop[n] - max_res / 2]
+        mesh.SetLines(axis, [start[n]] + lines + [stop[n]])
+        mesh.SmoothMeshLines(axis, max_res, ratio=ratio)
+
+
+def compare_s11(freq, s11_ref, s11, tolerance=s11_tolerance, below_db=compare_below_db):
+    """
+    Compare the S11 of a run against a reference run.
+
+    :param s11_ref: complex S11 of the reference (e.g. the 2 lambda0 MUR cube)
+    :param s11: complex S11 to check
+    :return: dict with the largest deviation of |S11| where the reference is below
+             `below_db`, the shift of the resonance (Hz) and whether it is within tolerance
+    """
+    ref_dB = 20 * np.log10(np.abs(s11_ref))
+    new_dB = 20 * np.log10(np.abs(s11))
+    band = ref_dB < below_db
+    deviation = float(np.max(np.abs(np.abs(s11) - np.abs(s11_ref))[band])) if band.any() else 0.0
+    shift = analysis.resonance_frequency(freq, new_dB) - analysis.resonance_frequency(freq, ref_dB)
+    return {"max_deviation": deviation, "resonance_shift": shift, "ok": deviation <= tolerance}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the S11 of two simulation directories")
+    parser.add_argument("reference", help="simulation directory of the reference run")
+    parser.add_argument("other", help="simulation directory of the run to check")
+    parser.add_argument("--f0", type=float, default=145.825e6, help="center frequency (Hz)")
+    parser.add_argument("--fc", type=float, default=0.3 * 145.825e6, help="half bandwidth (Hz)")
+    parser.add_argument("-z", "--z-ref", type=float, default=50, help="port resistance of both runs (Ohm)")
+    parser.add_argument("-t", "--tolerance", type=float, default=s11_tolerance, help="accepted |S11| deviation")
+    args = parser.parse_args()
+
+    freq = np.linspace(args.f0 - args.fc, args.f0 + args.fc, 2001)
+    ref = port_data.calc_port(args.reference, freq, args.z_ref)
+    other = port_data.calc_port(args.other, freq, args.z_ref)
+    res = compare_s11(freq, ref.s11, other.s11, args.tolerance)
+    print("|S11| deviation {:.3f} (tolerance {}), resonance shift {:+.1f} kHz: {}".format(
+        res["max_deviation"], args.tolerance, res["resonance_shift"] / 1e3, "OK" if res["ok"] else "FAILED"))
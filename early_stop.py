@@ -0,0 +1,147 @@
+# Stop an openEMS run once S11 in the band of interest has converged
+#
+# `fdtd.Run` only ends at the energy decay `EndCriteria` or after `NrTS` timesteps. Here the
+# engine runs in a child process while the parent periodically transforms the port
+# voltage and current written so far (port_data.py) and compares S11 and Zin over the band
+# of interest with the previous check. Once they stay within the tolerances for
+# `stable_checks` checks in a row, or when the port signal keeps growing long after the
+# excitation (an unstable run, e.g. with MUR boundaries), an `ABORT` file is created in the
+# simulation directory, which makes openEMS stop and write its results as if it had
+# finished.
+
+import os
+import time
+import shutil
+import multiprocessing
+
+import numpy as np
+
+import port_data
+
+# seconds between two checks of the port signals
+check_interval = 20
+
+# largest change of the complex S11 (linear) and relative change of Zin between two
+# checks that counts as converged
+s11_tolerance = 1e-3
+zin_tolerance = 1e-3
+
+# number of consecutive converged checks before stopping
+stable_checks = 2
+
+# the run is considered diverging when the RMS of the port voltage over the last check
+# grew at every one of this many checks and is this many times its lowest value so far
+divergence_checks = 3
+divergence_factor = 10.0
+
+
+class S11Monitor:
+    """
+    Convergence and divergence test on the growing port signals of a running simulation.
+
+    :param freq: frequencies of the band of interest (Hz)
+    :param Z_ref: port resistance
+    :param min_time: simulated time (s) before which no decision is taken, e.g. the length
+                     of the excitation
+    """
+
+    def __init__(self, freq, Z_ref=50, port_nr=1, min_time=0.0, s11_tolerance=s11_tolerance,
+                 zin_tolerance=zin_tolerance, stable_checks=stable_checks):
+        self.freq = np.asarray(freq, dtype=float)
+        self.Z_ref = Z_ref
+        self.port_nr = port_nr
+        self.min_time = min_time
+        self.s11_tolerance = s11_tolerance
+        self.zin_tolerance = zin_tolerance
+        self.stable_checks = stable_checks
+        self.last = None
+        self.stable = 0
+        # RMS of the port voltage per check after `min_time`
+        self.rms = []
+        self.t_checked = 0.0
+
+    def check(self, sim_path):
+        """
+        :return: "converged", "diverged" or None to keep running
+        """
+        t, u = port_data.read_probe(os.path.join(sim_path, "port_ut{}".format(self.port_nr)))
+        if len(t) < 2 or t[-1] <= self.t_checked:
+            return None
+        if not np.all(np.isfinite(u)):
+            return "diverged"
+
+        # RMS of the voltage written since the previous check
+        new = t > self.t_checked
+        self.t_checked = t[-1]
+        if t[-1] < self.min_time:
+            return None
+        self.rms.append(float(np.sqrt(np.mean(u[new] ** 2))))
+
+        rms = self.rms[-divergence_checks - 1:]
+        if (len(rms) > divergence_checks and all(b > a for a, b in zip(rms[:-1], rms[1:]))
+                and rms[-1] > divergence_factor * min(self.rms)):
+            return "diverged"
+
+        p = port_data.calc_port(sim_path, self.freq, self.Z_ref, self.port_nr)
+        current = (p.s11, p.Zin)
+        if self.last is not None:
+            ds11 = np.max(np.abs(p.s11 - self.last[0]))
+            dzin = np.max(np.abs(p.Zin - self.last[1]) / np.abs(p.Zin))
+            # a growing port signal never counts as converged, however stable S11 looks
+            decaying = len(self.rms) < 2 or self.rms[-1] <= self.rms[-2]
+            converged = ds11 < self.s11_tolerance and dzin < self.zin_tolerance and decaying
+            self.stable = self.stable + 1 if converged else 0
+        self.last = current
+        return "converged" if self.stable >= self.stable_checks else None
+
+
+def _run(fdtd, sim_path, verbose, run, kwargs):
+    if run is not None:
+        run(sim_path, verbose)
+    else:
+        fdtd.Run(sim_path, verbose=verbose, cleanup=True, **kwargs)
+
+
+def run_monitored(fdtd, sim_path, monitor, verbose=3, check_interval=check_interval, run=None, **kwargs):
+    """
+    Drop-in replacement of `fdtd.Run(sim_path, verbose=verbose, cleanup=True)` that stops
+    the engine once `monitor` decides so.
+
+    :param fdtd: openEMS instance
+    :param monitor: `S11Monitor` of the port to watch
+    :param check_interval: seconds between two checks
+    :param run: function `run(sim_path, verbose)` starting the engine instead of `fdtd.Run`,
+                e.g. `engine_tuner.runner(fdtd)`
+    :param kwargs: further arguments of `fdtd.Run`
+    :return: "converged" if stopped early, None if the engine ended by itself
+    :raises RuntimeError: if the run diverged or the engine failed
+    """
+    if os.path.isdir(sim_path):
+        shutil.rmtree(sim_path)
+    # fork, so the child gets the model without pickling the openEMS instance
+    proc = multiprocessing.get_context("fork").Process(target=_run, args=(fdtd, sim_path, verbose, run, kwargs))
+    proc.start()
+
+    abort_fn = os.path.join(sim_path, "ABORT")
+    status = None
+    start = time.time()
+    while status is None:
+        proc.join(check_interval)
+        if not proc.is_alive():
+            break
+        status = monitor.check(sim_path)
+
+    if status is not None:
+        print("early stop: {} after {:.0f} s at {:.4g} s simulated time".format(
+            status, time.time() - start, monitor.t_checked))
+        with open(abort_fn, "w"):
+            pass
+    proc.join()
+    if os.path.exists(abort_fn):
+        os.remove(abort_fn)
+
+    if status == "diverged":
+        raise RuntimeError("simulation in {} diverged and was aborted".format(sim_path))
+    if proc.exitcode != 0:
+        raise RuntimeError("simulation in {} failed with exit code {}".format(sim_path, proc.exitcode))
+    return status
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# Engine type and thread count autotuner for openEMS
+#
+# Runs a few hundred timesteps of the actual model with the openEMS command line tool for
+# every engine type and thread count, and then for several jobs running side by side
+# (cores split evenly among them), reading the speed openEMS reports in MCells/s. The
+# results are stored per machine, and `runner` picks the fastest engine and threads for a
+# single run, `split` the jobs x threads split for a batch of runs.
+#
+# Usage:
+#   ./engine_tuner.py                        calibrate on the model of yagi_trena.py
+#   ./engine_tuner.py models/some_fdtd.xml   calibrate on an openEMS FDTD file
+
+import os
+import re
+import json
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+
+# openEMS command line tool
+openems_bin = "openEMS"
+
+# engine types to compare; "multithreaded" is the one used by `fdtd.Run`
+engines = ["multithreaded", "sse-compressed", "sse", "basic"]
+
+# timesteps of every calibration run
+calibration_timesteps = 300
+
+# calibration results, per host
+profile_file = os.path.abspath(os.path.join("results", "engine_profile.json"))
+
+_SPEED = re.compile(r"Speed:\s*([0-9.eE+-]+)\s*MCells/s")
+
+
+def write_calibration_xml(fdtd, fn, timesteps=calibration_timesteps):
+    """
+    Write the FDTD file of a model, limited to `timesteps` timesteps without end criteria.
+    """
+    fdtd.Write2XML(fn)
+    tree = ET.parse(fn)
+    node = tree.getroot().find("FDTD")
+    node.set("NumberOfTimesteps", str(int(timesteps)))
+    node.set("endCriteria", "0")
+    tree.write(fn)
+
+
+def _threads(n):
+    # powers of two up to the number of cores, and the number of cores itself
+    res = [1]
+    while res[-1] * 2 <= n:
+        res.append(res[-1] * 2)
+    return res + [n] if res[-1] != n else res
+
+
+def measure(xml_fn, engine="multithreaded", threads=1, concurrent=1):
+    """
+    Speed of `concurrent` simultaneous runs of an FDTD file.
+
+    :return: list of MCells/s, one per run (0 for a failed run)
+    """
+    dirs = [tempfile.mkdtemp(prefix="engine_tuner-") for _ in range(concurrent)]
+    procs = []
+    for d in dirs:
+        shutil.copy(xml_fn, os.path.join(d, "model.xml"))
+        args = [openems_bin, "model.xml", "--engine={}".format(engine)]
+        if engine == "multithreaded":
+            args.append("--numThreads={}".format(threads))
+        procs.append(subprocess.Popen(args, cwd=d, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True))
+    speeds = []
+    for proc, d in zip(procs, dirs):
+        out = proc.communicate()[0]
+        m = _SPEED.search(out)
+        speeds.append(float(m.group(1)) if proc.returncode == 0 and m else 0.0)
+        shutil.rmtree(d, ignore_errors=True)
+    return speeds
+
+
+def autotune(xml_fn, cores=None, verbose=True):
+    """
+    Measure all engine types and thread counts, then the best engine with the cores split
+    among several jobs, and store the profile of this machine.
+
+    :param xml_fn: FDTD file of the model, see `write_calibration_xml`
+    :param cores: number of cores to use, all of them by default
+    :return: the profile
+    """
+    cores = cores or os.cpu_count()
+    single = []
+    for engine in engines:
+        # only the multithreaded engine takes a number of threads
+        for threads in (_threads(cores) if engine == "multithreaded" else [1]):
+            speed = measure(xml_fn, engine, threads)[0]
+            single.append({"engine": engine, "threads": threads, "mcells": speed})
+            if verbose:
+                print("{:>16} {:>3} threads: {:8.1f} MCells/s".format(engine, threads, speed))
+    best = max(single, key=lambda m: m["mcells"])
+
+    splits = []
+    for jobs in _threads(cores):
+        threads = cores // jobs if best["engine"] == "multithreaded" else 1
+        speeds = measure(xml_fn, best["engine"], threads, concurrent=jobs)
+        splits.append({"jobs": jobs, "threads": threads, "mcells": sum(speeds)})
+        if verbose:
+            print("{:>3} jobs x {:>3} threads: {:8.1f} MCells/s in total".format(jobs, threads, sum(speeds)))
+
+    profile = {"cores": cores, "engine": best["engine"], "threads": best["threads"], "single": single,
+               "splits": splits}
+    data = {}
+    if os.path.exists(profile_file):
+        with open(profile_file) as f:
+            data = json.load(f)
+    data[socket.gethostname()] = profile
+    os.makedirs(os.path.dirname(profile_file), exist_ok=True)
+    with open(profile_file + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(profile_file + ".tmp", profile_file)
+    return profile
+
+
+def load_profile():
+    """
+    Profile of this machine, None if it was not calibrated yet.
+    """
+    if not os.path.exists(profile_file):
+        return None
+    with open(profile_file) as f:
+        return json.load(f).get(socket.gethostname())
+
+
+def split(n_runs=None):
+    """
+    Jobs and threads per job for a batch of runs.
+
+    Without a profile the cores are split evenly among a quarter of them as jobs.
+
+    :param n_runs: number of runs in the batch, no more jobs than that are started
+    :return: tuple (jobs, threads per job)
+    """
+    cores = os.cpu_count()
+    profile = load_profile()
+    if profile is None:
+        jobs = max(1, cores // 4)
+        if n_runs:
+            jobs = min(jobs, n_runs)
+        return jobs, max(1, cores // jobs)
+    splits = [s for s in profile["splits"] if not n_runs or s["jobs"] <= n_runs] or profile["splits"][:1]
+    best = max(splits, key=lambda s: s["mcells"])
+    return best["jobs"], best["threads"]
+
+
+def run(fdtd, sim_path, verbose=3, engine="multithreaded", threads=None):
+    """
+    `fdtd.Run(sim_path, verbose=verbose, cleanup=True)` with the given engine and threads.
+
+    The multithreaded engine runs in this process, the others with the command line tool.
+    """
+    if engine == "multithreaded":
+        kwargs = {"numThreads": threads} if threads else {}
+        fdtd.Run(sim_path, verbose=verbose, cleanup=True, **kwargs)
+        return
+    if os.path.isdir(sim_path):
+        shutil.rmtree(sim_path)
+    os.makedirs(sim_path)
+    fdtd.Write2XML(os.path.join(sim_path, "openEMS.xml"))
+    args = [openems_bin, "openEMS.xml", "--engine={}".format(engine)]
+    if verbose:
+        args.append("-" + "v" * min(int(verbose), 3))
+    subprocess.run(args, cwd=sim_path, check=True)
+
+
+def settings(jobs=1):
+    """
+    Engine and threads per run for `jobs` runs going on at the same time on this machine.
+
+    :return: tuple (engine, threads); threads is None for the openEMS default
+    """
+    profile = load_profile()
+    engine = profile["engine"] if profile else "multithreaded"
+    if jobs <= 1:
+        return engine, profile["threads"] if profile else None
+    threads = max(1, os.cpu_count() // jobs)
+    for s in profile["splits"] if profile else []:
+        if s["jobs"] == jobs:
+            threads = s["threads"]
+    return engine, threads
+
+
+def runner(fdtd, jobs=1):
+    """
+    Function `run(sim_path, verbose)` with the engine and threads of the profile.
+
+    :param jobs: number of runs going on at the same time on this machine
+    """
+    engine, threads = settings(jobs)
+    return lambda sim_path, verbose: run(fdtd, sim_path, verbose, engine, threads)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the openEMS engine on this machine")
+    parser.add_argument("xml", nargs="?", help="openEMS FDTD file, the model of yagi_trena.py by default")
+    parser.add_argument("-c", "--cores", type=int, default=os.cpu_count(), help="number of cores to use")
+    parser.add_argument("-t", "--timesteps", type=int, default=calibration_timesteps, help="timesteps per run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_fn = os.path.join(tmp, "calibration.xml")
+        if args.xml:
+            shutil.copy(args.xml, xml_fn)
+            tree = ET.parse(xml_fn)
+            tree.getroot().find("FDTD").set("NumberOfTimesteps", str(args.timesteps))
+            tree.getroot().find("FDTD").set("endCriteria", "0")
+            tree.write(xml_fn)
+        else:
+            import yagi_trena
+
+            write_calibration_xml(yagi_trena.build_model()[0], xml_fn, args.timesteps)
+        profile = autotune(xml_fn, args.cores)
+    jobs, threads = split()
+    print("best single run: {} engine with {} threads; batches: {} jobs x {} threads".format(
+        profile["engine"], profile["threads"], jobs, threads))
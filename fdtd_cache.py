@@ -0,0 +1,165 @@
+# Content-addressed cache of openEMS simulation directories
+#
+# A run is identified by the SHA-256 of the CSX model written by `csx.Write2XML` (geometry,
+# materials, ports, dump boxes and mesh) together with the engine settings that are not part
+# of that file (excitation, number of timesteps, end criteria and boundary conditions).
+# When an identical run was done before, its files are linked back into the simulation
+# directory and `fdtd.Run` is skipped; `CalcPort` and `CalcNF2FF` work on them unchanged.
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+# where cached simulation directories are kept
+cache_root = os.path.abspath(os.path.join("results", "cache"))
+
+# least recently used entries are evicted once the cache grows beyond this size (bytes)
+cache_max_bytes = 20 * 1024 ** 3
+
+# file inside every entry whose mtime records the last time the entry was used
+_STAMP = ".last_used"
+
+
+def cache_key(model_xml, **settings):
+    """
+    Key of a simulation.
+
+    :param model_xml: path of the model written with `csx.Write2XML`
+    :param settings: engine settings not contained in the model (f0, fc, NrTS, ...)
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    with open(model_xml, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    h.update(json.dumps(settings, sort_keys=True, default=repr).encode())
+    return h.hexdigest()
+
+
+def _dir_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, fn)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def _link_tree(src, dst):
+    """Replicate `src` into `dst`, hard linking files where possible."""
+    def link_or_copy(s, d):
+        try:
+            os.link(s, d)
+        except OSError:
+            shutil.copy2(s, d)
+    shutil.copytree(src, dst, copy_function=link_or_copy, dirs_exist_ok=True, ignore=shutil.ignore_patterns(_STAMP))
+
+
+class FDTDCache:
+    """
+    Size-bounded, least recently used store of simulation directories.
+    """
+
+    def __init__(self, root=cache_root, max_bytes=cache_max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def restore(self, key, sim_path):
+        """
+        Fill `sim_path` with the files of a cached run.
+
+        :return: True on a cache hit, False otherwise
+        """
+        entry = self.path(key)
+        if not os.path.isdir(entry):
+            return False
+        if os.path.isdir(sim_path):
+            shutil.rmtree(sim_path)
+        _link_tree(entry, sim_path)
+        self._touch(entry)
+        return True
+
+    def store(self, key, sim_path):
+        """
+        Add the files of a finished run to the cache and evict old entries if needed.
+        """
+        entry = self.path(key)
+        if os.path.isdir(entry):
+            self._touch(entry)
+            return
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        _link_tree(sim_path, tmp)
+        self._touch(tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in `max_bytes`.
+
+        :param keep: key that must not be evicted (the entry just stored)
+        """
+        entries = []
+        for key in os.listdir(self.root):
+            entry = self.path(key)
+            if key.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                last_used = os.stat(os.path.join(entry, _STAMP)).st_mtime
+            except FileNotFoundError:
+                last_used = 0
+            entries.append((last_used, key, _dir_size(entry)))
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+
+    @staticmethod
+    def _touch(entry):
+        with open(os.path.join(entry, _STAMP), "a"):
+            pass
+        os.utime(os.path.join(entry, _STAMP))
+
+
+def run_cached(fdtd, sim_path, model_xml, cache=None, verbose=3, run=None, **settings):
+    """
+    Drop-in replacement of `fdtd.Run(sim_path, verbose=verbose, cleanup=True)`.
+
+    :param fdtd: openEMS instance, only run on a cache miss
+    :param sim_path: simulation directory
+    :param model_xml: path of the model written with `csx.Write2XML` for this run
+    :param cache: `FDTDCache` instance; a default one is created if None
+    :param run: callable `run(sim_path, verbose)` used instead of `fdtd.Run`; anything that
+                changes its result must be part of `settings`
+    :param settings: engine settings not contained in the model (f0, fc, NrTS, ...)
+    :return: True if the run was restored from the cache
+    """
+    if cache is None:
+        cache = FDTDCache()
+    key = cache_key(model_xml, **settings)
+    if cache.restore(key, sim_path):
+        print("FDTD cache hit {}, skipping simulation".format(key[:12]))
+        return True
+    if run is None:
+        fdtd.Run(sim_path, verbose=verbose, cleanup=True)
+    else:
+        run(sim_path, verbose)
+    cache.store(key, sim_path)
+    return False
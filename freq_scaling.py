@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Reuse of a simulation for an electrically scaled model in another band
+#
+# Maxwell's equations in vacuum and PEC are scale invariant: a model with every length
+# multiplied by 1/s has at s times the frequencies the same Zin, S11 and radiation pattern.
+# The FDTD scheme keeps this as long as the mesh scales along with the geometry, since the
+# timestep follows the cells and the number of timesteps, the end criteria and the Gaussian
+# excitation (fc proportional to f0) are dimensionless in units of the period.
+#
+# Every simulated run is registered below `scaling_root` with its signature: all mesh lines
+# and the geometric lengths of the model in wavelengths at f0, and the dimensionless engine
+# settings. A new model whose signature matches a registered one is an exact scaling: its run
+# is restored from the FDTD cache and evaluated at freq / s (probes and NF2FF dumps alike).
+# When only some lengths differ (e.g. a fixed wire radius or port gap), the rescaled result
+# of the closest run is a prediction; the model is simulated once and the error of the
+# prediction is reported.
+#
+# Usage:
+#   ./freq_scaling.py               list the registered runs and their normalized lengths
+
+import os
+import glob
+import json
+import math
+import hashlib
+import argparse
+
+import numpy as np
+
+import analysis
+import fdtd_cache
+
+C0 = 299792458.0
+
+# where the signatures and port results of the registered runs are kept
+scaling_root = os.path.abspath(os.path.join("results", "scaling"))
+
+# normalized lengths and mesh lines (wavelengths) closer than this are equal
+tolerance = 1e-6
+
+# runs whose normalized lengths differ by more than this factor are no prediction
+max_mismatch = 10.0
+
+
+def signature(csx, f0, lengths, settings):
+    """
+    Electrical signature of a model.
+
+    :param csx: model, with its mesh
+    :param f0: center of the excitation band (Hz)
+    :param lengths: dict name -> geometric length (drawing units) of everything the model
+                    depends on that is not visible in its mesh lines (wire radius, port size, ...)
+    :param settings: dimensionless settings that must be equal (fc / f0, port resistance,
+                     number of timesteps, end criteria, boundaries, symmetry, ...)
+    :return: dict with the normalized `lines` per axis, `lengths` and `settings`
+    """
+    grid = csx.GetGrid()
+    scale = grid.GetDeltaUnit() * f0 / C0
+    return {
+        "lines": {axis: [float(x) * scale for x in grid.GetLines(axis)] for axis in "xyz"},
+        "lengths": {name: float(value) * scale for name, value in lengths.items()},
+        # through JSON, so that tuples and lists compare equal to the registered ones
+        "settings": json.loads(json.dumps(settings, sort_keys=True, default=repr)),
+    }
+
+
+def _entries(root):
+    for fn in sorted(glob.glob(os.path.join(root, "*.json"))):
+        with open(fn) as f:
+            entry = json.load(f)
+        entry["id"] = os.path.splitext(os.path.basename(fn))[0]
+        yield entry
+
+
+def register(sig, f0, cache_key, freq, Zin, s11, root=scaling_root):
+    """
+    Register a simulated run for later reuse.
+
+    :param cache_key: key of the run in the FDTD cache (`fdtd_cache.cache_key`)
+    :param freq: frequencies (Hz) of the port results `Zin` and `s11`
+    :return: id of the entry
+    """
+    os.makedirs(root, exist_ok=True)
+    entry = {"f0": f0, "cache_key": cache_key, "signature": sig}
+    entry_id = hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).hexdigest()[:12]
+    np.savez(os.path.join(root, entry_id + ".npz"), freq=freq, Zin=Zin, s11=s11)
+    with open(os.path.join(root, entry_id + ".json"), "w") as f:
+        json.dump(entry, f)
+    return entry_id
+
+
+def compare(sig, other):
+    """
+    Compare two signatures.
+
+    :return: tuple ``(exact, mismatch, differing)``: exact scaling, largest factor between
+             normalized lengths (inf if the settings or length names differ) and the names
+             of the differing lengths ("mesh" for the mesh lines)
+    """
+    if sig["settings"] != other["settings"] or set(sig["lengths"]) != set(other["lengths"]):
+        return False, math.inf, []
+    differing = [name for name, value in sig["lengths"].items()
+                 if not math.isclose(value, other["lengths"][name], rel_tol=tolerance, abs_tol=tolerance ** 2)]
+    ratios = [sig["lengths"][name] / other["lengths"][name] for name in differing if other["lengths"][name] > 0]
+    mismatch = max([1.0] + [max(r, 1 / r) if r > 0 else math.inf for r in ratios])
+    for axis in "xyz":
+        a, b = np.asarray(sig["lines"][axis]), np.asarray(other["lines"][axis])
+        if len(a) != len(b) or not np.allclose(a, b, rtol=0, atol=tolerance):
+            differing.append("mesh")
+            break
+    return not differing, mismatch, differing
+
+
+def lookup(sig, f0, root=scaling_root):
+    """
+    Registered run the model of signature `sig` at `f0` is a scaling of.
+
+    Exact scalings come first, otherwise the run with the smallest mismatch below
+    `max_mismatch`. Runs at the same f0 are left to the FDTD cache.
+
+    :return: the entry, with its frequency `scale`, `exact`, `mismatch` and `differing`, or
+             None if there is none
+    """
+    best = None
+    for entry in _entries(root):
+        if math.isclose(entry["f0"], f0, rel_tol=1e-12):
+            continue
+        exact, mismatch, differing = compare(sig, entry["signature"])
+        if mismatch > max_mismatch:
+            continue
+        if best is None or (exact, -mismatch) > (best["exact"], -best["mismatch"]):
+            best = dict(entry, scale=f0 / entry["f0"], exact=exact, mismatch=mismatch, differing=differing)
+    return best
+
+
+def restore(entry, sim_path, cache=None):
+    """
+    Fill `sim_path` with the files of the run of an entry from the FDTD cache.
+
+    Its probes and dumps are those of the original band: evaluate them at freq / scale.
+
+    :return: True if the run was still in the cache
+    """
+    cache = cache or fdtd_cache.FDTDCache()
+    return cache.restore(entry["cache_key"], sim_path)
+
+
+def predict(entry, freq, root=scaling_root):
+    """
+    Port results of a registered run rescaled to the frequencies `freq`.
+
+    :return: tuple ``(Zin, s11)`` over `freq`, NaN outside the band of the run
+    """
+    data = np.load(os.path.join(root, entry["id"] + ".npz"))
+    f = np.asarray(freq, dtype=float) / entry["scale"]
+
+    def interp(y):
+        y = np.asarray(y)
+        return (np.interp(f, data["freq"], y.real, left=np.nan, right=np.nan)
+                + 1j * np.interp(f, data["freq"], y.imag, left=np.nan, right=np.nan))
+
+    return interp(data["Zin"]), interp(data["s11"])
+
+
+def prediction_error(entry, freq, Zin, s11, root=scaling_root):
+    """
+    Error of the rescaled prediction of a registered run against a simulated result.
+
+    :return: dict with the predicted and simulated resonance `f_res_pred`, `f_res` (Hz), their
+             relative difference `f_res_error`, the largest `Zin_error` (Ohm) and `s11_error`
+             (dB) over the common band
+    """
+    Zin_pred, s11_pred = predict(entry, freq, root)
+    valid = np.isfinite(Zin_pred)
+    f = np.asarray(freq)[valid]
+    s11_dB = 20.0 * np.log10(np.abs(np.asarray(s11)[valid]))
+    s11_pred_dB = 20.0 * np.log10(np.abs(s11_pred[valid]))
+    f_res, f_res_pred = analysis.resonance_frequency(f, s11_dB), analysis.resonance_frequency(f, s11_pred_dB)
+    return {
+        "f_res": f_res,
+        "f_res_pred": f_res_pred,
+        "f_res_error": f_res_pred / f_res - 1,
+        "Zin_error": float(np.max(np.abs(Zin_pred[valid] - np.asarray(Zin)[valid]))),
+        "s11_error": float(np.max(np.abs(s11_pred_dB - s11_dB))),
+    }
+
+
+def print_error(entry, err):
+    """
+    Print the result of `prediction_error`.
+    """
+    print("=" * 80)
+    print("scaled from the run at {:.3f} MHz (x{:.4f}), differing: {}".format(
+        entry["f0"] / 1e6, entry["scale"], ", ".join(entry["differing"])))
+    print("resonance predicted {:.3f} MHz, simulated {:.3f} MHz ({:+.3%})".format(
+        err["f_res_pred"] / 1e6, err["f_res"] / 1e6, err["f_res_error"]))
+    print("largest error over the band: Zin {:.2f} Ohm, S11 {:.2f} dB".format(err["Zin_error"], err["s11_error"]))
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the runs registered for frequency scaling")
+    parser.add_argument("-r", "--root", default=scaling_root, help="registry directory")
+    args = parser.parse_args()
+
+    for entry in _entries(args.root):
+        lengths = entry["signature"]["lengths"]
+        print("{} {:9.3f} MHz  cache {}  {}".format(
+            entry["id"], entry["f0"] / 1e6, entry["cache_key"][:12],
+            ", ".join("{} {:.4g} lambda".format(name, value) for name, value in sorted(lengths.items()))))
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# Bayesian optimization of the Yagi-Uda geometry of yagi_trena.py
+#
+# A Gaussian-process surrogate is fitted to every metric of the completed runs (resonance
+# frequency, resistance at resonance, maximum directivity and front-to-back ratio). New
+# geometries are proposed in batches by maximizing the expected improvement of the
+# combined cost, estimated by sampling the metric surrogates; the points of a batch are
+# chosen one after the other, each time pretending the previous ones returned the
+# predicted mean ("kriging believer"). Every batch is simulated in parallel through
+# sweep.run_sweep, and all evaluations are kept in `history_file` so a search can be
+# resumed or extended.
+#
+# Usage:
+#   ./gp_optimizer.py                  run `iterations` batches of `batch_size` points
+#   ./gp_optimizer.py -n 4 -b 8 -j 8   4 batches of 8 points on 8 concurrent simulations
+
+import os
+import json
+import math
+import argparse
+
+import numpy as np
+
+import sweep
+import yagi_trena as yagi
+
+# search space (mm): parameter -> (lower, upper)
+bounds = {
+    "director_length": (800, 920),
+    "director_dist": (180, 350),
+    "driven_length": (850, 950),
+    "reflector_length": (900, 1020),
+    "reflector_dist": (220, 400),
+    "hairpin_length": (20, 100),
+    "hairpin_D": (6, 20),
+}
+
+# resolution (mm) the proposed geometries are rounded to
+resolution = 0.1
+
+# scalarized cost of a run: offsets are divided by their scale, so e.g. 1 MHz away from
+# f0 costs as much as 5 Ohm away from the feed resistance or 1 dB less directivity
+resonance_scale = 1e6
+resistance_scale = 5.0
+directivity_scale = 1.0
+fb_scale = 3.0
+# front-to-back ratios above this (dB) are not rewarded any further
+fb_cap = 25.0
+
+# size of the random initial design and of every following batch
+initial_points = 12
+batch_size = max(1, os.cpu_count() // 4)
+
+# number of batches proposed by the surrogate
+iterations = 5
+
+# every evaluation of the search is appended to this file in the sweep output directory
+history_file = "gp_history.json"
+
+# number of random candidates and posterior samples used to maximize the expected improvement
+n_candidates = 4000
+n_samples = 256
+
+# metrics fitted by a surrogate each
+metrics = ["f_res", "r", "Dmax_dB", "fb_dB"]
+
+
+def cost(m, f_target=yagi.f0):
+    """
+    Scalarized cost of the metrics of a run, lower is better.
+
+    :param m: dict with `f_res` (Hz), `r` (Ohm), `Dmax_dB` and `fb_dB`; the values may be
+              arrays (e.g. samples of the surrogates)
+    """
+    return (
+        np.abs(m["f_res"] - f_target) / resonance_scale
+        + np.abs(m["r"] - yagi.feed_resistance) / resistance_scale
+        - m["Dmax_dB"] / directivity_scale
+        - np.minimum(m["fb_dB"], fb_cap) / fb_scale
+    )
+
+
+def _to_unit(points, names):
+    lo, hi = np.array([bounds[n] for n in names], dtype=float).T
+    return (np.array([[p[n] for n in names] for p in points], dtype=float) - lo) / (hi - lo)
+
+
+def _from_unit(x, names):
+    lo, hi = np.array([bounds[n] for n in names], dtype=float).T
+    values = np.round((lo + x * (hi - lo)) / resolution) * resolution
+    return [{n: round(float(v), 3) for n, v in zip(names, row)} for row in values]
+
+
+def latin_hypercube(n, dim, rng):
+    """
+    `n` points in the unit cube with exactly one point in every 1/n slice of each axis.
+    """
+    x = (np.arange(n)[:, None] + rng.random((n, dim))) / n
+    for d in range(dim):
+        x[:, d] = rng.permutation(x[:, d])
+    return x
+
+
+class GaussianProcess:
+    """
+    Gaussian-process regression with a squared-exponential kernel with one length scale per
+    input dimension (ARD).
+
+    The targets are standardized; the length scales and the noise level are chosen by
+    maximizing the log marginal likelihood over random draws.
+    """
+
+    def __init__(self, n_draws=300, rng=None):
+        self.n_draws = n_draws
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    @staticmethod
+    def _kernel(a, b, length):
+        d = (a[:, None, :] - b[None, :, :]) / length
+        return np.exp(-0.5 * np.sum(d * d, axis=-1))
+
+    def _factor(self, x, y, length, noise):
+        K = self._kernel(x, x, length) + (noise + 1e-9) * np.eye(len(x))
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+        lml = -0.5 * y @ alpha - np.sum(np.log(np.diag(L))) - 0.5 * len(x) * math.log(2 * math.pi)
+        return L, alpha, lml
+
+    def fit(self, x, y, optimize=True):
+        """
+        :param x: inputs [n, dim] in the unit cube
+        :param y: targets [n]
+        :param optimize: select the hyperparameters again, else keep the previous ones
+        """
+        self.x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.mean = y.mean()
+        self.scale = y.std() or 1.0
+        self.y = (y - self.mean) / self.scale
+
+        if optimize or not hasattr(self, "length"):
+            dim = self.x.shape[1]
+            draws = [(np.full(dim, 0.3), 1e-3)]
+            draws += [(10 ** self.rng.uniform(-1.3, 0.7, dim), 10 ** self.rng.uniform(-6, -1))
+                      for _ in range(self.n_draws)]
+            best = -np.inf
+            for length, noise in draws:
+                try:
+                    lml = self._factor(self.x, self.y, length, noise)[2]
+                except np.linalg.LinAlgError:
+                    continue
+                if lml > best:
+                    best, self.length, self.noise = lml, length, noise
+
+        self.L, self.alpha, _ = self._factor(self.x, self.y, self.length, self.noise)
+        return self
+
+    def predict(self, x):
+        """
+        :return: posterior mean and standard deviation at the inputs `x` [m, dim]
+        """
+        k = self._kernel(np.asarray(x, dtype=float), self.x, self.length)
+        mu = k @ self.alpha
+        v = np.linalg.solve(self.L, k.T)
+        var = np.maximum(1.0 - np.sum(v * v, axis=0), 1e-12)
+        return self.mean + self.scale * mu, self.scale * np.sqrt(var)
+
+
+def run_metrics(res):
+    """
+    Metrics of a `sweep.run_point` result (run with `record_nf2ff`).
+    """
+    return {
+        "f_res": float(res["f_res"]),
+        "r": float(np.real(res["Zin"])),
+        "Dmax_dB": float(res["Dmax_dB"]),
+        "fb_dB": float(res["fb_dB"]),
+    }
+
+
+def load_history(root=sweep.output_root):
+    fn = os.path.join(root, history_file)
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        return json.load(f)
+
+
+def save_history(history, root=sweep.output_root):
+    os.makedirs(root, exist_ok=True)
+    fn = os.path.join(root, history_file)
+    with open(fn + ".tmp", "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(fn + ".tmp", fn)
+
+
+def propose(history, n, names=list(bounds), f_target=yagi.f0, rng=None):
+    """
+    Propose a batch of geometries by expected improvement of the cost.
+
+    :param history: list of {"params": ..., "metrics": ...} of the completed runs
+    :param n: number of geometries to propose
+    :param names: parameters being optimized
+    :return: list of parameter dicts
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    x = _to_unit([h["params"] for h in history], names)
+    y = {m: np.array([h["metrics"][m] for h in history]) for m in metrics}
+    best = min(cost(h["metrics"], f_target) for h in history)
+    gps = {m: GaussianProcess(rng=rng).fit(x, y[m]) for m in metrics}
+
+    # candidates: uniform over the space and concentrated around the best runs so far
+    order = np.argsort([cost(h["metrics"], f_target) for h in history])
+    local = x[order[:3]][rng.integers(0, min(3, len(x)), n_candidates // 2)]
+    local = np.clip(local + rng.normal(0, 0.05, local.shape), 0, 1)
+    candidates = np.vstack([rng.random((n_candidates - len(local), len(names))), local])
+
+    batch = []
+    z = rng.standard_normal((len(metrics), n_samples))
+    for _ in range(n):
+        pred = {m: gps[m].predict(candidates) for m in metrics}
+        samples = {m: pred[m][0][:, None] + pred[m][1][:, None] * z[i] for i, m in enumerate(metrics)}
+        ei = np.mean(np.maximum(best - cost(samples, f_target), 0), axis=1)
+        i = int(np.argmax(ei))
+        batch.append(candidates[i])
+
+        # kriging believer: pretend the chosen point returned the predicted mean
+        x = np.vstack([x, candidates[i]])
+        for m in metrics:
+            y[m] = np.append(y[m], pred[m][0][i])
+            gps[m].fit(x, y[m], optimize=False)
+        candidates = np.delete(candidates, i, axis=0)
+
+    return _from_unit(np.array(batch), names)
+
+
+def optimize(params=None, names=list(bounds), iterations=iterations, batch_size=batch_size,
+             initial_points=initial_points, f_target=yagi.f0, jobs=sweep.jobs, root=sweep.output_root,
+             seed=None, verbose=True):
+    """
+    Search the geometry minimizing `cost`.
+
+    :param params: fixed `yagi_trena.build_model` arguments, not optimized
+    :param names: parameters to optimize, keys of `bounds`
+    :param iterations: number of batches proposed by the surrogate
+    :param batch_size: geometries simulated in parallel per batch
+    :param initial_points: size of the random initial design (only for a fresh history)
+    :param f_target: target resonance frequency (Hz)
+    :param jobs: number of concurrent simulations
+    :param root: directory holding the run directories and the history
+    :return: tuple (params of the best run, history)
+    """
+    rng = np.random.default_rng(seed)
+    params = dict(params or {})
+    history = load_history(root)
+
+    def evaluate(points):
+        results = sweep.run_sweep([dict(params, **p) for p in points], jobs=jobs, root=root, record_nf2ff=True)
+        for res in results:
+            history.append({"params": res["params"], "metrics": run_metrics(res), "output_dir": res["output_dir"]})
+        save_history(history, root)
+
+    if len(history) < 2:
+        if verbose:
+            print("gp: evaluating an initial design of {} points".format(initial_points))
+        evaluate(_from_unit(latin_hypercube(initial_points, len(names), rng), names))
+
+    for it in range(iterations):
+        batch = propose(history, batch_size, names, f_target, rng)
+        if verbose:
+            print("gp: batch {}/{} of {} points".format(it + 1, iterations, len(batch)))
+        evaluate(batch)
+        best = min(history, key=lambda h: cost(h["metrics"], f_target))
+        if verbose:
+            m = best["metrics"]
+            print("gp: best cost {:.3f} after {} runs: {} MHz, {} Ohm, {} dBi, F/B {} dB".format(
+                cost(m, f_target), len(history), round(m["f_res"] / 1e6, 3), round(m["r"], 1),
+                round(m["Dmax_dB"], 2), round(m["fb_dB"], 1)))
+
+    best = min(history, key=lambda h: cost(h["metrics"], f_target))
+    if verbose:
+        print("gp: best geometry {} in {}".format(best["params"], os.path.relpath(best["output_dir"])))
+    return best["params"], history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bayesian optimization of the yagi_trena.py geometry")
+    parser.add_argument("-n", "--iterations", type=int, default=iterations, help="number of proposed batches")
+    parser.add_argument("-b", "--batch-size", type=int, default=batch_size, help="geometries per batch")
+    parser.add_argument("-i", "--initial-points", type=int, default=initial_points, help="size of the initial design")
+    parser.add_argument("-j", "--jobs", type=int, default=sweep.jobs, help="number of concurrent simulations")
+    parser.add_argument("-f", "--freq", type=float, default=yagi.f0, help="target resonance frequency (Hz)")
+    parser.add_argument("-o", "--output", default=sweep.output_root, help="directory for the runs and the history")
+    parser.add_argument("-s", "--seed", type=int, help="random seed")
+    args = parser.parse_args()
+
+    optimize(iterations=args.iterations, batch_size=args.batch_size, initial_points=args.initial_points,
+             f_target=args.freq, jobs=args.jobs, root=args.output, seed=args.seed)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Hairpin match as a shunt stub applied to the feed impedance
+#
+# The hairpin of yagi_trena.py is a two-wire line of `hairpin_length`, wire spacing
+# `hairpin_D` and wire diameter `hairpin_wire_diameter`, shorted at its far end by a third
+# wire and connected across the driven element next to the feed. As a transmission line of
+# characteristic impedance Z0 = (eta0 / pi) acosh(D / d), shorted by the inductance of the
+# bar, it is an inductive stub in parallel with the impedance of the bare antenna. Applied
+# to the Zin of one run without the hairpin, any hairpin length is evaluated instantly; the
+# short pieces of the driven element between the feed and the hairpin taps are neglected.
+#
+# Usage:
+#   ./hairpin.py results/yagi_trena                  S11 and Zin at f0 for `default_lengths`
+#   ./hairpin.py results/yagi_trena -l 40 50 58 68   ... for these lengths (mm)
+
+import math
+import argparse
+
+import numpy as np
+
+import analysis
+
+C0 = 299792458.0
+MUE0 = 4e-7 * math.pi
+ETA0 = MUE0 * C0
+
+# the hairpin is air-spaced bare wire
+velocity_factor = 1.0
+
+# lengths (mm) evaluated by the command line
+default_lengths = np.arange(20.0, 101.0, 5.0)
+
+
+def line_impedance(D, d):
+    """
+    Characteristic impedance of a two-wire line.
+
+    :param D: center-to-center spacing of the wires
+    :param d: wire diameter (same unit as D)
+    """
+    return ETA0 / math.pi * math.acosh(D / d)
+
+
+def bar_inductance(D, d, unit=1e-3):
+    """
+    Inductance (H) of the shorting bar, a straight wire of length D and diameter d.
+    """
+    return MUE0 * D * unit / (2 * math.pi) * (math.log(4 * D / d) - 1)
+
+
+def stub_impedance(freq, length, D, d, unit=1e-3):
+    """
+    Input impedance of the hairpin, a two-wire line shorted by its bar.
+
+    :param freq: frequencies (Hz)
+    :param length: length of the hairpin
+    :param D: wire spacing
+    :param d: wire diameter
+    :param unit: drawing unit of `length`, `D` and `d` (m)
+    """
+    freq = np.asarray(freq, dtype=float)
+    Z0 = line_impedance(D, d)
+    ZL = 2j * math.pi * freq * bar_inductance(D, d, unit)
+    t = np.tan(2 * math.pi * freq * length * unit / (velocity_factor * C0))
+    return Z0 * (ZL + 1j * Z0 * t) / (Z0 + 1j * ZL * t)
+
+
+def apply(freq, Zin, length, D, d, unit=1e-3):
+    """
+    Feed impedance of the antenna with the hairpin in parallel.
+
+    :param Zin: feed impedance of the antenna without the hairpin over `freq`
+    """
+    Zs = stub_impedance(freq, length, D, d, unit)
+    return Zin * Zs / (Zin + Zs)
+
+
+def reflection(Zin, Z_ref):
+    """
+    Reflection coefficient of an impedance against a reference resistance.
+    """
+    return (Zin - Z_ref) / (Zin + Z_ref)
+
+
+def length_sweep(freq, Zin, lengths, D, d, Z_ref, f_target, unit=1e-3):
+    """
+    Evaluate many hairpin lengths at once.
+
+    :return: dict with arrays over `lengths`: resonance `f_res` (S11 minimum), `s11_dB`
+             and `Zin` at `f_target`
+    """
+    freq = np.asarray(freq, dtype=float)
+    Z = np.array([apply(freq, Zin, l, D, d, unit) for l in lengths])
+    s11_dB = 20 * np.log10(np.abs(reflection(Z, Z_ref)))
+    at = np.argmin(np.abs(freq - f_target))
+    return {
+        "f_res": np.array([analysis.resonance_frequency(freq, s) for s in s11_dB]),
+        "s11_dB": s11_dB[:, at],
+        "Zin": Z[:, at],
+    }
+
+
+if __name__ == "__main__":
+    import analyze
+    import matching
+    import symmetry
+
+    parser = argparse.ArgumentParser(description="Hairpin lengths applied to a run without the hairpin")
+    parser.add_argument("sim_path", help="result directory of a run without the hairpin, with a " + analyze.info_file)
+    parser.add_argument("-l", "--lengths", type=float, nargs="+", default=default_lengths, help="hairpin lengths (mm)")
+    parser.add_argument("-D", type=float, help="wire spacing (mm), that of the run by default")
+    parser.add_argument("-d", type=float, help="wire diameter (mm), that of the run by default")
+    parser.add_argument("-f", "--freq", type=float, help="target frequency (Hz), f0 of the run by default")
+    parser.add_argument("-z", "--z-ref", type=float, help="reference resistance (Ohm), that of the run by default")
+    args = parser.parse_args()
+
+    freq, Zin, info = matching.load_feed(args.sim_path)
+    wires = info.get("hairpin") or {}
+    D, d = args.D or wires.get("D"), args.d or wires.get("d")
+    if D is None or d is None:
+        parser.error("the run has no hairpin settings, pass -D and -d")
+    factor = symmetry.impedance_factor(info["planes"])
+    Z_ref = args.z_ref or info["Z_ref"] * factor
+    f_target = args.freq or info["f0"]
+
+    print("Z0 = {:.1f} Ohm".format(line_impedance(D, d)))
+    res = length_sweep(freq, Zin, args.lengths, D, d, Z_ref, f_target)
+    for l, f_res, s11_dB, Z in zip(args.lengths, res["f_res"], res["s11_dB"], res["Zin"]):
+        print("{:6.1f} mm: resonance at {:.3f} MHz, at {:.3f} MHz {:.1f} dB, {:.1f}{:+.1f}j Ohm".format(
+            l, f_res / 1e6, f_target / 1e6, s11_dB, Z.real, Z.imag))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# Reference impedance and matching networks applied to the feed impedance of one run
+#
+# The port resistance of a simulation (`feed_resistance`) only sets the reference of the S11
+# written by the scripts; the feed impedance Zin(f) does not depend on it. From the Zin of
+# one result directory this script computes S11 and VSWR against any reference, the
+# frequency response of matching networks built from series and shunt elements (inductors,
+# capacitors and the hairpin stub of hairpin.py, cascaded as ABCD matrices), and solves for
+# the L-network values and the hairpin length matching `Z_match` at the target frequency,
+# instead of changing `hairpin_length` and running the simulation again.
+#
+# Usage:
+#   ./matching.py results/yagi_trena               match to 50 Ohm at f0 of the run
+#   ./matching.py results/dipole -z 50 70.8 75     S11 and VSWR against these references
+#   ./matching.py results/yagi_trena -f 145.825e6 -D 10 -d 2.26
+
+import math
+import argparse
+
+import numpy as np
+
+import analysis
+import hairpin
+
+# impedance of the transceiver the antenna is matched to (Ohm)
+Z_match = 50.0
+
+# S11 threshold (dB) of the bandwidth of the matched antenna
+match_cutoff_db = -10.0
+
+
+def vswr(s11):
+    """
+    Voltage standing wave ratio of a reflection coefficient.
+    """
+    m = np.abs(s11)
+    with np.errstate(divide="ignore"):
+        return (1 + m) / (1 - m)
+
+
+def element_impedance(freq, kind, value):
+    """
+    Impedance of a matching element.
+
+    :param kind: "L" (value in H), "C" (value in F) or "hairpin" (value is the tuple
+                 ``(length, D, d)`` in mm, see `hairpin.stub_impedance`)
+    """
+    w = 2 * math.pi * np.asarray(freq, dtype=float)
+    if kind == "L":
+        return 1j * w * value
+    if kind == "C":
+        return 1 / (1j * w * value)
+    if kind == "hairpin":
+        return hairpin.stub_impedance(freq, *value)
+    raise ValueError("unknown matching element {!r}".format(kind))
+
+
+def abcd(freq, elements):
+    """
+    ABCD matrix of a ladder of elements.
+
+    :param elements: list of ``(connection, kind, value)`` from the transceiver to the
+                     antenna, `connection` being "series" or "shunt", see `element_impedance`
+    :return: array of shape (len(freq), 2, 2)
+    """
+    freq = np.atleast_1d(np.asarray(freq, dtype=float))
+    m = np.broadcast_to(np.eye(2, dtype=complex), (len(freq), 2, 2))
+    for connection, kind, value in elements:
+        Z = np.broadcast_to(element_impedance(freq, kind, value), freq.shape)
+        e = np.zeros((len(freq), 2, 2), dtype=complex)
+        e[:, 0, 0] = e[:, 1, 1] = 1
+        if connection == "series":
+            e[:, 0, 1] = Z
+        elif connection == "shunt":
+            e[:, 1, 0] = 1 / Z
+        else:
+            raise ValueError("unknown connection {!r}".format(connection))
+        m = m @ e
+    return m
+
+
+def response(freq, Zin, elements):
+    """
+    Impedance seen by the transceiver through a matching network.
+
+    :param Zin: feed impedance of the antenna over `freq`
+    :param elements: matching network, see `abcd`
+    """
+    m = abcd(freq, elements)
+    return (m[:, 0, 0] * Zin + m[:, 0, 1]) / (m[:, 1, 0] * Zin + m[:, 1, 1])
+
+
+def _reactance(f, X, connection):
+    # element of reactance X (series) or susceptance X (shunt) at f
+    w = 2 * math.pi * f
+    if X == 0:
+        return None
+    if connection == "series":
+        return ("series", "L", X / w) if X > 0 else ("series", "C", -1 / (w * X))
+    return ("shunt", "C", X / w) if X > 0 else ("shunt", "L", -1 / (w * X))
+
+
+def l_network(f, Z_load, Z_ref=Z_match):
+    """
+    Lossless L-networks matching a load to a reference resistance at one frequency.
+
+    With the load resistance above the reference the shunt element sits at the antenna,
+    otherwise the series element does.
+
+    :param Z_load: feed impedance of the antenna at `f`
+    :return: list of the (up to two) solutions, each a list of elements for `response`
+    """
+    R, X = Z_load.real, Z_load.imag
+    solutions = []
+    if R > Z_ref:
+        root = math.sqrt(R / Z_ref) * math.sqrt(R ** 2 + X ** 2 - Z_ref * R)
+        for sign in (1, -1):
+            B = (X + sign * root) / (R ** 2 + X ** 2)
+            Xs = 1 / B + X * Z_ref / R - Z_ref / (B * R)
+            solutions.append([_reactance(f, Xs, "series"), _reactance(f, B, "shunt")])
+    else:
+        for sign in ((1, -1) if R < Z_ref else (1,)):
+            Xs = sign * math.sqrt(R * (Z_ref - R)) - X
+            B = sign * math.sqrt((Z_ref - R) / R) / Z_ref
+            solutions.append([_reactance(f, B, "shunt"), _reactance(f, Xs, "series")])
+    # a vanishing element is left out
+    return [[e for e in s if e is not None] for s in solutions]
+
+
+def solve_hairpin(f, Z_load, D, d, unit=1e-3):
+    """
+    Hairpin length cancelling the susceptance of the antenna at one frequency.
+
+    A shunt stub only changes the susceptance, so the matched resistance is 1 / Re(1 / Z_load);
+    it is the reference `Z_ref` when the reactance of the antenna is
+    ``-sqrt(R (Z_ref - R))`` (see `hairpin_reactance`), set by shortening the driven element.
+
+    :param Z_load: feed impedance of the antenna without the hairpin at `f`
+    :return: hairpin length (same unit as D and d)
+    """
+    Y = 1 / Z_load
+    if Y.imag <= 0:
+        raise ValueError("the antenna is inductive at {:.3f} MHz, a hairpin cannot cancel it".format(f / 1e6))
+    # reactance of the stub, Z0 (ZL + j Z0 t) / (Z0 + j ZL t) = j X, solved for t = tan(beta l)
+    Xs = 1 / Y.imag
+    Z0 = hairpin.line_impedance(D, d)
+    XL = 2 * math.pi * f * hairpin.bar_inductance(D, d, unit)
+    t = (Xs - XL) / (Z0 + Xs * XL / Z0)
+    return (math.atan(t) % math.pi) * hairpin.velocity_factor * hairpin.C0 / (2 * math.pi * f) / unit
+
+
+def hairpin_reactance(R, Z_ref=Z_match):
+    """
+    Reactance the antenna of resistance R needs for a hairpin to match it to `Z_ref`.
+    """
+    return -math.sqrt(R * (Z_ref - R)) if R < Z_ref else float("nan")
+
+
+def bandwidth(freq, s11, cutoff_db=match_cutoff_db):
+    """
+    Width (Hz) of the band around the S11 minimum below `cutoff_db`, 0 if it is never reached.
+    """
+    with np.errstate(divide="ignore"):
+        s11_dB = 20 * np.log10(np.abs(s11))
+    idx = analysis.resonance_index(s11_dB)
+    if s11_dB[idx] >= cutoff_db:
+        return 0.0
+    lower, upper = analysis.band_edges(s11_dB, idx, [cutoff_db])
+    return float(freq[upper[0]] - freq[lower[0]])
+
+
+def load_feed(sim_path):
+    """
+    Feed impedance of the full antenna from the probes of a result directory.
+
+    :return: tuple ``(freq, Zin, info)``, with the `sim_info.json` of the run; a hairpin left
+             out of the model (hairpin.py) is not applied
+    """
+    import analyze
+    import port_data
+    import symmetry
+
+    info = analyze.load_info(sim_path)
+    freq = np.linspace(info["f0"] - info["fc"], info["f0"] + info["fc"], analyze.n_freq)
+    Zin = port_data.calc_port(sim_path, freq, info["Z_ref"]).Zin * symmetry.impedance_factor(info["planes"])
+    return freq, Zin, info
+
+
+def _print_network(name, freq, Z, at, elements=()):
+    s11 = hairpin.reflection(Z, Z_match)
+    with np.errstate(divide="ignore"):
+        s11_dB = 20 * np.log10(np.abs(s11[at]))
+    print("{}: {:.1f}{:+.1f}j Ohm, S11 {:.1f} dB, VSWR {:.2f}, {:g} dB bandwidth {:.3f} MHz".format(
+        name, Z[at].real, Z[at].imag, s11_dB, vswr(s11[at]), match_cutoff_db,
+        bandwidth(freq, s11) / 1e6))
+    for connection, kind, value in elements:
+        unit, scale = {"L": ("nH", 1e9), "C": ("pF", 1e12), "hairpin": ("mm", 1)}[kind]
+        value = value[0] if kind == "hairpin" else value
+        print("    {:6s} {:7s} {:.4g} {}".format(connection, kind, value * scale, unit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="S11 against any reference and matching networks of a run")
+    parser.add_argument("sim_path", help="result directory with a sim_info.json")
+    parser.add_argument("-f", "--freq", type=float, help="target frequency (Hz), f0 of the run by default")
+    parser.add_argument("-z", "--z-ref", type=float, nargs="+", default=[Z_match], help="reference impedances (Ohm)")
+    parser.add_argument("-D", type=float, help="hairpin wire spacing (mm), that of the run by default")
+    parser.add_argument("-d", type=float, help="hairpin wire diameter (mm), that of the run by default")
+    args = parser.parse_args()
+
+    freq, Zin_bare, info = load_feed(args.sim_path)
+    stub = info.get("hairpin")
+    Zin = hairpin.apply(freq, Zin_bare, **stub) if stub else Zin_bare
+    f = args.freq or info["f0"]
+    at = np.argmin(np.abs(freq - f))
+
+    print("=" * 80)
+    print("Zin at {:.3f} MHz: {:.1f}{:+.1f}j Ohm".format(freq[at] / 1e6, Zin[at].real, Zin[at].imag))
+    for Z_ref in args.z_ref:
+        s11 = hairpin.reflection(Zin, Z_ref)
+        print("  {:6.1f} Ohm: S11 {:.1f} dB, VSWR {:.2f}, {:g} dB bandwidth {:.3f} MHz".format(
+            Z_ref, 20 * np.log10(np.abs(s11[at])), vswr(s11[at]), match_cutoff_db, bandwidth(freq, s11) / 1e6))
+
+    print("")
+    print("matched to {:g} Ohm at {:.3f} MHz".format(Z_match, freq[at] / 1e6))
+    _print_network("unmatched", freq, Zin, at)
+    for n, elements in enumerate(l_network(freq[at], Zin[at], Z_match)):
+        _print_network("L-network {}".format(n + 1), freq, response(freq, Zin, elements), at, elements)
+
+    wires = stub or {}
+    D, d = args.D or wires.get("D"), args.d or wires.get("d")
+    if D is None or d is None:
+        print("hairpin: the run has no hairpin applied afterwards, pass -D and -d for a run without one")
+    else:
+        try:
+            length = solve_hairpin(freq[at], Zin_bare[at], D, d)
+            elements = [("shunt", "hairpin", (length, D, d))]
+            _print_network("hairpin", freq, response(freq, Zin_bare, elements), at, elements)
+            R = Zin_bare[at].real
+            if R < Z_match:
+                print("    the hairpin matches {:g} Ohm with the antenna at {:.1f}{:+.1f}j Ohm".format(
+                    Z_match, R, hairpin_reactance(R, Z_match)))
+        except ValueError as e:
+            print("hairpin: {}".format(e))
+    print("=" * 80)
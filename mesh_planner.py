@@ -0,0 +1,238 @@
+# Automatic FDTD mesh from the geometry of a CSXCAD model
+#
+# Instead of placing mesh lines by hand around the feed, the element ends, the hairpin and
+# the boom, the planner collects the required lines from the bounding boxes of all
+# primitives, merges lines closer than a tolerance and fills the gaps with the fewest
+# lines that respect the maximum resolution and the maximum ratio between neighbouring
+# cells: the cell size grows geometrically away from every required line (linearly with
+# the distance) until it reaches the maximum resolution. Every primitive gets a line on
+# each of its edges, or one through its center if it is thinner than a cell, so no
+# primitive ends up unused. Lumped ports and the gaps between metal primitives (the feed
+# gap of a dipole) are never collapsed or merged away: their edges are kept distinct and
+# get at least `min_port_cells` / `min_gap_cells` cells across. A port edge closer than
+# `edge_res` to a metal or gap edge is snapped onto it, so that the overlap of the port into
+# the wire does not become the smallest cell.
+
+import numpy as np
+
+_AXES = "xyz"
+
+# property types that only record fields and do not need mesh lines of their own
+skip_types = ("DumpBox", "ProbeBox")
+
+# property types of the lumped ports and their excitation boxes
+port_types = ("LumpedElement", "Excitation")
+
+# property types whose primitives are conductors, the gaps between them must stay open
+metal_types = ("Metal", "ConductingSheet")
+
+# minimum number of cells along a lumped port (its excitation direction); across it the
+# port is a current filament and may be a single line
+min_port_cells = 3
+
+# minimum number of cells across a gap between two metal primitives
+min_gap_cells = 2
+
+
+def grid_size(mesh):
+    """
+    Number of mesh lines along x, y and z.
+    """
+    return tuple(len(mesh.GetLines(axis)) for axis in _AXES)
+
+
+def print_size(mesh, label="mesh"):
+    """
+    Print the mesh size as Nx x Ny x Nz and the total number of cells.
+    """
+    n = grid_size(mesh)
+    print("{}: {} x {} x {} lines, {:.3g} cells".format(label, n[0], n[1], n[2], np.prod([k - 1 for k in n])))
+
+
+def _overlap(a_lo, a_hi, b_lo, b_hi, axes):
+    # boxes overlapping (or touching) along all `axes`
+    return all(a_lo[k] <= b_hi[k] and b_lo[k] <= a_hi[k] for k in axes)
+
+
+def gap_lines(boxes):
+    """
+    Edges of the gaps between metal primitives.
+
+    Two boxes leave a gap along an axis when they are separated along it and overlap along
+    the two others, e.g. the two arms of a dipole on either side of the feed.
+
+    :param boxes: list of (lower corner, upper corner) arrays
+    :return: dict axis -> list of (position, cell size, True) tuples, the cell size fitting
+             `min_gap_cells` cells into the gap
+    """
+    lines = {axis: [] for axis in _AXES}
+    for i, (a_lo, a_hi) in enumerate(boxes):
+        for b_lo, b_hi in boxes[i + 1:]:
+            for n, axis in enumerate(_AXES):
+                others = [k for k in range(3) if k != n]
+                if not _overlap(a_lo, a_hi, b_lo, b_hi, others):
+                    continue
+                lo, hi = (a_hi[n], b_lo[n]) if a_hi[n] < b_lo[n] else (b_hi[n], a_lo[n])
+                if hi > lo:
+                    lines[axis] += [(lo, (hi - lo) / min_gap_cells, True), (hi, (hi - lo) / min_gap_cells, True)]
+    return lines
+
+
+def port_direction(prop):
+    """
+    Excitation direction (0, 1 or 2) of a lumped port property, None if it has none.
+    """
+    if hasattr(prop, "GetDirection"):
+        return int(prop.GetDirection())
+    if hasattr(prop, "GetExcitation"):
+        return int(np.argmax(np.abs(prop.GetExcitation())))
+    return None
+
+
+def _snap(ports, edges, tol):
+    # move every port edge onto the closest metal or gap edge within tol
+    snapped = []
+    for x, res, keep in ports:
+        near = [e for e in edges if abs(e - x) < tol]
+        snapped.append((min(near, key=lambda e: abs(e - x)) if near else x, res, keep))
+    return snapped
+
+
+def primitive_lines(csx, edge_res, thin=None, skip_types=skip_types):
+    """
+    Lines required by the primitives of a model.
+
+    :param csx: ContinuousStructure with all primitives added
+    :param edge_res: cell size wanted at the edges of the primitives
+    :param thin: primitives thinner than this along an axis get a single line through
+                 their center, half of `edge_res` by default; lumped ports only across
+                 their excitation direction (`port_direction`)
+    :param skip_types: property types (`GetTypeString`) to ignore
+    :return: dict axis -> list of (position, cell size, keep) tuples, `keep` marking the
+             edges of ports and gaps that must not be merged with other lines
+    """
+    if thin is None:
+        thin = edge_res / 2
+    lines = {axis: [] for axis in _AXES}
+    ports = {axis: [] for axis in _AXES}
+    metal = []
+    for prop in csx.GetAllProperties():
+        kind = prop.GetTypeString()
+        if kind in skip_types:
+            continue
+        direction = port_direction(prop) if kind in port_types else None
+        for prim in prop.GetAllPrimitives():
+            start, stop = np.asarray(prim.GetBoundBox(), dtype=float)
+            lo_box, hi_box = np.minimum(start, stop), np.maximum(start, stop)
+            if kind in metal_types:
+                metal.append((lo_box, hi_box))
+            for n, axis in enumerate(_AXES):
+                lo, hi = lo_box[n], hi_box[n]
+                if n == direction:
+                    res = min(edge_res, (hi - lo) / min_port_cells)
+                    ports[axis] += [(lo, res, True), (hi, res, True)]
+                elif hi - lo < thin:
+                    lines[axis].append(((lo + hi) / 2, edge_res, False))
+                else:
+                    lines[axis] += [(lo, edge_res, False), (hi, edge_res, False)]
+    for n, (axis, gaps) in enumerate(gap_lines(metal).items()):
+        edges = [x for x, _, _ in gaps] + [box[k][n] for box in metal for k in (0, 1)]
+        lines[axis] += gaps + _snap(ports[axis], edges, edge_res)
+    return lines
+
+
+def merge_lines(lines, tol):
+    """
+    Merge lines closer than `tol` into their mean, keeping the smallest cell size.
+
+    Lines farther apart than half the cell size wanted at either of them are not merged, so
+    that a small gap (e.g. the feed gap) keeps the lines inside it.
+
+    Lines marked `keep` (edges of ports and gaps) are never moved: other lines merge into
+    them, and two of them at different positions are never merged.
+
+    :param lines: list of (position, cell size) or (position, cell size, keep) tuples
+    :return: sorted arrays of positions and cell sizes
+    """
+    if not lines:
+        return np.zeros(0), np.zeros(0)
+    lines = sorted((line[0], line[1], len(line) > 2 and bool(line[2])) for line in lines)
+    groups = []
+    for x, h, keep in lines:
+        g = groups[-1] if groups else None
+        if g is not None and x - g["last"] <= min(tol, g["res"] / 2, h / 2) and not (keep and g["kept"] and abs(x - g["kept"][0]) > 1e-9):
+            g["pos"].append(x)
+            g["last"] = x
+            g["res"] = min(g["res"], h)
+            if keep:
+                g["kept"].append(x)
+        else:
+            groups.append({"pos": [x], "last": x, "res": h, "kept": [x] if keep else []})
+    pos = [g["kept"][0] if g["kept"] else np.mean(g["pos"]) for g in groups]
+    return np.array(pos), np.array([g["res"] for g in groups])
+
+
+def graded_lines(fixed, res, max_res, ratio=1.4):
+    """
+    Fill the gaps between fixed lines with the fewest lines within the cell size field.
+
+    The wanted cell size at a fixed line is its own size, capped by the distance to its
+    neighbours, and grows by `ratio` per cell away from it up to `max_res`: a size field
+    growing linearly with slope log(ratio) grows by exactly `ratio` from cell to cell. The
+    slope is kept 10% lower, so rounding the number of cells of a gap up stays within it.
+
+    :param fixed: sorted positions of the required lines
+    :param res: cell size wanted at every required line
+    :return: sorted array of all lines
+    """
+    if len(fixed) < 2:
+        return np.asarray(fixed, dtype=float)
+    gaps = np.diff(fixed)
+    res = np.minimum(res, max_res)
+    res = np.minimum(res, np.concatenate([[np.inf], gaps]))
+    res = np.minimum(res, np.concatenate([gaps, [np.inf]]))
+
+    slope = 0.9 * np.log(ratio)
+    lines = [fixed[:1]]
+    for a, b in zip(fixed[:-1], fixed[1:]):
+        x = np.linspace(a, b, int(min(4096, max(64, 8 * (b - a) / res.min()))))
+        h = np.min(res[:, None] + slope * np.abs(x[None, :] - fixed[:, None]), axis=0)
+        h = np.minimum(h, max_res)
+        cells = np.concatenate([[0], np.cumsum(np.diff(x) * 0.5 * (1 / h[1:] + 1 / h[:-1]))])
+        n = max(1, int(np.ceil(cells[-1] - 1e-6)))
+        lines.append(np.interp(np.arange(1, n + 1) * cells[-1] / n, cells, x))
+        lines[-1][-1] = b
+    return np.concatenate(lines)
+
+
+def plan(csx, max_res, ratio=1.4, edge_res=None, merge_tol=None, extra=None, verbose=True):
+    """
+    Replace the mesh of a model by a graded mesh derived from its primitives.
+
+    Call it once all primitives (including ports and NF2FF boxes) have been added.
+
+    :param csx: ContinuousStructure
+    :param max_res: maximum cell size
+    :param ratio: maximum ratio between neighbouring cells
+    :param edge_res: cell size at the edges of the primitives, `max_res / 4` by default
+    :param merge_tol: lines closer than this are merged, `edge_res / 20` by default
+    :param extra: dict axis -> positions of additional required lines, e.g. the boundaries
+                  of the simulation box; these get `max_res` cells
+    :return: dict axis -> array of mesh lines
+    """
+    if edge_res is None:
+        edge_res = max_res / 4
+    if merge_tol is None:
+        merge_tol = edge_res / 20
+    required = primitive_lines(csx, edge_res)
+    for axis, positions in (extra or {}).items():
+        required[axis] += [(x, max_res, False) for x in positions]
+
+    mesh = csx.GetGrid()
+    lines = {}
+    for axis in _AXES:
+        lines[axis] = graded_lines(*merge_lines(required[axis], merge_tol), max_res=max_res, ratio=ratio)
+        mesh.SetLines(axis, lines[axis])
+    if verbose:
+        print_size(mesh, "mesh planner")
+    return lines
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# Run a single openEMS simulation on several MPI processes
+#
+# The FDTD file gets an `<MPI SplitPos_X="...">` element that cuts the mesh into slabs of
+# equal cell count along the axis with most lines (the boom of the Yagi), and openEMS runs
+# with `--engine=MPI` under mpirun, one slab per rank. No slab boundary goes through the
+# lumped port or its probes, so every port signal is written whole by one rank. The dump
+# files of the ranks (`ID<rank>_<name>`) are collected afterwards into the files a single
+# process run writes: probes are renamed and the parts of the NF2FF box faces are merged,
+# so `CalcPort` and `CalcNF2FF` work on the directory unchanged.
+#
+# openEMS has to be built with MPI support. The ranks may run on several hosts
+# (`mpi_hosts`) if the simulation directory is on a filesystem shared by all of them.
+#
+# Usage:
+#   ./mpi_run.py                    strong scaling of the model of yagi_trena.py
+#   ./mpi_run.py -n 1 2 4 8 model.xml
+
+import os
+import re
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import engine_tuner
+
+# mpirun executable and extra arguments, e.g. ["--oversubscribe"]
+mpirun_bin = "mpirun"
+mpirun_args = []
+
+# hosts for mpirun, e.g. "node1:8,node2:8"; None runs all ranks on this machine
+mpi_hosts = None
+
+# timesteps of every run of the strong scaling measurement
+scaling_timesteps = 1000
+
+# properties whose primitives must not be cut by a slab boundary
+keepout_types = ("LumpedElement", "Excitation", "ProbeBox")
+
+# files written by rank n are named ID<n>_<name>
+_RANK_FILE = re.compile(r"^ID(\d+)_(.+)$")
+
+_AXES = "xyz"
+
+
+def read_mesh(xml_fn):
+    """
+    Mesh lines of an FDTD file, in drawing units.
+
+    :return: list of three arrays (x, y, z)
+    """
+    grid = ET.parse(xml_fn).getroot().find(".//RectilinearGrid")
+    return [np.array([float(v) for v in grid.find(a.upper() + "Lines").text.split(",")]) for a in _AXES]
+
+
+def keepout_boxes(xml_fn, types=keepout_types):
+    """
+    Bounding boxes of the primitives of ports and probes of an FDTD file.
+
+    :return: list of (start, stop) arrays in drawing units
+    """
+    boxes = []
+    props = ET.parse(xml_fn).getroot().find(".//Properties")
+    for prop in props if props is not None else []:
+        if prop.tag not in types:
+            continue
+        for box in prop.iter("Box"):
+            p1, p2 = box.find("P1"), box.find("P2")
+            pts = np.array([[float(p.get(a.upper())) for a in _AXES] for p in (p1, p2)])
+            boxes.append((pts.min(axis=0), pts.max(axis=0)))
+    return boxes
+
+
+def split_positions(lines, ranks, keepout=()):
+    """
+    Mesh lines cutting an axis into `ranks` slabs of about equal cell count.
+
+    :param lines: mesh lines of the axis
+    :param keepout: list of (lo, hi) intervals no cut may touch
+    :return: list of `ranks - 1` positions
+    """
+    lines = np.asarray(lines)
+    allowed = np.array([not any(lo <= x <= hi for lo, hi in keepout) for x in lines])
+    allowed[[0, -1]] = False
+    candidates = np.flatnonzero(allowed)
+    res = []
+    for k in range(1, ranks):
+        target = k * (len(lines) - 1) / ranks
+        n = candidates[np.argmin(np.abs(candidates - target))]
+        if res and n <= res[-1]:
+            later = candidates[candidates > res[-1]]
+            if not len(later):
+                raise ValueError("mesh of {} lines cannot be split into {} slabs".format(len(lines), ranks))
+            n = later[0]
+        res.append(n)
+    return [float(lines[n]) for n in res]
+
+
+def add_mpi_split(xml_fn, ranks, axis=None):
+    """
+    Add the `<MPI>` element splitting the mesh of an FDTD file into `ranks` slabs.
+
+    :param axis: axis to split, the one with most mesh lines by default
+    :return: (axis, positions)
+    """
+    lines = read_mesh(xml_fn)
+    if axis is None:
+        axis = _AXES[int(np.argmax([len(l) for l in lines]))]
+    n = _AXES.index(axis)
+    keepout = [(start[n], stop[n]) for start, stop in keepout_boxes(xml_fn)]
+    positions = split_positions(lines[n], ranks, keepout)
+
+    tree = ET.parse(xml_fn)
+    fdtd_node = tree.getroot().find("FDTD")
+    for node in fdtd_node.findall("MPI"):
+        fdtd_node.remove(node)
+    if ranks > 1:
+        ET.SubElement(fdtd_node, "MPI", {"SplitPos_" + axis.upper(): ",".join(repr(p) for p in positions)})
+    tree.write(xml_fn)
+    return axis, positions
+
+
+def mpirun_command(xml_name, ranks, verbose=0):
+    """
+    Command line running an FDTD file on `ranks` MPI processes.
+    """
+    args = [mpirun_bin, "-n", str(ranks)] + list(mpirun_args)
+    if mpi_hosts:
+        args += ["--host", mpi_hosts]
+    args += [engine_tuner.openems_bin, xml_name, "--engine=MPI"]
+    if verbose:
+        args.append("-" + "v" * min(int(verbose), 3))
+    return args
+
+
+def _merge_h5(parts, dst):
+    import h5py
+
+    files = [h5py.File(fn, "r") for fn in parts]
+    try:
+        lines = [[np.asarray(f["Mesh"][a]) for a in _AXES] for f in files]
+        split = [n for n in range(3) if any(not np.array_equal(l[n], lines[0][n]) for l in lines)]
+        if len(split) != 1:
+            raise RuntimeError("cannot merge {}: parts differ along {} axes".format(dst, len(split)))
+        n = split[0]
+        order = np.argsort([l[n][0] for l in lines])
+        files = [files[i] for i in order]
+        lines = [lines[i][n] for i in order]
+
+        # neighbouring ranks both write the line on the cut, keep it once
+        keep = []
+        last = -np.inf
+        for l in lines:
+            keep.append(l > last + 1e-9 * max(1.0, abs(last)))
+            last = l[-1]
+        merged = np.concatenate([l[k] for l, k in zip(lines, keep)])
+
+        def dim(name):
+            shapes = [f[name].shape for f in files]
+            dims = [d for d in range(len(shapes[0])) if len({s[d] for s in shapes}) > 1]
+            if not dims:
+                dims = [d for d in range(len(shapes[0])) if all(s[d] == len(l) for s, l in zip(shapes, lines))]
+            if len(dims) != 1:
+                raise RuntimeError("cannot tell the split axis of {} in {}".format(name, dst))
+            return dims[0]
+
+        with h5py.File(dst + ".tmp", "w") as out:
+            out.attrs.update(files[0].attrs)
+
+            def copy(name, obj):
+                if isinstance(obj, h5py.Group):
+                    out.require_group(name).attrs.update(obj.attrs)
+                    return
+                if name == "Mesh/" + _AXES[n]:
+                    data = merged
+                elif name.startswith("FieldData") and obj.ndim:
+                    d = dim(name)
+                    data = np.concatenate([np.compress(k, f[name][()], axis=d) for f, k in zip(files, keep)], axis=d)
+                else:
+                    data = obj[()]
+                out.create_dataset(name, data=data).attrs.update(obj.attrs)
+
+            files[0].visititems(copy)
+    finally:
+        for f in files:
+            f.close()
+    os.replace(dst + ".tmp", dst)
+
+
+def collect(sim_path):
+    """
+    Turn the files written by the ranks into the files of a single process run.
+
+    :raises RuntimeError: if a probe was split across ranks
+    """
+    groups = {}
+    for fn in os.listdir(sim_path):
+        m = _RANK_FILE.match(fn)
+        if m:
+            groups.setdefault(m.group(2), []).append(os.path.join(sim_path, fn))
+    for name, parts in groups.items():
+        dst = os.path.join(sim_path, name)
+        if len(parts) == 1:
+            os.replace(parts[0], dst)
+        elif name.endswith(".h5"):
+            _merge_h5(parts, dst)
+            for fn in parts:
+                os.remove(fn)
+        else:
+            raise RuntimeError("probe {} was split across {} ranks".format(name, len(parts)))
+
+
+def run(fdtd, sim_path, ranks, verbose=3):
+    """
+    `fdtd.Run(sim_path, verbose=verbose, cleanup=True)` on `ranks` MPI processes.
+    """
+    if os.path.isdir(sim_path):
+        shutil.rmtree(sim_path)
+    os.makedirs(sim_path)
+    xml_fn = os.path.join(sim_path, "openEMS.xml")
+    fdtd.Write2XML(xml_fn)
+    add_mpi_split(xml_fn, ranks)
+    subprocess.run(mpirun_command("openEMS.xml", ranks, verbose), cwd=sim_path, check=True)
+    collect(sim_path)
+
+
+def runner(fdtd, ranks):
+    """
+    Function `run(sim_path, verbose)` running on `ranks` MPI processes.
+    """
+    return lambda sim_path, verbose: run(fdtd, sim_path, ranks, verbose)
+
+
+def scaling(xml_fn, ranks_list, timesteps=scaling_timesteps, verbose=True):
+    """
+    Strong scaling: the same model for a fixed number of timesteps on each rank count.
+
+    :param xml_fn: FDTD file of the model
+    :return: list of dicts with `ranks`, wall time `seconds`, `speedup` and `efficiency`,
+             relative to the smallest rank count
+    """
+    res = []
+    for ranks in sorted(ranks_list):
+        with tempfile.TemporaryDirectory(prefix="mpi_run-") as tmp:
+            fn = os.path.join(tmp, "openEMS.xml")
+            shutil.copy(xml_fn, fn)
+            tree = ET.parse(fn)
+            tree.getroot().find("FDTD").set("NumberOfTimesteps", str(int(timesteps)))
+            tree.getroot().find("FDTD").set("endCriteria", "0")
+            tree.write(fn)
+            add_mpi_split(fn, ranks)
+            start = time.time()
+            subprocess.run(mpirun_command("openEMS.xml", ranks), cwd=tmp, check=True, stdout=subprocess.DEVNULL)
+            seconds = time.time() - start
+        base = res[0] if res else {"ranks": ranks, "seconds": seconds}
+        speedup = base["seconds"] / seconds
+        res.append({"ranks": ranks, "seconds": seconds, "speedup": speedup,
+                    "efficiency": speedup * base["ranks"] / ranks})
+        if verbose:
+            print("{:>4} ranks: {:8.1f} s, speedup {:5.2f}, efficiency {:4.0%}".format(
+                ranks, seconds, speedup, res[-1]["efficiency"]))
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strong scaling of an openEMS simulation with MPI")
+    parser.add_argument("xml", nargs="?", help="openEMS FDTD file, the model of yagi_trena.py by default")
+    parser.add_argument("-n", "--ranks", type=int, nargs="+", default=[1, 2, 4], help="rank counts to measure")
+    parser.add_argument("-t", "--timesteps", type=int, default=scaling_timesteps, help="timesteps per run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_fn = args.xml
+        if xml_fn is None:
+            import yagi_trena
+
+            xml_fn = os.path.join(tmp, "yagi_trena.xml")
+            yagi_trena.build_model()[0].Write2XML(xml_fn)
+        scaling(xml_fn, args.ranks, args.timesteps)
@@ -0,0 +1,167 @@
+# Memory-bounded NF2FF over many frequencies
+#
+# `nf2ff.CalcNF2FF` keeps the surface spectra and the far-field of every requested
+# frequency in memory at once, which gets OOM-killed for the full 2001-frequency
+# excitation band. This driver splits the frequencies into chunks sized to a memory
+# budget, computes the chunks on worker processes and streams every chunk's results into
+# `.npy` arrays on disk, which are memory mapped back when reading.
+
+import os
+import glob
+import types
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# memory available to all NF2FF workers together (bytes)
+nf2ff_mem_budget = 8 * 1024 ** 3
+
+# number of worker processes
+nf2ff_jobs = max(1, os.cpu_count() // 4)
+
+# per surface sample: E and H spectra, 3 complex<float> components each
+_BYTES_PER_SURFACE_SAMPLE = 6 * 8
+# per angle: E_theta/E_phi inside the engine (complex<double>), plus E_theta, E_phi,
+# E_cprh, E_cplh (complex) and E_norm, P_rad (real) in the Python result object
+_BYTES_PER_ANGLE = 2 * 16 + 4 * 16 + 2 * 8
+
+# arrays streamed to disk: name -> (dtype, whether it holds a theta x phi grid per frequency)
+_ARRAYS = {
+    "Dmax": (np.float64, False),
+    "Prad": (np.float64, False),
+    "E_norm": (np.float64, True),
+    "E_cprh": (np.complex128, True),
+    "E_cplh": (np.complex128, True),
+}
+
+
+def bytes_per_freq(sim_path, box_name, n_theta, n_phi):
+    """
+    Estimate the NF2FF memory needed per frequency.
+
+    :param sim_path: simulation directory holding the NF2FF box dumps
+    :param box_name: name of the NF2FF box (as passed to `CreateNF2FFBox`)
+    :param n_theta: number of theta angles
+    :param n_phi: number of phi angles
+    :return: bytes
+    """
+    import h5py
+
+    n_surface = 0
+    for fn in glob.glob(os.path.join(sim_path, "{}_E_*.h5".format(box_name))):
+        with h5py.File(fn, "r") as h5:
+            n_surface += int(np.prod([len(h5["Mesh"][axis]) for axis in ("x", "y", "z")]))
+    return freq_bytes(n_surface, n_theta, n_phi)
+
+
+def freq_bytes(n_surface, n_theta, n_phi):
+    """
+    NF2FF memory needed per frequency for `n_surface` samples on the recording box.
+    """
+    return n_surface * _BYTES_PER_SURFACE_SAMPLE + n_theta * n_phi * _BYTES_PER_ANGLE
+
+
+def chunk_size(per_freq, mem_budget=nf2ff_mem_budget, jobs=nf2ff_jobs):
+    """
+    Number of frequencies per chunk so that `jobs` chunks in flight fit in `mem_budget`.
+    """
+    return max(1, int(mem_budget // (jobs * per_freq)))
+
+
+def _chunk_file(box, freqs, theta, phi, radius, center, chunk_nr):
+    # the frequencies, angles and box a chunk file holds are part of its name, so that a call
+    # splitting the frequencies differently never reads another chunk back
+    name, start, stop, directions, mirror = box
+    key = np.concatenate([np.ravel(a).astype(float)
+                          for a in (start, stop, directions, mirror, freqs, theta, phi, [radius], center)])
+    return "{}_chunk{:04d}_{}.h5".format(name, chunk_nr, hashlib.sha1(key.tobytes()).hexdigest()[:12])
+
+
+def _calc_chunk(sim_path, box, freqs, theta, phi, radius, center, out_dir, offset, chunk_nr, keep_h5):
+    from CSXCAD import ContinuousStructure
+    from openEMS.nf2ff import nf2ff
+
+    # the recording box only has to be known by name and extent to read its dumps back
+    name, start, stop, directions, mirror = box
+    outfile = _chunk_file(box, freqs, theta, phi, radius, center, chunk_nr)
+    box = nf2ff(ContinuousStructure(), name, start, stop, directions=directions, mirror=mirror)
+    res = box.CalcNF2FF(sim_path, freqs, theta, phi, radius=radius, center=center, outfile=outfile,
+                        read_cached=keep_h5)
+
+    chunk = slice(offset, offset + len(freqs))
+    for key in _ARRAYS:
+        arr = np.load(os.path.join(out_dir, key + ".npy"), mmap_mode="r+")
+        arr[chunk] = np.asarray(getattr(res, key))
+        arr.flush()
+        del arr
+
+    if not keep_h5:
+        os.remove(os.path.join(sim_path, outfile))
+    return len(freqs)
+
+
+def calc_nf2ff(nf2ff, sim_path, freq, theta, phi, radius=1, center=(0, 0, 0), out_dir=None,
+               mem_budget=nf2ff_mem_budget, jobs=nf2ff_jobs, keep_h5=False, verbose=True):
+    """
+    Far-field of an NF2FF box for many frequencies within a memory budget.
+
+    :param nf2ff: box returned by `fdtd.CreateNF2FFBox`
+    :param sim_path: simulation directory
+    :param freq: frequencies to analyse (Hz)
+    :param theta: theta angles (degrees)
+    :param phi: phi angles (degrees)
+    :param radius: radius at which to calculate the far-field (m)
+    :param center: phase center of the far-field
+    :param out_dir: directory for the on-disk arrays, `<sim_path>/nf2ff_chunked` by default
+    :param mem_budget: memory available to all workers together (bytes)
+    :param jobs: number of worker processes
+    :param keep_h5: keep the per-chunk NF2FF files and reuse them on a later call computing
+                    the same chunk (same frequencies, angles, radius and center)
+    :return: result with `freq`, `theta`, `phi`, `Dmax`, `Prad` and per-frequency
+             `E_norm`, `E_cprh`, `E_cplh` memory-mapped from `out_dir`
+    """
+    freq = np.atleast_1d(np.asarray(freq, dtype=float))
+    theta = np.asarray(theta, dtype=float)
+    phi = np.asarray(phi, dtype=float)
+    if out_dir is None:
+        out_dir = os.path.join(sim_path, "nf2ff_chunked")
+    os.makedirs(out_dir, exist_ok=True)
+
+    n = chunk_size(bytes_per_freq(sim_path, nf2ff.name, len(theta), len(phi)), mem_budget, jobs)
+    chunks = [(offset, freq[offset:offset + n]) for offset in range(0, len(freq), n)]
+    if verbose:
+        print("nf2ff: analysing far-field for {} frequencies in {} chunks of up to {} on {} workers".format(
+            len(freq), len(chunks), n, jobs))
+
+    np.save(os.path.join(out_dir, "freq.npy"), freq)
+    np.save(os.path.join(out_dir, "theta.npy"), theta)
+    np.save(os.path.join(out_dir, "phi.npy"), phi)
+    for key, (dtype, angular) in _ARRAYS.items():
+        shape = (len(freq), len(theta), len(phi)) if angular else (len(freq),)
+        np.lib.format.open_memmap(os.path.join(out_dir, key + ".npy"), mode="w+", dtype=dtype, shape=shape).flush()
+
+    box = (nf2ff.name, list(nf2ff.start), list(nf2ff.stop), list(nf2ff.directions), list(nf2ff.mirror))
+    done = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(_calc_chunk, sim_path, box, chunk, theta, phi, radius, list(center), out_dir, offset, nr,
+                        keep_h5)
+            for nr, (offset, chunk) in enumerate(chunks)
+        ]
+        for future in futures:
+            done += future.result()
+            if verbose:
+                print("nf2ff: {}/{} frequencies done".format(done, len(freq)))
+
+    return load_farfield(out_dir)
+
+
+def load_farfield(out_dir):
+    """
+    Open the arrays written by `calc_nf2ff` without reading them into memory.
+    """
+    res = types.SimpleNamespace()
+    for key in ["freq", "theta", "phi"] + list(_ARRAYS):
+        setattr(res, key, np.load(os.path.join(out_dir, key + ".npy"), mmap_mode="r"))
+    return res
@@ -0,0 +1,149 @@
+# Radiation pattern metrics over all frequencies of an NF2FF result
+#
+# The principal planes are found on the theta x phi grid by direction, not by angle, so
+# any grid that contains them works: theta from -180 to 180 at phi=0 as in yagi_trena.py,
+# or theta from 0 to 180 with phi all around as in sweep.py. The E-plane holds the forward
+# direction (the boom, towards the directors) and the elements, the H-plane is
+# perpendicular to the elements. Every metric is an array over the frequencies, computed
+# for all of them at once.
+
+import types
+
+import numpy as np
+
+# forward direction of the antenna (towards the directors) and direction of its elements
+forward = (1.0, 0.0, 0.0)
+element_axis = (0.0, 0.0, 1.0)
+
+# half-power level (dB below the peak)
+half_power_db = 3.0
+
+
+def directions(theta, phi):
+    """
+    Unit vectors of a theta x phi grid (degrees).
+
+    :return: array [theta, phi, 3]
+    """
+    t = np.deg2rad(np.asarray(theta, dtype=float))[:, None]
+    p = np.deg2rad(np.asarray(phi, dtype=float))[None, :]
+    return np.stack(np.broadcast_arrays(np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)), axis=-1)
+
+
+def plane_cut(theta, phi, normal, forward=forward):
+    """
+    Grid points lying in the plane through the origin with the given normal.
+
+    :return: flat grid indices and angle (degrees) of every point from `forward` within the
+             plane, sorted by angle, without duplicate directions
+    """
+    d = directions(theta, phi).reshape(-1, 3)
+    normal = np.asarray(normal, dtype=float) / np.linalg.norm(normal)
+    fwd = np.asarray(forward, dtype=float)
+    side = np.cross(normal, fwd)
+    on = np.flatnonzero(np.abs(d @ normal) < 1e-9)
+    angle = np.rad2deg(np.arctan2(d[on] @ side, d[on] @ fwd))
+    angle, first = np.unique(np.round(angle, 6), return_index=True)
+    return on[first], angle
+
+
+def _rolled(values, angle):
+    # every row rolled so its peak is in the middle, with angles relative to the peak
+    n = values.shape[1]
+    peak = np.argmax(values, axis=1)
+    idx = (peak[:, None] + np.arange(-(n // 2), n - n // 2)[None, :]) % n
+    rel = (angle[idx] - angle[peak][:, None] + 180.0) % 360.0 - 180.0
+    rel[:, n // 2] = 0.0
+    return np.take_along_axis(values, idx, axis=1), rel, n // 2
+
+
+def _first_below(v, a, level):
+    # interpolated angle of the first sample below `level` along each row, NaN if none
+    below = v < level
+    k = np.argmax(below, axis=1)
+    ok = below.any(axis=1) & (k > 0)
+    k = np.maximum(k, 1)
+    rows = np.arange(len(v))
+    v0, v1, a0, a1 = v[rows, k - 1], v[rows, k], a[rows, k - 1], a[rows, k]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = a0 + (level - v0) / (v1 - v0) * (a1 - a0)
+    return np.where(ok, res, np.nan)
+
+
+def _first_sidelobe(v):
+    # level of the first local maximum after the first null along each row, NaN if none
+    d = np.diff(v, axis=1)
+    rising = d > 0
+    null = np.argmax(rising, axis=1)
+    after = np.arange(d.shape[1])[None, :] > null[:, None]
+    falling = (d <= 0) & after
+    top = np.argmax(falling, axis=1)
+    ok = rising.any(axis=1) & falling.any(axis=1)
+    return np.where(ok, v[np.arange(len(v)), top], np.nan)
+
+
+def cut_metrics(pattern_db, angle):
+    """
+    Half-power beamwidth and first sidelobe level of pattern cuts.
+
+    :param pattern_db: array [freq, angle] of the pattern in dB
+    :param angle: angles of the cut (degrees), increasing, covering the full circle
+    :return: arrays of HPBW (degrees) and first sidelobe level (dB relative to the peak)
+    """
+    v, a, c = _rolled(pattern_db, angle)
+    v = v - v[:, c:c + 1]
+    right, left = v[:, c:], v[:, c::-1]
+    hpbw = _first_below(right, a[:, c:], -half_power_db) - _first_below(left, a[:, c::-1], -half_power_db)
+    sll = np.fmax(_first_sidelobe(right), _first_sidelobe(left))
+    return hpbw, sll
+
+
+def metrics(nf2ff_res, freq=None, P_acc=None, theta=None, phi=None, forward=forward, element_axis=element_axis):
+    """
+    Pattern metrics for all frequencies of an NF2FF result.
+
+    :param nf2ff_res: result of `CalcNF2FF` or `nf2ff_chunked.calc_nf2ff`
+    :param freq: frequencies of `P_acc` (Hz)
+    :param P_acc: accepted power at the feed over `freq`, for the radiation efficiency and gain
+    :param theta: theta angles of the result (degrees), `nf2ff_res.theta` by default
+    :param phi: phi angles of the result (degrees), `nf2ff_res.phi` by default
+    :return: namespace of arrays over `nf2ff_res.freq`: `Dmax_dBi`, directivity towards
+             `forward` `D_forward_dBi`, front-to-back ratio `fb_dB`, half-power beamwidths
+             `hpbw_E` and `hpbw_H` (degrees), first sidelobe levels `sll_E_dB`, `sll_H_dB`
+             and `sll_dB` (the higher of both); with `P_acc` also `efficiency` and `gain_dBi`
+    """
+    theta = np.asarray(nf2ff_res.theta if theta is None else theta, dtype=float)
+    phi = np.asarray(nf2ff_res.phi if phi is None else phi, dtype=float)
+    f = np.asarray(nf2ff_res.freq, dtype=float)
+    E = np.asarray(nf2ff_res.E_norm, dtype=float).reshape(len(f), len(theta) * len(phi))
+    Dmax = np.asarray(nf2ff_res.Dmax, dtype=float)
+
+    # directivity pattern in dBi, -inf in exact nulls
+    with np.errstate(divide="ignore"):
+        D_dB = 20 * np.log10(E / E.max(axis=1, keepdims=True)) + 10 * np.log10(Dmax)[:, None]
+
+    d = directions(theta, phi).reshape(-1, 3)
+    fwd = np.asarray(forward, dtype=float)
+    front, back = np.argmax(d @ fwd), np.argmin(d @ fwd)
+
+    res = types.SimpleNamespace(freq=f, Dmax_dBi=10 * np.log10(Dmax), D_forward_dBi=D_dB[:, front],
+                                fb_dB=D_dB[:, front] - D_dB[:, back])
+    e_normal = np.cross(fwd, element_axis)
+    for name, normal in [("E", e_normal), ("H", element_axis)]:
+        idx, angle = plane_cut(theta, phi, normal, fwd)
+        hpbw, sll = cut_metrics(D_dB[:, idx], angle) if len(idx) > 2 else (np.full(len(f), np.nan),) * 2
+        setattr(res, "hpbw_" + name, hpbw)
+        setattr(res, "sll_{}_dB".format(name), sll)
+    res.sll_dB = np.fmax(res.sll_E_dB, res.sll_H_dB)
+
+    if P_acc is not None:
+        res.efficiency = np.asarray(nf2ff_res.Prad, dtype=float) / np.interp(f, freq, P_acc)
+        res.gain_dBi = res.Dmax_dBi + 10 * np.log10(res.efficiency)
+    return res
+
+
+def save(fn, res):
+    """
+    Write the arrays of a `metrics` result into an `.npz` file.
+    """
+    np.savez(fn, **vars(res))
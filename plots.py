@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# Headless rendering of the impedance, reflection and directivity figures
+#
+# The figures are drawn on the Agg canvas directly (no pyplot state), so they can be
+# rendered from worker processes and on machines without a display. The shaded S11 band is
+# a single image instead of one axvline per frequency sample.
+#
+# Usage:
+#   ./plots.py results/yagi_trena_sweep/p_*   render the figures of result directories in parallel
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import analysis
+
+# transparency of the S11 band shading at the cutoff and at the S11 minimum
+min_alpha = 0.05
+max_alpha = 0.8
+
+
+def _new_figure(fig=None):
+    # a figure passed in (e.g. from pyplot.figure() to show it on screen) is drawn as is
+    if fig is None:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def plot_impedance(filename, freq, Zin, fig=None):
+    """
+    Plot the feed point impedance.
+
+    :param fig: figure to draw into, a new headless one by default
+    """
+    fig, ax = _new_figure(fig)
+    ax.plot(freq / 1e6, np.real(Zin), "k-", linewidth=2, label=r"$\Re(Z_{in})$")
+    ax.grid()
+    ax.plot(freq / 1e6, np.imag(Zin), "r--", linewidth=2, label=r"$\Im(Z_{in})$")
+    ax.set_title("feed point impedance")
+    ax.set_xlabel("frequency (MHz)")
+    ax.set_ylabel("impedance (Omega)")
+    ax.legend()
+    fig.savefig(filename)
+    return fig
+
+
+def plot_reflection(filename, freq, s11_dB, Zin, cutoff_dbs_results, cutoff_dbs=analysis.cutoff_dbs,
+                    cutoff_db_resonance=analysis.cutoff_db_resonance, title="Yagi-Uda", fig=None):
+    """
+    Plot the reflection coefficient S11 with the resonance and its bandwidths.
+
+    :param cutoff_dbs_results: bandwidths as returned by `analysis.bandwidths`, optionally
+                               with an "interest" entry from `analysis.interest_band`
+    :param title: antenna name shown in the title
+    :param fig: figure to draw into, a new headless one by default
+    """
+    f0 = (freq[0] + freq[-1]) / 2
+    idx = analysis.resonance_index(s11_dB)
+
+    fig, ax = _new_figure(fig)
+    ax.plot(freq / 1e6, s11_dB, "k-", linewidth=2, label="$S_{11}$")
+    ax.grid()
+    ax.set_title(
+        "{} for {} MHz\nAntenna Efficiency: S11 Reflection Coefficient vs Frequency\n".format(title, round(f0 / 1e6, 1))
+    )
+    ax.set_ylabel("Reflection coefficient $S_{11}$ (dB)")
+    ax.set_xlabel("Frequency (MHz)")
+
+    # shade the band below the reference cutoff, more opaque towards the S11 minimum
+    idx_cutoff_lower = cutoff_dbs_results[cutoff_db_resonance]["lower"]["idx"]
+    idx_cutoff_upper = cutoff_dbs_results[cutoff_db_resonance]["upper"]["idx"]
+    band = slice(idx_cutoff_lower, idx_cutoff_upper + 1)
+    alpha_values = (s11_dB[band] - cutoff_db_resonance) / (s11_dB.min() - cutoff_db_resonance)
+    alpha_values = min_alpha - np.clip(alpha_values, 0, 1) * (min_alpha - max_alpha)
+    shade = np.zeros((1, len(alpha_values), 4))
+    shade[0, :, 1] = 0.5  # green
+    shade[0, :, 3] = alpha_values
+    ax.autoscale_view()
+    ymin, ymax = ax.get_ylim()
+    ax.imshow(shade, extent=(freq[idx_cutoff_lower] / 1e6, freq[idx_cutoff_upper] / 1e6, ymin, ymax),
+              aspect="auto", interpolation="bilinear", zorder=0)
+    ax.set_ylim(ymin, ymax)
+    ax.set_xlim(freq[0] / 1e6, freq[-1] / 1e6)
+
+    ax.axvline(x=freq[idx_cutoff_lower] / 1e6, color="green", alpha=1.0, zorder=2)
+    ax.axvline(x=freq[idx_cutoff_upper] / 1e6, color="green", alpha=1.0, zorder=2)
+    ax.axvline(x=freq[idx] / 1e6, color="blue", alpha=1.0, zorder=2)
+    ax.axhline(y=round(s11_dB[idx], 1), color="blue", alpha=1.0, zorder=2)
+
+    if "interest" in cutoff_dbs_results:
+        res_cutoff_interest_lower = cutoff_dbs_results["interest"]["lower"]
+        res_cutoff_interest_upper = cutoff_dbs_results["interest"]["upper"]
+        # index of _maximum_ of S11 at both ends of frequency band of interest
+        i = (
+            res_cutoff_interest_lower["idx"]
+            if res_cutoff_interest_lower["s11"] > res_cutoff_interest_upper["s11"]
+            else res_cutoff_interest_upper["idx"]
+        )
+        if idx_cutoff_lower < i < idx_cutoff_upper and i != idx:
+            ax.axhline(y=round(s11_dB[i], 1), color="blue", alpha=1.0, zorder=2, linestyle="--")
+            ax.text(
+                round(freq[i] / 1e6, 1),
+                round(s11_dB[i], 1) + 1.0,
+                "{} MHz bandwidth @ {} dB".format(res_cutoff_interest_lower["bandwidth"], round(s11_dB[i], 1)),
+                ha="center",
+                zorder=4,
+                fontweight="bold",
+            )
+
+    x = round(freq[idx] / 1e6, 1)
+    for cutoff_db in cutoff_dbs:
+        ax.axhline(y=cutoff_db, color="green", alpha=1.0, linestyle="dotted")
+        ax.text(
+            x,
+            cutoff_db + 1.0,
+            "{} MHz bandwidth @ {} dB".format(cutoff_dbs_results[cutoff_db]["bandwidth"], cutoff_db),
+            ha="center",
+            zorder=4,
+            fontweight="bold",
+        )
+
+        lower = cutoff_dbs_results[cutoff_db]["lower"]["idx"]
+        upper = cutoff_dbs_results[cutoff_db]["upper"]["idx"]
+        markers = [(lower, [-4.0, -4.0], "red", "right"), (upper, [4.0, -4.0], "red", "left"),
+                   (idx, [2.0, 2.0], "blue", "left")]
+        for i, offset, color, ha in markers:
+            ax.scatter(freq[i] / 1e6, s11_dB[i], color=color, zorder=3)
+            ax.text(
+                freq[i] / 1e6 + offset[0],
+                s11_dB[i] + offset[1],
+                " {} MHz: {} dB\n@ {} Ohm".format(
+                    round(freq[i] / 1e6, 1), round(s11_dB[i], 1), round(np.real(Zin[i]), 1)
+                ),
+                ha=ha,
+                zorder=4,
+                fontweight="normal",
+            )
+
+    fig.savefig(filename)
+    return fig
+
+
+def plot_directivity(filename, theta, phi, nf2ff_res, n=0, fig=None):
+    """
+    Plot the directivity pattern in the phi=0 plane.
+
+    :param nf2ff_res: result of `CalcNF2FF` or `nf2ff_chunked.calc_nf2ff`
+    :param n: index of the frequency to plot
+    :param fig: figure to draw into, a new headless one by default
+    """
+    E_max = np.max(nf2ff_res.E_norm[n])
+    Dmax_dB = 10 * np.log10(nf2ff_res.Dmax[n])
+    E_norm = 20.0 * np.log10(nf2ff_res.E_norm[n] / E_max) + Dmax_dB
+    E_CPRH = 20.0 * np.log10(np.abs(nf2ff_res.E_cprh[n]) / E_max) + Dmax_dB
+    E_CPLH = 20.0 * np.log10(np.abs(nf2ff_res.E_cplh[n]) / E_max) + Dmax_dB
+
+    fig, ax = _new_figure(fig)
+    ax.plot(theta, E_norm[:, phi == 0], "k-", linewidth=2, label="$|E|$")
+    ax.plot(theta, E_CPRH[:, phi == 0], "g--", linewidth=2, label="$|E_{CPRH}|$")
+    ax.plot(theta, E_CPLH[:, phi == 0], "r-.", linewidth=2, label="$|E_{CPLH}|$")
+    ax.grid()
+    ax.set_xlabel("Theta (deg)")
+    ax.set_ylabel("Directivity (dBi)")
+    ax.set_title("Frequency: {} GHz".format(nf2ff_res.freq[n] / 1e9))
+    ax.legend()
+    fig.savefig(filename)
+    return fig
+
+
+def plot_directivity_freq(filename, nf2ff_res, fig=None):
+    """
+    Plot the maximum directivity over all frequencies of a far-field result.
+
+    :param fig: figure to draw into, a new headless one by default
+    """
+    fig, ax = _new_figure(fig)
+    ax.plot(nf2ff_res.freq / 1e6, 10 * np.log10(nf2ff_res.Dmax), "k-", linewidth=2)
+    ax.grid()
+    ax.set_xlabel("Frequency (MHz)")
+    ax.set_ylabel("Maximum directivity (dBi)")
+    ax.set_title("Directivity vs Frequency")
+    fig.savefig(filename)
+    return fig
+
+
+def render_result_dir(result_dir, fmt="svg"):
+    """
+    Render the figures of a result directory written by `sweep.run_point`.
+
+    Reads `port.npz` and, if present, the far-field in `nf2ff_chunked`; the figures are
+    saved into the result directory.
+
+    :return: list of written files
+    """
+    port = np.load(os.path.join(result_dir, "port.npz"))
+    freq, Zin = port["freq"], port["Zin"]
+    s11_dB = 20.0 * np.log10(np.abs(port["s11"]))
+
+    written = [os.path.join(result_dir, "fig_impedance." + fmt), os.path.join(result_dir, "fig_reflection." + fmt)]
+    plot_impedance(written[0], freq, Zin)
+    plot_reflection(written[1], freq, s11_dB, Zin, analysis.bandwidths(freq, s11_dB, Zin))
+
+    nf2ff_dir = os.path.join(result_dir, "nf2ff_chunked")
+    if os.path.isdir(nf2ff_dir):
+        import nf2ff_chunked
+
+        nf2ff_res = nf2ff_chunked.load_farfield(nf2ff_dir)
+        written.append(os.path.join(result_dir, "fig_directivity." + fmt))
+        plot_directivity(written[-1], nf2ff_res.theta, nf2ff_res.phi, nf2ff_res)
+    return written
+
+
+def render_result_dirs(result_dirs, jobs=os.cpu_count(), fmt="svg"):
+    """
+    Render the figures of many result directories in parallel.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(render_result_dir, result_dirs, [fmt] * len(result_dirs)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the figures of result directories")
+    parser.add_argument("result_dirs", nargs="+", help="directories with a port.npz")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-f", "--format", default="svg", help="image format (svg, png, pdf)")
+    args = parser.parse_args()
+
+    for files in render_result_dirs(args.result_dirs, args.jobs, args.format):
+        print("\n".join(files))
@@ -0,0 +1,181 @@
+# Lumped port quantities from the probe files of an openEMS run
+#
+# Same results as `port.CalcPort(sim_path, freq)` of a lumped port, computed with NumPy
+# from the time signals `port_ut<n>` / `port_it<n>` alone. It needs neither the openEMS
+# model nor a finished run: files that are still being written are read up to their last
+# complete line.
+#
+# On a uniform frequency grid the transform is a chirp-Z transform (Bluestein's algorithm,
+# three FFTs) instead of a DFT matrix, so its cost hardly depends on the number of
+# frequencies. `refine` uses that to zoom into the resonance and the S11 threshold
+# crossings found on a coarse grid, at any resolution.
+
+import os
+import types
+
+import numpy as np
+
+import analysis
+
+# frequencies transformed at once, bounds the memory of the DFT matrix
+_DFT_CHUNK = 128
+
+# frequencies of the coarse grid and of every zoomed window of `refine`
+refine_coarse_points = 201
+refine_zoom_points = 201
+
+
+def read_probe(fn):
+    """
+    Read the time signal of a voltage or current probe.
+
+    :return: arrays of time (s) and value; empty if nothing was written yet
+    """
+    try:
+        with open(fn) as f:
+            text = f.read()
+    except FileNotFoundError:
+        return np.zeros(0), np.zeros(0)
+    # the last line may be incomplete while the engine is running
+    end = text.rfind("\n")
+    rows = [line for line in text[:end].splitlines() if line and not line.startswith("%")]
+    if not rows:
+        return np.zeros(0), np.zeros(0)
+    data = np.array([line.split()[:2] for line in rows], dtype=float)
+    return data[:, 0], data[:, 1]
+
+
+def _uniform(x, rtol=1e-3):
+    # the probe files round the time stamps, hence the loose tolerance
+    d = np.diff(x)
+    return len(x) > 2 and np.all(np.abs(d - d.mean()) <= rtol * abs(d.mean()))
+
+
+def czt(x, dt, f_start, df, m):
+    """
+    Chirp-Z transform `sum_n x[n] exp(-2j pi (f_start + k df) n dt)` for k = 0 .. m-1.
+
+    Bluestein's algorithm: the transform is written as a convolution with a chirp and
+    evaluated with FFTs of a power of two length, O((n + m) log(n + m)).
+    """
+    n = len(x)
+    length = 1 << (n + m - 2).bit_length()
+    k = np.arange(max(n, m), dtype=np.int64)
+    chirp = np.exp(-1j * np.pi * df * dt * (k * k).astype(float))
+    y = np.zeros(length, dtype=complex)
+    y[:n] = x * np.exp(-2j * np.pi * f_start * dt * np.arange(n)) * chirp[:n]
+    v = np.zeros(length, dtype=complex)
+    v[:m] = np.conj(chirp[:m])
+    if n > 1:
+        v[length - n + 1:] = np.conj(chirp[1:n][::-1])
+    return np.fft.ifft(np.fft.fft(y) * np.fft.fft(v))[:m] * chirp[:m]
+
+
+def dft(t, val, freq):
+    """
+    Spectrum of a pulse signal, as `openEMS.utilities.DFT_time2freq(t, val, freq)`.
+
+    Uniform time and frequency grids go through `czt`, others through a DFT matrix.
+    """
+    freq = np.atleast_1d(np.asarray(freq, dtype=float))
+    if len(t) < 2:
+        return np.zeros(len(freq), dtype=complex)
+    if _uniform(freq) and _uniform(t):
+        dt = (t[-1] - t[0]) / (len(t) - 1)
+        df = (freq[-1] - freq[0]) / (len(freq) - 1)
+        res = czt(np.asarray(val, dtype=float), dt, freq[0], df, len(freq)) * np.exp(-2j * np.pi * freq * t[0])
+        return 2 * dt * res
+    res = np.empty(len(freq), dtype=complex)
+    for n in range(0, len(freq), _DFT_CHUNK):
+        f = freq[n:n + _DFT_CHUNK]
+        res[n:n + _DFT_CHUNK] = np.exp(-2j * np.pi * f[:, None] * t[None, :]) @ val
+    return 2 * (t[1] - t[0]) * res
+
+
+def calc_port(sim_path, freq, Z_ref=50, port_nr=1):
+    """
+    Voltages, currents, powers, input impedance and reflection of a lumped port.
+
+    :param sim_path: simulation directory
+    :param freq: frequencies (Hz)
+    :param Z_ref: reference impedance, the port resistance
+    :param port_nr: number of the port
+    :return: namespace with `freq`, `uf_tot`, `if_tot`, `uf_inc`, `if_inc`, `uf_ref`,
+             `if_ref`, `P_inc`, `P_ref`, `P_acc`, `Zin`, `s11` and the simulated time `t_end`
+    """
+    t_u, u = read_probe(os.path.join(sim_path, "port_ut{}".format(port_nr)))
+    t_i, i = read_probe(os.path.join(sim_path, "port_it{}".format(port_nr)))
+    n = min(len(t_u), len(t_i))
+    return from_spectra(freq, dft(t_u[:n], u[:n], freq), dft(t_i[:n], i[:n], freq), Z_ref, t_u[n - 1] if n else 0.0)
+
+
+def from_spectra(freq, uf_tot, if_tot, Z_ref=50, t_end=0.0):
+    """
+    Port quantities from the spectra of the total port voltage and current.
+
+    :return: namespace as returned by `calc_port`
+    """
+    p = types.SimpleNamespace(freq=np.asarray(freq, dtype=float), t_end=t_end, uf_tot=uf_tot, if_tot=if_tot)
+    p.uf_inc = 0.5 * (p.uf_tot + p.if_tot * Z_ref)
+    p.if_inc = 0.5 * (p.if_tot + p.uf_tot / Z_ref)
+    p.uf_ref = p.uf_tot - p.uf_inc
+    p.if_ref = p.if_inc - p.if_tot
+    p.P_inc = 0.5 * np.real(p.uf_inc * np.conj(p.if_inc))
+    p.P_ref = 0.5 * np.real(p.uf_ref * np.conj(p.if_ref))
+    p.P_acc = 0.5 * np.real(p.uf_tot * np.conj(p.if_tot))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p.Zin = p.uf_tot / p.if_tot
+        p.s11 = p.uf_ref / p.uf_inc
+    return p
+
+
+def _zoom_crossing(sim_path, f_a, f_b, cutoff_db, Z_ref, port_nr, n):
+    # frequency where S11 crosses `cutoff_db` between f_a (below) and f_b (at or above)
+    fine = np.linspace(f_a, f_b, n)
+    s11_dB = 20 * np.log10(np.abs(calc_port(sim_path, fine, Z_ref, port_nr).s11))
+    above = np.flatnonzero(s11_dB >= cutoff_db)
+    if not len(above):
+        return float(f_b)
+    i = above[0]
+    if i == 0:
+        return float(fine[0])
+    frac = (cutoff_db - s11_dB[i - 1]) / (s11_dB[i] - s11_dB[i - 1])
+    return float(fine[i - 1] + frac * (fine[i] - fine[i - 1]))
+
+
+def refine(sim_path, f_lo, f_hi, Z_ref=50, port_nr=1, cutoff_dbs=analysis.cutoff_dbs,
+           coarse_points=refine_coarse_points, zoom_points=refine_zoom_points):
+    """
+    Resonance and S11 bandwidths, zoomed in from a coarse grid.
+
+    The port is evaluated on `coarse_points` frequencies over the band, then again on
+    `zoom_points` frequencies between the neighbours of the S11 minimum and of every
+    threshold crossing.
+
+    :param f_lo: lower end of the band (Hz)
+    :param f_hi: upper end of the band (Hz)
+    :param cutoff_dbs: S11 thresholds (dB)
+    :return: namespace with the resonance `f_res`, `s11_dB` and `Zin` there (of the
+             simulated port), and `bandwidths`, a dict cutoff_db -> (lower, upper) frequency
+    """
+    freq = np.linspace(f_lo, f_hi, coarse_points)
+    s11_dB = 20 * np.log10(np.abs(calc_port(sim_path, freq, Z_ref, port_nr).s11))
+    idx = analysis.resonance_index(s11_dB)
+
+    fine = np.linspace(freq[max(idx - 1, 0)], freq[min(idx + 1, len(freq) - 1)], zoom_points)
+    p = calc_port(sim_path, fine, Z_ref, port_nr)
+    fine_dB = 20 * np.log10(np.abs(p.s11))
+    i = analysis.resonance_index(fine_dB)
+    res = types.SimpleNamespace(f_res=analysis.resonance_frequency(fine, fine_dB), s11_dB=float(fine_dB[i]),
+                                Zin=complex(p.Zin[i]), bandwidths={})
+
+    lower, upper = analysis.band_edges(s11_dB, idx, cutoff_dbs)
+    for cutoff_db, lo, hi in zip(cutoff_dbs, lower, upper):
+        # the edges are the first coarse samples at or above the threshold, the crossing
+        # lies between them and their neighbour towards the resonance
+        f_lower = _zoom_crossing(sim_path, freq[lo + 1], freq[lo], cutoff_db, Z_ref, port_nr, zoom_points) \
+            if lo < idx and s11_dB[lo] >= cutoff_db else float(freq[lo])
+        f_upper = _zoom_crossing(sim_path, freq[hi - 1], freq[hi], cutoff_db, Z_ref, port_nr, zoom_points) \
+            if hi > idx and s11_dB[hi] >= cutoff_db else float(freq[hi])
+        res.bandwidths[cutoff_db] = (f_lower, f_upper)
+    return res
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Resonance from a truncated run by a matrix pencil fit of the port ring-down
+#
+# After the Gaussian excitation has ended, the port voltage and current are a free
+# ring-down, a sum of damped complex exponentials with poles common to both. The matrix
+# pencil method finds those poles from the recorded part of the ring-down (both signals
+# stacked into one Hankel matrix, so they share the poles), and the residues follow by
+# least squares. The fitted exponentials continue the signals beyond the end of the run in
+# closed form, so the port spectra, Zin and S11 are those of a run rung down to zero
+# energy, even if it was stopped at a fraction of its timesteps.
+#
+# The confidence compares fits over shorter parts of the record and with fewer poles: the
+# more their resonances agree relative to the half-power bandwidth f_res / 2Q, and the
+# better the model reproduces the record, the closer it is to 1.
+#
+# Usage:
+#   ./resonance_fit.py results/yagi_trena   (needs sim_info.json, see analyze.py)
+
+import os
+import types
+import argparse
+
+import numpy as np
+
+import analysis
+import port_data
+
+# samples per period of the highest frequency of the excitation after decimation
+oversampling = 4
+
+# at most this many samples of the ring-down enter the fit
+max_samples = 2000
+
+# singular values below this fraction of the largest one are noise; at most `max_order` poles
+svd_tolerance = 1e-4
+max_order = 40
+
+# fractions of the ring-down and pole counts of the fits compared for the confidence
+spread_windows = (0.6, 0.8, 1.0)
+spread_orders = (0, -2)
+
+# relative RMS error of the fit at which the confidence drops to 1/e
+fit_error_scale = 0.05
+
+
+def excitation_end(fc):
+    """
+    Time (s) at which the Gaussian excitation of openEMS with half bandwidth `fc` is over.
+    """
+    return 9 / (np.pi * fc)
+
+
+def matrix_pencil(signals, order=None, tolerance=svd_tolerance):
+    """
+    Common poles of uniformly sampled signals.
+
+    :param signals: list of arrays of equal length
+    :param order: number of poles, from the singular values by default
+    :return: poles z (per sample)
+    """
+    n = len(signals[0])
+    pencil = n // 3
+    rows = np.arange(n - pencil)[:, None] + np.arange(pencil + 1)[None, :]
+    y = np.vstack([s[rows] for s in signals])
+    _, sv, vh = np.linalg.svd(y, full_matrices=False)
+    if order is None:
+        order = int(np.sum(sv > tolerance * sv[0]))
+    order = max(1, min(order, max_order, pencil))
+    v = vh[:order].conj().T
+    return np.linalg.eigvals(np.linalg.pinv(v[:-1]) @ v[1:])
+
+
+def residues(z, signal):
+    """
+    Least squares amplitudes of the poles `z` in a signal starting at sample 0.
+    """
+    vander = z[None, :] ** np.arange(len(signal))[:, None]
+    return np.linalg.lstsq(vander, signal.astype(complex), rcond=None)[0]
+
+
+def _fit(t, signals, t_start, f_max, window=1.0, order=None):
+    # decimated ring-down from t_start on, a fraction `window` of what was recorded
+    dt = t[1] - t[0]
+    first = np.searchsorted(t, t_start)
+    last = first + int(window * (len(t) - first))
+    step = max(1, int(1 / (oversampling * f_max * dt)), int(np.ceil((last - first) / max_samples)))
+    idx = np.arange(first, last, step)
+    if len(idx) < 12:
+        raise ValueError("too little ring-down recorded after the excitation for a fit")
+    samples = [s[idx] for s in signals]
+    scale = [np.sqrt(np.mean(s ** 2)) or 1.0 for s in samples]
+    z = matrix_pencil([s / k for s, k in zip(samples, scale)], order)
+
+    # only decaying poles may continue the signals
+    z = z[np.abs(z) < 1]
+    poles = np.log(z) / (step * dt)
+    amps = [residues(z, s) for s in samples]
+    model = [np.real(z[None, :] ** np.arange(len(s))[:, None] @ a) for s, a in zip(samples, amps)]
+    error = np.sqrt(sum(np.sum((s - m) ** 2) for s, m in zip(samples, model)) / sum(np.sum(s ** 2) for s in samples))
+    return types.SimpleNamespace(poles=poles, amps=amps, t0=t[idx[0]], order=len(z), error=float(error))
+
+
+def _spectrum(t, x, fit, amps, freq):
+    # DFT of the record plus the closed-form sum of the fitted exponentials after it
+    dt = t[1] - t[0]
+    w = 2j * np.pi * np.asarray(freq)[:, None]
+    q = np.exp((fit.poles[None, :] - w) * dt)
+    tail = np.exp(fit.poles[None, :] * (t[-1] - fit.t0) - w * t[-1]) * q / (1 - q) @ amps
+    return port_data.dft(t, x, freq) + 2 * dt * tail
+
+
+def fit_port(sim_path, f0, fc, Z_ref=50, port_nr=1, freq=None):
+    """
+    Resonance, Q and Zin of a port from its (possibly truncated) ring-down.
+
+    :param f0: center of the excitation band (Hz)
+    :param fc: half width of the excitation band (Hz)
+    :param Z_ref: port resistance
+    :param freq: frequencies of the extrapolated port quantities, 2001 over the band by default
+    :return: namespace with `f_res`, `Q`, `Zin` and `s11_dB` at the resonance, `confidence`
+             (0..1), the relative fit error `fit_error`, the spread of the resonance over the
+             compared fits `f_res_spread` (Hz), all `poles` (1/s) and the extrapolated port
+             quantities `port` (see `port_data.calc_port`)
+    :raises ValueError: if the run ended before the excitation
+    """
+    t_u, u = port_data.read_probe(os.path.join(sim_path, "port_ut{}".format(port_nr)))
+    t_i, i = port_data.read_probe(os.path.join(sim_path, "port_it{}".format(port_nr)))
+    n = min(len(t_u), len(t_i))
+    t, u, i = t_u[:n], u[:n], i[:n]
+    if freq is None:
+        freq = np.linspace(f0 - fc, f0 + fc, 2001)
+
+    def resonance(fit):
+        p = port_data.from_spectra(freq, _spectrum(t, u, fit, fit.amps[0], freq),
+                                   _spectrum(t, i, fit, fit.amps[1], freq), Z_ref, t[-1])
+        s11_dB = 20 * np.log10(np.abs(p.s11))
+        return analysis.resonance_frequency(freq, s11_dB), p
+
+    best = _fit(t, [u, i], excitation_end(fc), f0 + fc)
+    f_res, port = resonance(best)
+    others = [_fit(t, [u, i], excitation_end(fc), f0 + fc, window, best.order + d)
+              for window in spread_windows for d in spread_orders if (window, d) != (1.0, 0)]
+    spread = float(np.std([f_res] + [resonance(fit)[0] for fit in others]))
+
+    # Q of the pole closest to the resonance
+    pole = best.poles[np.argmin(np.abs(best.poles.imag / (2 * np.pi) - f_res))]
+    Q = float(abs(pole.imag) / (2 * -pole.real))
+    at = port_data.from_spectra([f_res], _spectrum(t, u, best, best.amps[0], [f_res]),
+                                _spectrum(t, i, best, best.amps[1], [f_res]), Z_ref, t[-1])
+    confidence = np.exp(-spread / (f_res / (2 * Q)) - best.error / fit_error_scale)
+    if f_res in (freq[0], freq[-1]):
+        # the S11 minimum at an end of the band is no resonance
+        confidence = 0.0
+    return types.SimpleNamespace(
+        f_res=f_res,
+        Q=Q,
+        Zin=complex(at.Zin[0]),
+        s11_dB=float(20 * np.log10(np.abs(at.s11[0]))),
+        confidence=float(confidence),
+        fit_error=best.error,
+        f_res_spread=spread,
+        poles=best.poles,
+        port=port,
+    )
+
+
+if __name__ == "__main__":
+    import analyze
+    import symmetry
+
+    parser = argparse.ArgumentParser(description="Resonance of a (truncated) run from its port ring-down")
+    parser.add_argument("sim_path", help="result directory with a " + analyze.info_file)
+    args = parser.parse_args()
+
+    info = analyze.load_info(args.sim_path)
+    res = fit_port(args.sim_path, info["f0"], info["fc"], info["Z_ref"])
+    Zin = res.Zin * symmetry.impedance_factor(info["planes"])
+    print("resonance at {:.4f} MHz, Q {:.1f}, {:.1f} dB at {:.1f}{:+.1f}j Ohm".format(
+        res.f_res / 1e6, res.Q, res.s11_dB, Zin.real, Zin.imag))
+    print("confidence {:.2f} (fit error {:.2%}, resonance spread {:.1f} kHz, {:.3g} s recorded)".format(
+        res.confidence, res.fit_error, res.f_res_spread / 1e3, res.port.t_end))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# Columnar store of the results of all runs
+#
+# Every run appends one row to a table of scalars (`index_file`): parameters, resonance,
+# S11 and Zin there, bandwidths of the S11 thresholds and far-field metrics near the
+# resonance, one NumPy array per column. The full results of the run (freq, complex Zin
+# and s11, band edges and the far-field metrics over all analyzed frequencies) go into a
+# file of their own below `runs/`. Queries only load the index, so they take milliseconds
+# even over thousands of runs, without opening any openEMS dump. Concurrent writers (the
+# sweep workers) are serialized with a lock file.
+#
+# Usage:
+#   ./result_store.py                                        list all runs
+#   ./result_store.py --near 145.825e6 200e3 --sort Dmax_dBi --desc
+#   ./result_store.py --range p_hairpin_length 40 60 -c f_res r x p_hairpin_length
+
+import os
+import json
+import time
+import fcntl
+import argparse
+import contextlib
+
+import numpy as np
+
+import analysis
+
+# directory of the store
+store_root = os.path.abspath(os.path.join("results", "store"))
+
+# table of the scalar columns of all runs
+index_file = "index.npz"
+
+# far-field metrics (pattern_metrics.py) copied into the index, at the analyzed frequency
+# closest to the resonance
+farfield_columns = ["Dmax_dBi", "gain_dBi", "efficiency", "fb_dB", "hpbw_E", "hpbw_H", "sll_dB"]
+
+
+@contextlib.contextmanager
+def _locked(root):
+    os.makedirs(os.path.join(root, "runs"), exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _save(fn, arrays):
+    # readers never see a partially written file
+    tmp = fn + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, fn)
+
+
+def _run_file(root, run_id):
+    return os.path.join(root, "runs", "{:06d}.npz".format(int(run_id)))
+
+
+def summary(params, freq, Zin, s11, cutoff_dbs=analysis.cutoff_dbs, band_edges=None, farfield=None, f_res=None):
+    """
+    Index row and full arrays of a run.
+
+    :param band_edges: dict cutoff_db -> (lower, upper) frequency (Hz), e.g. from
+                       `port_data.refine`; from the S11 samples by default
+    :param farfield: result of `pattern_metrics.metrics`
+    :param f_res: resonance frequency (Hz), the interpolated S11 minimum by default
+    :return: tuple ``(row, arrays)`` of dicts
+    """
+    freq, Zin, s11 = np.asarray(freq, dtype=float), np.asarray(Zin), np.asarray(s11)
+    s11_dB = 20.0 * np.log10(np.abs(s11))
+    idx = analysis.resonance_index(s11_dB)
+    if f_res is None:
+        f_res = analysis.resonance_frequency(freq, s11_dB)
+    if band_edges is None:
+        lower, upper = analysis.band_edges(s11_dB, idx, cutoff_dbs)
+        band_edges = {c: (freq[lo], freq[hi]) for c, lo, hi in zip(cutoff_dbs, lower, upper)}
+    cutoffs = sorted(band_edges, reverse=True)
+
+    row = {"f_res": float(f_res), "s11_dB": float(s11_dB[idx]), "r": float(Zin[idx].real), "x": float(Zin[idx].imag)}
+    for c in cutoffs:
+        row["bw_{:g}".format(c)] = float(band_edges[c][1] - band_edges[c][0])
+    for key, value in params.items():
+        if isinstance(value, (bool, int, float, np.number)):
+            row["p_" + key] = float(value)
+
+    arrays = {
+        "freq": freq,
+        "Zin": Zin,
+        "s11": s11,
+        "cutoff_dbs": np.array(cutoffs, dtype=float),
+        "band_lower": np.array([band_edges[c][0] for c in cutoffs], dtype=float),
+        "band_upper": np.array([band_edges[c][1] for c in cutoffs], dtype=float),
+    }
+    if farfield is not None:
+        at = np.argmin(np.abs(farfield.freq - f_res))
+        for key, value in vars(farfield).items():
+            arrays["ff_" + key] = np.asarray(value)
+            if key in farfield_columns:
+                row[key] = float(value[at])
+    return row, arrays
+
+
+def load_index(root=store_root):
+    """
+    Scalar columns of all runs.
+
+    :return: dict column -> array, empty if nothing was stored yet
+    """
+    fn = os.path.join(root, index_file)
+    if not os.path.exists(fn):
+        return {}
+    with np.load(fn) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _set_row(index, pos, row):
+    # the index with `row` at position `pos` (appended if pos == number of rows), columns
+    # missing on either side are filled with NaN or ""
+    n = len(index["id"]) if index else 0
+    res = {}
+    for key in list(index) + [k for k in row if k not in index]:
+        value = row.get(key)
+        col = index.get(key)
+        if col is None:
+            col = np.full(n, "") if isinstance(value, str) else np.full(n, np.nan)
+        if value is None:
+            value = "" if col.dtype.kind == "U" else np.nan
+        col = col.astype(np.result_type(col, np.array(value)))
+        res[key] = np.append(col, value) if pos == n else col
+        res[key][pos] = value
+    return res
+
+
+def record(name, params, freq, Zin, s11, cutoff_dbs=analysis.cutoff_dbs, band_edges=None, farfield=None,
+           f_res=None, sim_path="", root=store_root):
+    """
+    Add a run to the store.
+
+    Recording the same parameters from the same result directory again (e.g. when it is
+    reanalysed) replaces the earlier row.
+
+    :param name: antenna name
+    :param params: dict of the run parameters, the numeric ones become `p_<name>` columns
+    :param sim_path: result directory of the run
+    :return: id of the run
+    """
+    row, arrays = summary(params, freq, Zin, s11, cutoff_dbs, band_edges, farfield, f_res)
+    params_json = json.dumps(params, sort_keys=True, default=float)
+    row.update(name=name, sim_path=sim_path, params=params_json, time=time.time())
+    arrays["params"] = np.array(params_json)
+
+    with _locked(root):
+        index = load_index(root)
+        n = len(index["id"]) if index else 0
+        pos = n
+        if n:
+            same = np.flatnonzero((index["sim_path"] == sim_path) & (index["params"] == params_json))
+            if sim_path and len(same):
+                pos = same[0]
+        row["id"] = float(index["id"][pos] if pos < n else (np.max(index["id"]) + 1 if n else 0))
+        _save(_run_file(root, row["id"]), arrays)
+        _save(os.path.join(root, index_file), _set_row(index, pos, row))
+    return int(row["id"])
+
+
+def load_run(run_id, root=store_root):
+    """
+    Full arrays of a run, with its parameters decoded into the dict `params`.
+    """
+    with np.load(_run_file(root, run_id)) as data:
+        res = {key: data[key] for key in data.files}
+    res["params"] = json.loads(str(res["params"]))
+    return res
+
+
+def query(where=None, sort=None, descending=False, limit=None, root=store_root):
+    """
+    Select runs from the index.
+
+    For example, all runs with the resonance within 200 kHz of f0, sorted by directivity:
+    ``query(lambda c: np.abs(c["f_res"] - f0) < 200e3, sort="Dmax_dBi", descending=True)``
+
+    :param where: function of the dict of index columns returning a boolean mask
+    :param sort: column to sort by, NaN last
+    :param limit: return at most this many runs
+    :return: dict column -> array of the selected runs
+    """
+    index = load_index(root)
+    if not index:
+        return index
+    sel = np.arange(len(index["id"]))
+    if where is not None:
+        sel = sel[np.asarray(where(index), dtype=bool)]
+    if sort is not None:
+        key = index[sort][sel]
+        if key.dtype.kind == "U":
+            order = np.argsort(key, kind="stable")
+            order = order[::-1] if descending else order
+        else:
+            order = np.argsort(-key if descending else key, kind="stable")
+        sel = sel[order]
+    return {key: col[sel[:limit]] for key, col in index.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the stored results of all runs")
+    parser.add_argument("--near", type=float, nargs=2, metavar=("F", "TOL"),
+                        help="resonance within TOL of F (Hz)")
+    parser.add_argument("--range", nargs=3, action="append", default=[], metavar=("COLUMN", "MIN", "MAX"),
+                        help="column value between MIN and MAX, can be repeated")
+    parser.add_argument("--name", help="antenna name")
+    parser.add_argument("-s", "--sort", help="column to sort by")
+    parser.add_argument("--desc", action="store_true", help="sort in descending order")
+    parser.add_argument("-n", "--limit", type=int, help="show at most this many runs")
+    parser.add_argument("-c", "--columns", nargs="+", default=["f_res", "s11_dB", "r", "x", "Dmax_dBi", "fb_dB"],
+                        help="columns to show besides id and parameters")
+    parser.add_argument("-r", "--root", default=store_root, help="store directory")
+    args = parser.parse_args()
+
+    def where(c):
+        mask = np.ones(len(c["id"]), dtype=bool)
+        if args.near:
+            mask &= np.abs(c["f_res"] - args.near[0]) <= args.near[1]
+        for column, lo, hi in args.range:
+            mask &= (c[column] >= float(lo)) & (c[column] <= float(hi))
+        if args.name:
+            mask &= c["name"] == args.name
+        return mask
+
+    start = time.time()
+    res = query(where, args.sort, args.desc, args.limit, args.root)
+    elapsed = time.time() - start
+    n = len(res["id"]) if res else 0
+    columns = [c for c in args.columns if c in res]
+    print("\t".join(["id"] + columns + ["params"]))
+    for i in range(n):
+        print("\t".join(["{:d}".format(int(res["id"][i]))] + ["{:.6g}".format(res[c][i]) for c in columns]
+                        + [res["params"][i]]))
+    print("{} runs in {:.1f} ms".format(n, 1e3 * elapsed))
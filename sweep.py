@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# Parallel geometry sweep for the Yagi-Uda antenna of yagi_trena.py
+#
+# Every parameter set is an independent openEMS run (model build, fdtd.Run and
+# feed.CalcPort) executed on a process pool, each one in its own output directory
+# below `output_root`.
+#
+# Usage:
+#   ./sweep.py                  sweep the `sweep_grid` defined below
+#   ./sweep.py points.json      sweep a grid ({"name": [values]}) or a list of parameter sets
+#   ./sweep.py -j 8 points.json use 8 worker processes
+
+import os
+import json
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import analysis
+import analyze
+import engine_tuner
+import fdtd_cache
+import hairpin
+import pattern_metrics
+import port_data
+import result_store
+import symmetry
+import yagi_trena as yagi
+
+# default grid, every combination of the values below is simulated
+sweep_grid = {
+    "driven_length": [892, 902, 912],
+    "hairpin_length": [48, 58, 68],
+}
+
+# number of simulations running at the same time, the best split of the cores measured by
+# engine_tuner.py (a quarter of the cores without a profile)
+jobs = engine_tuner.split()[0]
+
+# every parameter set is simulated in a subdirectory of this one
+output_root = os.path.abspath(os.path.join("results", "yagi_trena_sweep"))
+
+# coarse full-sphere grid (degrees) for the far-field metrics at resonance
+farfield_theta = np.arange(0.0, 181.0, 5.0)
+farfield_phi = np.arange(0.0, 360.0, 5.0)
+
+
+def expand_grid(grid):
+    """
+    Expand a grid of parameter values into the list of all parameter sets.
+
+    :param grid: dict mapping a `yagi_trena.build_model` argument to a list of values
+    :return: list of dicts, one per combination
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def point_name(params):
+    """
+    Stable directory name of a parameter set, so reruns of a point land in the same place.
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return "p_" + digest[:12]
+
+
+def run_point(params, root=output_root, record_nf2ff=False, jobs=1):
+    """
+    Simulate one parameter set and evaluate the feed port.
+
+    Identical runs are restored from the FDTD cache instead of simulated again. The port
+    quantities are written to `port.npz` in the run directory, next to the parameter set in
+    `params.json`, and the results are added to the result store (result_store.py).
+
+    :param params: dict of `yagi_trena.build_model` arguments
+    :param root: directory holding the run directories
+    :param record_nf2ff: also record the NF2FF box (slower) and evaluate the far-field at
+                         the resonance
+    :param jobs: number of simulations running at the same time, for the thread count
+    :return: dict with the parameters, run directory and resonance summary; with
+             `record_nf2ff` also the maximum directivity `Dmax_dB` and the front-to-back
+             ratio `fb_dB` (director, +x, versus reflector, -x)
+    """
+    name = point_name(params)
+    output_dir = os.path.join(root, name)
+    model_dir = os.path.join(root, "models")
+    os.makedirs(model_dir, exist_ok=True)
+
+    fdtd, csx, feed, nf2ff = yagi.build_model(record_nf2ff=record_nf2ff, **params)
+    model_fn = os.path.join(model_dir, name + ".xml")
+    csx.Write2XML(model_fn)
+    # the model lives outside of output_dir, which is wiped when the simulation starts
+    fdtd_cache.run_cached(fdtd, output_dir, model_fn, verbose=0, run=yagi.fdtd_runner(fdtd, jobs),
+                          **yagi.fdtd_settings())
+
+    with open(os.path.join(output_dir, "params.json"), "w") as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+
+    freq = yagi.freq
+    Z_ref = yagi.feed_resistance / symmetry.impedance_factor(yagi.sim_planes)
+    stub = yagi.post_hairpin(**params)
+    analyze.write_info(output_dir, "Yagi-Uda", yagi.f0, yagi.fc, Z_ref, yagi.sim_planes, nf2ff,
+                       yagi.nf_ff_transition_distance, farfield_theta, farfield_phi, hairpin=stub)
+    feed.CalcPort(output_dir, freq)
+    Zin = feed.uf_tot / feed.if_tot * symmetry.impedance_factor(yagi.sim_planes)
+    s11 = feed.uf_ref / feed.uf_inc
+    if stub is not None:
+        Zin = hairpin.apply(freq, Zin, **stub)
+        s11 = hairpin.reflection(Zin, yagi.feed_resistance)
+    s11_dB = 20.0 * np.log10(np.abs(s11))
+    np.savez(os.path.join(output_dir, "port.npz"), freq=freq, Zin=Zin, s11=s11,
+             P_acc=feed.P_acc * symmetry.power_factor(yagi.sim_planes))
+
+    idx = np.argmin(s11_dB)
+    if stub is not None:
+        # the zoom works on the probes, i.e. without the hairpin
+        f_res, band_edges = analysis.resonance_frequency(freq, s11_dB), None
+    else:
+        # resonance and band edges zoomed in with the chirp-Z transform, finer than the grid of `freq`
+        fine = port_data.refine(output_dir, freq[0], freq[-1], Z_ref)
+        f_res, band_edges = fine.f_res, fine.bandwidths
+    result = {
+        "params": params,
+        "output_dir": output_dir,
+        "f_res": f_res,
+        "s11_dB": s11_dB[idx],
+        "Zin": Zin[idx],
+    }
+
+    metrics = None
+    if record_nf2ff:
+        nf2ff_res = nf2ff.CalcNF2FF(output_dir, [freq[idx]], farfield_theta, farfield_phi,
+                                    radius=yagi.nf_ff_transition_distance, outfile="nf2ff_resonance.h5")
+        metrics = pattern_metrics.metrics(nf2ff_res, theta=farfield_theta, phi=farfield_phi)
+        result["Dmax_dB"] = metrics.Dmax_dBi[0]
+        result["fb_dB"] = metrics.fb_dB[0]
+    result_store.record("Yagi-Uda", params, freq, Zin, s11, band_edges=band_edges, farfield=metrics,
+                        f_res=f_res, sim_path=output_dir)
+    return result
+
+
+def run_sweep(points, jobs=jobs, root=output_root, record_nf2ff=False):
+    """
+    Simulate a list of parameter sets concurrently.
+
+    :param points: list of dicts of `yagi_trena.build_model` arguments
+    :param jobs: number of worker processes
+    :param root: directory holding the run directories
+    :param record_nf2ff: also record the NF2FF box and evaluate the far-field in every run
+    :return: list of `run_point` results, in the order of `points`
+    """
+    # with fewer points than jobs, every run gets more threads
+    jobs = max(1, min(jobs, len(points)))
+    results = [None] * len(points)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_point, params, root, record_nf2ff, jobs): n for n, params in enumerate(points)}
+        for future in as_completed(futures):
+            n = futures[future]
+            results[n] = future.result()
+            print(
+                "[{}/{}] {}: resonance at {} MHz with {} dB at {} Ohm".format(
+                    sum(r is not None for r in results),
+                    len(points),
+                    points[n],
+                    round(results[n]["f_res"] / 1e6, 2),
+                    round(results[n]["s11_dB"], 1),
+                    round(np.real(results[n]["Zin"]), 1),
+                )
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel geometry sweep of yagi_trena.py")
+    parser.add_argument("points", nargs="?", help="JSON file with a grid or a list of parameter sets")
+    parser.add_argument("-j", "--jobs", type=int, default=jobs, help="number of concurrent simulations")
+    parser.add_argument("-o", "--output", default=output_root, help="directory for the run directories")
+    parser.add_argument("--nf2ff", action="store_true", help="record the NF2FF box and evaluate the far-field at resonance")
+    args = parser.parse_args()
+
+    points = sweep_grid
+    if args.points:
+        with open(args.points) as f:
+            points = json.load(f)
+    if isinstance(points, dict):
+        points = expand_grid(points)
+
+    print("Sweeping {} parameter sets with {} jobs".format(len(points), args.jobs))
+    results = run_sweep(points, jobs=args.jobs, root=args.output, record_nf2ff=args.nf2ff)
+
+    print("=" * 80)
+    for res in sorted(results, key=lambda r: abs(r["f_res"] - yagi.f0)):
+        print(
+            "{} MHz  {} dB  {} Ohm  {}  {}".format(
+                round(res["f_res"] / 1e6, 2),
+                round(res["s11_dB"], 1),
+                round(np.real(res["Zin"]), 1),
+                res["params"],
+                os.path.relpath(res["output_dir"]),
+            )
+        )
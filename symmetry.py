@@ -0,0 +1,93 @@
+# Symmetry planes: simulate half, a quarter or an eighth of the domain
+#
+# A symmetry plane through the origin replaces the lower half of the domain along its axis
+# by a PEC or PMC boundary: PEC where the structure's currents cross the plane
+# perpendicularly and symmetrically (z=0 for antennas along z, like a monopole over ground),
+# PMC where the currents lie in the plane (x=0 or y=0 for a dipole along z).
+#
+# The lumped port is cut by the planes too. A PEC plane halves the port voltage, a PMC
+# plane halves its current, so the impedance of the reduced model is
+# Zin / impedance_factor(planes) and its port resistance must be scaled alike to keep S11.
+# Every plane halves the power. The NF2FF box gets the planes as mirrors and no face on
+# them, so its far-field is the one of the full structure.
+#
+# Planes are given as a list of (axis, type) tuples, e.g. [("z", "PEC"), ("x", "PMC")].
+
+_AXES = "xyz"
+
+# NF2FF mirror codes
+_MIRROR = {"PEC": 1, "PMC": 2}
+
+
+def boundary(boundary_cond, planes):
+    """
+    Boundary conditions with the lower side of every symmetry plane axis replaced.
+
+    :param boundary_cond: list of 6 conditions (xmin, xmax, ymin, ymax, zmin, zmax)
+    """
+    bc = list(boundary_cond)
+    for axis, kind in planes:
+        bc[2 * _AXES.index(axis)] = kind
+    return bc
+
+
+def impedance_factor(planes):
+    """
+    Ratio of the impedance of the full structure to the one of the reduced model.
+    """
+    n_pec = sum(kind == "PEC" for _, kind in planes)
+    return 2.0 ** n_pec / 2.0 ** (len(planes) - n_pec)
+
+
+def power_factor(planes):
+    """
+    Ratio of the power of the full structure to the one of the reduced model.
+    """
+    return 2.0 ** len(planes)
+
+
+def clip_box(start, stop, planes):
+    """
+    Part of a box on the simulated side of the symmetry planes.
+
+    :return: new (start, stop)
+    """
+    start, stop = list(start), list(stop)
+    for axis, _ in planes:
+        n = _AXES.index(axis)
+        lo, hi = sorted((start[n], stop[n]))
+        start[n], stop[n] = max(lo, 0), max(hi, 0)
+    return start, stop
+
+
+def mirrored(start, stop, planes):
+    """
+    True if a box lies entirely on the mirrored side of a plane, i.e. is replaced by the
+    image of its counterpart.
+    """
+    return any(max(start[_AXES.index(axis)], stop[_AXES.index(axis)]) <= 0 for axis, _ in planes)
+
+
+def clip_mesh(mesh, planes):
+    """
+    Remove the mesh lines on the mirrored side of the planes and add a line on each plane.
+    """
+    for axis, _ in planes:
+        lines = [x for x in mesh.GetLines(axis) if x > 0]
+        mesh.SetLines(axis, [0] + lines)
+
+
+def nf2ff_args(start, stop, planes):
+    """
+    Arguments of `fdtd.CreateNF2FFBox` for the reduced domain.
+
+    :return: dict with `start`, `stop`, `directions` and `mirror`
+    """
+    start, stop = clip_box(start, stop, planes)
+    directions = [True] * 6
+    mirror = [0] * 6
+    for axis, kind in planes:
+        n = _AXES.index(axis)
+        directions[2 * n] = False
+        mirror[2 * n] = _MIRROR[kind]
+    return dict(start=start, stop=stop, directions=directions, mirror=mirror)
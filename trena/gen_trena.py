@@ -1,53 +1,383 @@
-import xml.etree.ElementTree as ET
+#!/usr/bin/env python
+# Cross-section of the Trena (tape measure) elements from an SVG drawing
+#
+# Reads the outline path of the drawing, with all path commands (m, l, h, v, c, s, q, t,
+# a, z, absolute and relative) and the transforms of the path and its groups, flattens
+# the curves into line segments no farther than `flatten_tolerance` from the curve, and
+# decimates the outline with the Douglas-Peucker algorithm, either down to a geometric
+# tolerance or to a number of vertices. Every vertex of the polygon forces mesh lines in
+# the simulation, so the tolerance trades the accuracy of the profile for speed. The
+# result is printed as `Trena.points` for yagi_trena.py and dipole_trena.py.
+#
+# Usage:
+#   ./gen_trena.py                     every vertex of trena.svg
+#   ./gen_trena.py -t 0.02             drop vertices closer than 0.02 mm to the outline
+#   ./gen_trena.py -n 16 perfil.svg    at most 16 vertices
+
 import re
+import math
+import argparse
+import xml.etree.ElementTree as ET
+
+import numpy as np
 
+# thickness of the tape (mm), the outline is centered on it vertically
 thickness = 0.2
 
-def parse_svg_path_d(d_string):
-    tokens = re.findall(r'[a-zA-Z]|-?\d*\.?\d+', d_string)
-    points = []
-    current_pos = [0.0, 0.0]
-    command = ''
+# largest distance (mm) between a curve and the line segments replacing it
+flatten_tolerance = 1e-3
+
+_SVG_NS = "{http://www.w3.org/2000/svg}"
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_PARAMS = {"m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7, "z": 0}
+
+
+#############################################################################################
+# transforms
+
+def parse_transform(text):
+    """
+    Affine matrix of an SVG `transform` attribute.
+
+    :return: 3x3 array acting on column vectors (x, y, 1)
+    """
+    res = np.eye(3)
+    for name, args in re.findall(r"(\w+)\s*\(([^)]*)\)", text or ""):
+        v = [float(x) for x in re.findall(_NUMBER, args)]
+        m = np.eye(3)
+        if name == "matrix":
+            m[:2] = np.array(v).reshape(3, 2).T
+        elif name == "translate":
+            m[:2, 2] = [v[0], v[1] if len(v) > 1 else 0.0]
+        elif name == "scale":
+            m[0, 0], m[1, 1] = v[0], v[1] if len(v) > 1 else v[0]
+        elif name == "rotate":
+            a = math.radians(v[0])
+            m[:2, :2] = [[math.cos(a), -math.sin(a)], [math.sin(a), math.cos(a)]]
+            if len(v) == 3:
+                m = parse_transform("translate({},{})".format(v[1], v[2])) @ m \
+                    @ parse_transform("translate({},{})".format(-v[1], -v[2]))
+        elif name == "skewX":
+            m[0, 1] = math.tan(math.radians(v[0]))
+        elif name == "skewY":
+            m[1, 0] = math.tan(math.radians(v[0]))
+        else:
+            raise ValueError("unknown transform {}".format(name))
+        res = res @ m
+    return res
+
+
+def apply_transform(m, points):
+    """
+    Transform an array of points [n, 2] by the affine matrix `m`.
+    """
+    return points @ m[:2, :2].T + m[:2, 2]
+
+
+#############################################################################################
+# path parsing and curve flattening
+
+def _tokens(d):
+    # command letters and numbers; arc flags may be written without separators ("a1 1 0 01.5 2")
+    pos = 0
+    pattern = re.compile(r"\s*,?\s*(?:([a-zA-Z])|({}))".format(_NUMBER))
+    flag = re.compile(r"\s*,?\s*([01])")
+    command, n_args = None, 0
+    while True:
+        if command == "a" and n_args % 7 in (3, 4):
+            m = flag.match(d, pos)
+            if m:
+                pos = m.end()
+                n_args += 1
+                yield float(m.group(1))
+                continue
+        m = pattern.match(d, pos)
+        if not m:
+            if d[pos:].strip():
+                raise ValueError("invalid path data near {!r}".format(d[pos:pos + 20]))
+            return
+        pos = m.end()
+        if m.group(1):
+            command, n_args = m.group(1).lower(), 0
+            yield m.group(1)
+        else:
+            n_args += 1
+            yield float(m.group(2))
+
+
+def _samples(n):
+    return np.linspace(0.0, 1.0, n + 1)[1:, None]
+
+
+def _segments(max_second_derivative, tolerance):
+    # chords of a curve stay within `tolerance` if h^2 |B''| / 8 <= tolerance
+    return max(1, int(math.ceil(math.sqrt(max_second_derivative / (8 * tolerance)))))
+
+
+def flatten_cubic(p0, p1, p2, p3, tolerance=flatten_tolerance):
+    """
+    Points along a cubic Bezier curve, without `p0`.
+    """
+    n = _segments(6 * max(np.linalg.norm(p0 - 2 * p1 + p2), np.linalg.norm(p1 - 2 * p2 + p3)), tolerance)
+    t = _samples(n)
+    return (1 - t) ** 3 * p0 + 3 * (1 - t) ** 2 * t * p1 + 3 * (1 - t) * t ** 2 * p2 + t ** 3 * p3
+
+
+def flatten_quadratic(p0, p1, p2, tolerance=flatten_tolerance):
+    """
+    Points along a quadratic Bezier curve, without `p0`.
+    """
+    t = _samples(_segments(2 * np.linalg.norm(p0 - 2 * p1 + p2), tolerance))
+    return (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
+
+
+def flatten_arc(p0, rx, ry, rotation, large_arc, sweep, p1, tolerance=flatten_tolerance):
+    """
+    Points along an elliptical arc in SVG endpoint notation, without `p0`.
+    """
+    if np.allclose(p0, p1):
+        return np.empty((0, 2))
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0:
+        return p1[None, :]
+    # center parametrization, SVG 1.1 appendix F.6.5
+    phi = math.radians(rotation)
+    rot = np.array([[math.cos(phi), -math.sin(phi)], [math.sin(phi), math.cos(phi)]])
+    x1, y1 = rot.T @ ((p0 - p1) / 2)
+    scale = x1 ** 2 / rx ** 2 + y1 ** 2 / ry ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    num = rx ** 2 * ry ** 2 - rx ** 2 * y1 ** 2 - ry ** 2 * x1 ** 2
+    coef = math.sqrt(max(0.0, num / (rx ** 2 * y1 ** 2 + ry ** 2 * x1 ** 2)))
+    if large_arc == sweep:
+        coef = -coef
+    cx, cy = coef * rx * y1 / ry, -coef * ry * x1 / rx
+    center = rot @ [cx, cy] + (p0 + p1) / 2
+    theta0 = math.atan2((y1 - cy) / ry, (x1 - cx) / rx)
+    dtheta = math.atan2((-y1 - cy) / ry, (-x1 - cx) / rx) - theta0
+    if sweep and dtheta < 0:
+        dtheta += 2 * math.pi
+    elif not sweep and dtheta > 0:
+        dtheta -= 2 * math.pi
+
+    # the sagitta of every chord stays within the tolerance
+    step = 2 * math.acos(max(-1.0, 1 - tolerance / max(rx, ry)))
+    n = max(1, int(math.ceil(abs(dtheta) / step)))
+    theta = theta0 + dtheta * _samples(n)[:, 0]
+    pts = np.stack([rx * np.cos(theta), ry * np.sin(theta)], axis=1) @ rot.T + center
+    pts[-1] = p1
+    return pts
+
+
+def parse_path(d, tolerance=flatten_tolerance):
+    """
+    Flatten the `d` attribute of an SVG path.
+
+    :return: list of subpaths, each a tuple ``(points, closed)`` with an array [n, 2]
+    """
+    tokens = list(_tokens(d))
+    subpaths = []
+    pts, closed = [], False
+    pos = start = np.zeros(2)
+    # last control point of the previous curve, for s and t
+    last_ctrl, last_cmd = None, ""
+    command = None
     i = 0
+
+    def finish():
+        if pts:
+            subpaths.append((np.vstack(pts), closed))
+
     while i < len(tokens):
-        token = tokens[i]
-        if token.isalpha():
-            command = token
+        if isinstance(tokens[i], str):
+            command = tokens[i]
             i += 1
-            if command.lower() == 'z':
-                break
+            if command.lower() == "z":
+                closed = True
+                pos = start
+                last_cmd = "z"
+                continue
+        elif command is None:
+            raise ValueError("path data has to start with a command")
+        c = command.lower()
+        rel = command.islower()
+        n = _PARAMS[c]
+        if len(tokens) < i + n or any(isinstance(x, str) for x in tokens[i:i + n]):
+            raise ValueError("missing arguments of {}".format(command))
+        v = np.array(tokens[i:i + n], dtype=float)
+        i += n
+        base = pos if rel else np.zeros(2)
+
+        if c == "m":
+            finish()
+            pos = start = base + v
+            pts, closed = [pos[None, :]], False
+            # further coordinate pairs are implicit line-to commands
+            command = "l" if rel else "L"
+            new = np.empty((0, 2))
+        elif c == "l":
+            new = (base + v)[None, :]
+        elif c == "h":
+            new = np.array([[base[0] + v[0] if rel else v[0], pos[1]]])
+        elif c == "v":
+            new = np.array([[pos[0], base[1] + v[0] if rel else v[0]]])
+        elif c in "cs":
+            if c == "c":
+                c1, c2, end = base + v[0:2], base + v[2:4], base + v[4:6]
+            else:
+                c1 = 2 * pos - last_ctrl if last_cmd in "cs" and last_ctrl is not None else pos
+                c2, end = base + v[0:2], base + v[2:4]
+            new = flatten_cubic(pos, c1, c2, end, tolerance)
+            last_ctrl = c2
+        elif c in "qt":
+            if c == "q":
+                c1, end = base + v[0:2], base + v[2:4]
+            else:
+                c1 = 2 * pos - last_ctrl if last_cmd in "qt" and last_ctrl is not None else pos
+                end = base + v[0:2]
+            new = flatten_quadratic(pos, c1, end, tolerance)
+            last_ctrl = c1
+        else:
+            new = flatten_arc(pos, v[0], v[1], v[2], bool(v[3]), bool(v[4]), base + v[5:7], tolerance)
+        if c != "m":
+            pts.append(new)
+            if len(new):
+                pos = new[-1]
+        last_cmd = c
+    finish()
+    return subpaths
+
+
+def find_paths(root, tolerance=flatten_tolerance):
+    """
+    All paths of an SVG document with the transforms of their groups applied.
+
+    :return: list of tuples ``(id, subpaths)``, see `parse_path`
+    """
+    res = []
+
+    def walk(element, m):
+        m = m @ parse_transform(element.get("transform"))
+        if element.tag == _SVG_NS + "path" and element.get("d"):
+            subpaths = [(apply_transform(m, p), closed) for p, closed in parse_path(element.get("d"), tolerance)]
+            res.append((element.get("id"), subpaths))
+        for child in element:
+            walk(child, m)
+
+    walk(root, np.eye(3))
+    return res
+
+
+#############################################################################################
+# decimation
+
+def _segment_distance(points, a, b):
+    # distance of every point to the segment from a to b
+    ab = b - a
+    length2 = ab @ ab
+    t = np.clip((points - a) @ ab / length2, 0, 1) if length2 > 0 else np.zeros(len(points))
+    return np.linalg.norm(points - (a + t[:, None] * ab), axis=1)
+
+
+def significance(points):
+    """
+    Douglas-Peucker significance of every vertex of a closed outline.
+
+    A vertex is kept by the decimation with tolerance `tol` if its significance is larger
+    than `tol`; the two vertices the outline is split at first are always kept.
+
+    :param points: array [n, 2], without repeating the first vertex at the end
+    :return: array [n]
+    """
+    n = len(points)
+    sig = np.zeros(n)
+    first = 0
+    second = int(np.argmax(np.linalg.norm(points - points[first], axis=1)))
+    sig[[first, second]] = np.inf
+    ring = np.vstack([points, points[:1]])
+    # ranges of the outline (end inclusive) with the significance of their parent split
+    stack = [(first, second, np.inf), (second, n, np.inf)]
+    while stack:
+        lo, hi, parent = stack.pop()
+        if hi - lo < 2:
             continue
-        if command.lower() in ['m', 'l']:
-            x = float(token)
-            y = float(tokens[i+1])
-            i += 2
-            if command == 'm' and not points:
-                current_pos = [x, y]
-            elif command == 'L':
-                current_pos = [x, y]
-            else: # 'l' ou 'm' implícito
-                current_pos[0] += x
-                current_pos[1] += y
-            points.append(tuple(current_pos))
-    return points
-
-with open('trena.svg') as f:
-    svg_content = f.read()
-
-namespaces = {'svg': 'http://www.w3.org/2000/svg'}
-root = ET.fromstring(svg_content)
-g_element = root.find('.//svg:g', namespaces)
-path_element = g_element.find('svg:path', namespaces)
-d_attribute = path_element.get('d')
-transform_attribute = g_element.get('transform')
-points = parse_svg_path_d(d_attribute)
-
-max_y = max(y for x, y in points)
-min_x = min(x for x, y in points)
-max_x = max(x for x, y in points)
-mid_x = (min_x + max_x) / 2.
-points = [(x - mid_x, max_y - y - thickness/2) for x, y in points]
-
-print("points = [" +
-    "[" + ",".join(f'{x:.3f}' for x,y in points) + "],"
-    "[" + ",".join(f'{y:.3f}' for x,y in points) + "]]")
+        dist = _segment_distance(ring[lo + 1:hi], ring[lo], ring[hi])
+        k = lo + 1 + int(np.argmax(dist))
+        # never more significant than the split that exposed it, so keeping by threshold or
+        # by count gives the same nested outlines
+        s = min(dist[k - lo - 1], parent)
+        sig[k] = s
+        stack += [(lo, k, s), (k, hi, s)]
+    return sig
+
+
+def decimate(points, tolerance=0.0, vertices=None):
+    """
+    Decimate a closed outline with the Douglas-Peucker algorithm.
+
+    :param tolerance: drop vertices that are at most this far from the decimated outline
+    :param vertices: keep at most this many vertices (and at least 3)
+    :return: decimated array of points, in the original order
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) > 1 and np.allclose(points[0], points[-1]):
+        points = points[:-1]
+    sig = significance(points)
+    keep = sig > tolerance
+    if vertices is not None and keep.sum() > vertices:
+        keep[:] = False
+        keep[np.argsort(-sig, kind="stable")[:max(3, vertices)]] = True
+    return points[keep]
+
+
+def deviation(points, decimated):
+    """
+    Largest distance of the vertices of an outline from its decimated version.
+    """
+    ring = np.vstack([decimated, decimated[:1]])
+    dist = np.min([_segment_distance(points, a, b) for a, b in zip(ring[:-1], ring[1:])], axis=0)
+    return float(np.max(dist))
+
+
+#############################################################################################
+
+def cross_section(fn, path_id=None, tolerance=0.0, vertices=None, flatten=flatten_tolerance):
+    """
+    Decimated outline of a drawing in the coordinates of `Trena.points`: x centered, y up
+    from the center line of the tape at its lowest point.
+
+    :param fn: SVG file
+    :param path_id: id of the outline path, the first closed path by default
+    :return: tuple ``(points, outline)`` of the decimated and the full outline, arrays [n, 2]
+    """
+    paths = find_paths(ET.parse(fn).getroot(), flatten)
+    if path_id is not None:
+        paths = [p for p in paths if p[0] == path_id]
+    closed = [sp for _, subpaths in paths for sp, is_closed in subpaths if is_closed]
+    if not closed and not paths:
+        raise ValueError("no path found in {}".format(fn))
+    outline = closed[0] if closed else paths[0][1][0][0]
+
+    # SVG y points down
+    x, y = outline[:, 0], outline[:, 1]
+    outline = np.stack([x - (x.min() + x.max()) / 2, y.max() - y - thickness / 2], axis=1)
+    if np.allclose(outline[0], outline[-1]):
+        outline = outline[:-1]
+    return decimate(outline, tolerance, vertices), outline
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trena.points from an SVG drawing of the tape cross-section")
+    parser.add_argument("svg", nargs="?", default="trena.svg", help="SVG file")
+    parser.add_argument("-p", "--path-id", help="id of the outline path (first closed path by default)")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.0, help="decimation tolerance (mm)")
+    parser.add_argument("-n", "--vertices", type=int, help="maximum number of vertices")
+    parser.add_argument("-f", "--flatten", type=float, default=flatten_tolerance, help="curve flattening tolerance (mm)")
+    args = parser.parse_args()
+
+    points, outline = cross_section(args.svg, args.path_id, args.tolerance, args.vertices, args.flatten)
+    print("# {} of {} vertices, largest deviation {:.4f} mm".format(len(points), len(outline),
+                                                                   deviation(outline, points)))
+    print("points = [" +
+          "[" + ",".join(f'{x:.3f}' for x, y in points) + "],"
+          "[" + ",".join(f'{y:.3f}' for x, y in points) + "]]")
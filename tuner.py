@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Closed-loop resonance tuner for yagi_trena.py
+#
+# Scales one or more length parameters by a common factor until the resonance (S11
+# minimum) lies within `tolerance` of f0. The first step comes from electromagnetic
+# scaling (resonance frequency inversely proportional to length), the following ones are
+# secant steps on 1/f_res, which is linear in the length for a pure scaling, safeguarded by
+# bisection once the target is bracketed. Every evaluation goes through sweep.run_point,
+# so repeated geometries are restored from the FDTD cache.
+#
+# Usage:
+#   ./tuner.py                                       tune driven_length
+#   ./tuner.py -p driven_length -p director_length   scale both lengths together
+
+import argparse
+
+import sweep
+import yagi_trena as yagi
+
+# length parameters scaled together by the tuner
+tune_params = ["driven_length"]
+
+# stop once the resonance is this close to f0 (Hz)
+tolerance = 100e3
+
+# give up after this many FDTD runs
+max_runs = 6
+
+
+def tune(params=None, names=tune_params, f_target=yagi.f0, tolerance=tolerance, max_runs=max_runs,
+         root=sweep.output_root, verbose=True):
+    """
+    Scale the length parameters `names` until the resonance is within `tolerance` of `f_target`.
+
+    :param params: fixed `yagi_trena.build_model` arguments; the tuned ones start from
+                   their value here or from the defaults in yagi_trena.py
+    :param names: length parameters scaled by a common factor
+    :param f_target: target resonance frequency (Hz)
+    :param tolerance: accepted resonance offset (Hz)
+    :param max_runs: maximum number of evaluations
+    :param root: directory holding the run directories
+    :return: tuple (params of the best run, list of (scale, f_res, run result) per evaluation)
+    """
+    params = dict(params or {})
+    base = {name: params.get(name, getattr(yagi, name)) for name in names}
+
+    def evaluate(scale):
+        point = dict(params, **{name: round(value * scale, 3) for name, value in base.items()})
+        res = sweep.run_point(point, root)
+        history.append((scale, res["f_res"], res))
+        if verbose:
+            print("tuner: run {} scale {:.5f} -> resonance at {} MHz ({:+.1f} kHz)".format(
+                len(history), scale, round(res["f_res"] / 1e6, 3), (res["f_res"] - f_target) / 1e3))
+        return res["f_res"]
+
+    # g(scale) = 1/f_res - 1/f_target is linear in the scale for a pure electromagnetic
+    # scaling and increases with it (longer elements resonate lower)
+    def g(f_res):
+        return 1.0 / f_res - 1.0 / f_target
+
+    history = []
+    s1 = 1.0
+    f_res = evaluate(s1)
+    if abs(f_res - f_target) > tolerance and len(history) < max_runs:
+        s0, g0 = s1, g(f_res)
+        s1 = s1 * f_res / f_target
+        f_res = evaluate(s1)
+        while abs(f_res - f_target) > tolerance and len(history) < max_runs:
+            g1 = g(f_res)
+            s2 = s1 - g1 * (s1 - s0) / (g1 - g0) if g1 != g0 else s1 * f_res / f_target
+
+            # once runs on both sides of the target exist, never step outside of them
+            below = [(s, g(f)) for s, f, _ in history if g(f) < 0]
+            above = [(s, g(f)) for s, f, _ in history if g(f) > 0]
+            if below and above:
+                lo, g_lo = max(below)
+                hi, g_hi = min(above)
+                if not min(lo, hi) < s2 < max(lo, hi):
+                    s2 = lo - g_lo * (hi - lo) / (g_hi - g_lo)
+
+            s0, g0 = s1, g1
+            s1 = s2
+            f_res = evaluate(s1)
+
+    scale, f_res, best = min(history, key=lambda h: abs(h[1] - f_target))
+    if verbose:
+        status = "converged" if abs(f_res - f_target) <= tolerance else "NOT converged"
+        print("tuner: {} after {} runs: {} -> resonance at {} MHz".format(
+            status, len(history), {name: best["params"][name] for name in names}, round(f_res / 1e6, 3)))
+    return best["params"], history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune yagi_trena.py lengths to resonate at f0")
+    parser.add_argument("-p", "--param", action="append", dest="params",
+                        help="length parameter to scale (repeatable), default {}".format(tune_params))
+    parser.add_argument("-f", "--freq", type=float, default=yagi.f0, help="target resonance frequency (Hz)")
+    parser.add_argument("-t", "--tolerance", type=float, default=tolerance, help="accepted offset (Hz)")
+    parser.add_argument("-n", "--max-runs", type=int, default=max_runs, help="maximum number of FDTD runs")
+    args = parser.parse_args()
+
+    tune(names=args.params or tune_params, f_target=args.freq, tolerance=args.tolerance, max_runs=args.max_runs)
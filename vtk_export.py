@@ -0,0 +1,136 @@
+# Binary VTK export of openEMS far-field patterns
+#
+# The far-field is written as a structured grid over theta x phi, with every point placed
+# at the direction (theta, phi) and the distance given by a radius pattern. All patterns of
+# all requested frequencies go into the same file as point-data arrays, so ParaView can
+# switch between them (or warp by them) without loading several files.
+#
+# @see https://github.com/thliebig/openEMS-Project/discussions/151
+# @see https://docs.vtk.org/en/latest/design_documents/VTKFileFormats.html
+
+import numpy as np
+
+
+def farfield_points(radius, theta, phi):
+    """
+    Cartesian coordinates of a far-field pattern.
+
+    :param radius: 2D array [theta, phi] of distances
+    :param theta: theta angles in degrees
+    :param phi: phi angles in degrees
+    :return: array [phi, theta, 3], i.e. theta varies fastest
+    """
+    t = np.deg2rad(np.asarray(theta, dtype=float))[None, :]
+    a = np.deg2rad(np.asarray(phi, dtype=float))[:, None]
+    r = np.asarray(radius, dtype=float).T
+    return np.stack([r * np.sin(t) * np.cos(a), r * np.sin(t) * np.sin(a), r * np.cos(t) * np.ones_like(a)], axis=-1)
+
+
+def pattern_arrays(nf2ff_res, freq_indices=(0,)):
+    """
+    Directivity patterns of an NF2FF result, ready to be written with `write_vts`/`write_vtk`.
+
+    For every frequency the arrays `E_norm_dBi`, `E_CPRH_dBi`, `E_CPLH_dBi` (directivity of
+    the total, right- and left-hand circularly polarized field) and `E_normalized` (|E|
+    relative to its maximum) are returned, each name suffixed with the frequency.
+
+    :param nf2ff_res: result of `CalcNF2FF` or `nf2ff_chunked.calc_nf2ff`
+    :param freq_indices: indices of the frequencies to export
+    :return: dict name -> 2D array [theta, phi]
+    """
+    arrays = {}
+    for n in freq_indices:
+        E_max = np.max(nf2ff_res.E_norm[n])
+        Dmax_dB = 10 * np.log10(nf2ff_res.Dmax[n])
+        suffix = "_{}MHz".format(round(nf2ff_res.freq[n] / 1e6, 3))
+        arrays["E_norm_dBi" + suffix] = 20.0 * np.log10(nf2ff_res.E_norm[n] / E_max) + Dmax_dB
+        arrays["E_CPRH_dBi" + suffix] = 20.0 * np.log10(np.abs(nf2ff_res.E_cprh[n]) / E_max) + Dmax_dB
+        arrays["E_CPLH_dBi" + suffix] = 20.0 * np.log10(np.abs(nf2ff_res.E_cplh[n]) / E_max) + Dmax_dB
+        arrays["E_normalized" + suffix] = nf2ff_res.E_norm[n] / E_max
+    return arrays
+
+
+def _default_radius(arrays):
+    for name, values in arrays.items():
+        if name.startswith("E_normalized"):
+            return values
+    return np.abs(next(iter(arrays.values())))
+
+
+def write_vts(filename, theta, phi, arrays, radius=None):
+    """
+    Write far-field patterns as a VTK XML structured grid (`.vts`) with raw appended data.
+
+    :param filename: output file name
+    :param theta: theta angles in degrees
+    :param phi: phi angles in degrees
+    :param arrays: dict name -> 2D array [theta, phi], written as point data
+    :param radius: 2D array [theta, phi] placing the points; defaults to the first
+                   `E_normalized*` array (see `pattern_arrays`)
+    """
+    if radius is None:
+        radius = _default_radius(arrays)
+    nt, na = len(theta), len(phi)
+
+    # everything goes into the appended block: (name, bytes, number of components)
+    blocks = [(name, np.ascontiguousarray(np.asarray(values, dtype="<f8").T).tobytes(), 1)
+              for name, values in arrays.items()]
+    blocks.append((None, farfield_points(radius, theta, phi).astype("<f8").tobytes(), 3))
+
+    offsets = []
+    offset = 0
+    for _, data, _ in blocks:
+        offsets.append(offset)
+        offset += 8 + len(data)
+
+    extent = "0 0 0 {} 0 {}".format(nt - 1, na - 1)
+    xml = [
+        '<?xml version="1.0"?>',
+        '<VTKFile type="StructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">',
+        '  <StructuredGrid WholeExtent="{}">'.format(extent),
+        '    <Piece Extent="{}">'.format(extent),
+        '      <PointData Scalars="{}">'.format(blocks[0][0] if arrays else ""),
+    ]
+    for (name, _, _), off in zip(blocks[:-1], offsets):
+        xml.append('        <DataArray type="Float64" Name="{}" format="appended" offset="{}"/>'.format(name, off))
+    xml += [
+        '      </PointData>',
+        '      <Points>',
+        '        <DataArray type="Float64" NumberOfComponents="3" format="appended" offset="{}"/>'.format(offsets[-1]),
+        '      </Points>',
+        '    </Piece>',
+        '  </StructuredGrid>',
+        '  <AppendedData encoding="raw">',
+    ]
+
+    with open(filename, "wb") as f:
+        f.write(("\n".join(xml) + "\n   _").encode())
+        for _, data, _ in blocks:
+            f.write(np.uint64(len(data)).astype("<u8").tobytes())
+            f.write(data)
+        f.write(b"\n  </AppendedData>\n</VTKFile>\n")
+
+
+def write_vtk(filename, theta, phi, arrays, radius=None):
+    """
+    Write far-field patterns as a binary legacy VTK structured grid (`.vtk`).
+
+    Same arguments as `write_vts`.
+    """
+    if radius is None:
+        radius = _default_radius(arrays)
+    nt, na = len(theta), len(phi)
+
+    with open(filename, "wb") as f:
+        f.write(b"# vtk DataFile Version 3.0\n")
+        f.write(b"Structured Grid by python-interface of openEMS\n")
+        f.write(b"BINARY\n")
+        f.write(b"DATASET STRUCTURED_GRID\n")
+        f.write("DIMENSIONS 1 {} {}\n".format(nt, na).encode())
+        f.write("POINTS {} double\n".format(nt * na).encode())
+        f.write(farfield_points(radius, theta, phi).astype(">f8").tobytes())
+        f.write("\nPOINT_DATA {}\n".format(nt * na).encode())
+        for name, values in arrays.items():
+            f.write("SCALARS {} double 1\nLOOKUP_TABLE default\n".format(name).encode())
+            f.write(np.ascontiguousarray(np.asarray(values, dtype=">f8").T).tobytes())
+            f.write(b"\n")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Round wire equivalent to the curved cross-section of the Trena (tape measure) elements
+#
+# A long conductor of any cross-section behaves like a round wire of its equivalent radius,
+# the radius of the circle with the same capacitance per unit length (the logarithmic
+# capacity of the cross-section; w/4 for a flat strip of width w). It is found by solving
+# the 2D electrostatic problem on the outline of `Trena.points` with a boundary element
+# method: piecewise constant charge on short panels, potential of every panel integrated
+# in closed form, constant potential on all panels. The wire is placed at the centroid of
+# that charge.
+#
+# The wire model needs no cells as fine as the 0.2 mm tape, but it only keeps the
+# capacitance (and so the phase velocity) of the element, not its exact current
+# distribution. This script simulates the Yagi-Uda of yagi_trena.py with both element
+# models and reports the difference of resonance and Zin, mesh size and timestep, so the
+# wire model can be used for sweeps and the polygon one for the final checks. Neither the hand
+# mesh of yagi_trena.py nor mesh_planner.py (--plan-mesh), which only sees bounding boxes,
+# resolves the tape, so both models get grids of about the same cost.
+#
+# Usage:
+#   ./wire_model.py                             equivalent radius of the Trena cross-section
+#   ./wire_model.py --compare -j 2              simulate both element models and compare them
+#   ./wire_model.py --compare --plan-mesh       the same on the mesh of mesh_planner.py
+
+import math
+import argparse
+
+import numpy as np
+
+# the outline is split into panels of at most this fraction of its smallest feature (the
+# distance between its closest non-adjacent vertices, i.e. the tape thickness)
+panel_fraction = 0.5
+
+# but at least this many panels in total
+min_panels = 400
+
+
+def _panels(points, max_len):
+    # outline (x, y lists of a closed polygon) split into panels of at most `max_len`
+    p = np.asarray(points, dtype=float).T
+    a, b = p, np.roll(p, -1, axis=0)
+    n = np.maximum(1, np.ceil(np.linalg.norm(b - a, axis=1) / max_len).astype(int))
+    frac = np.concatenate([np.arange(k) / k for k in n])
+    start = np.repeat(a, n, axis=0) + frac[:, None] * np.repeat(b - a, n, axis=0)
+    stop = np.repeat(a, n, axis=0) + (frac + 1.0 / np.repeat(n, n))[:, None] * np.repeat(b - a, n, axis=0)
+    return start, stop
+
+
+def _log_integral(points, start, stop):
+    # integral of ln|r - p| over every panel (columns) for every point p (rows)
+    d = stop - start
+    length = np.linalg.norm(d, axis=1)
+    t = d / length[:, None]
+    rel = points[:, None, :] - start[None, :, :]
+    s = np.sum(rel * t[None], axis=2)
+    h = np.abs(rel[..., 0] * t[None, :, 1] - rel[..., 1] * t[None, :, 0])
+
+    def F(x):
+        # antiderivative of ln sqrt(x^2 + h^2)
+        r2 = x ** 2 + h ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xlog = np.where(x == 0, 0.0, 0.5 * x * np.log(r2))
+        return xlog - x + h * np.arctan2(x, h)
+
+    return F(length[None, :] - s) - F(-s)
+
+
+def equivalent_radius(points, panel_fraction=panel_fraction, min_panels=min_panels):
+    """
+    Equivalent radius of a closed cross-section.
+
+    :param points: [[x...], [y...]] vertices of the outline, as `Trena.points`
+    :return: tuple ``(radius, center)``, with the (x, y) center of the wire
+    """
+    p = np.asarray(points, dtype=float).T
+    size = np.max(np.ptp(p, axis=0))
+    dist = np.linalg.norm(p[:, None] - p[None, :], axis=2)
+    # closest vertices that are not neighbours along the outline
+    n = len(p)
+    k = np.abs(np.arange(n)[:, None] - np.arange(n)[None, :])
+    feature = np.min(dist[(k > 1) & (k < n - 1)]) if n > 3 else size
+    perimeter = np.sum(np.linalg.norm(np.roll(p, -1, axis=0) - p, axis=1))
+    start, stop = _panels(points, min(panel_fraction * feature, perimeter / min_panels))
+
+    # in units of twice the size, so every distance is below 1 and every potential positive
+    scale = 2 * size
+    start, stop = start / scale, stop / scale
+    mid = (start + stop) / 2
+    length = np.linalg.norm(stop - start, axis=1)
+    G = -_log_integral(mid, start, stop)
+    sigma = np.linalg.solve(G, np.ones(len(mid)))
+    charge = sigma * length
+
+    # unit potential: a circle of radius a carries the charge -1 / ln(a)
+    radius = math.exp(-1 / np.sum(charge)) * scale
+    center = charge @ mid / np.sum(charge) * scale
+    return radius, (float(center[0]), float(center[1]))
+
+
+def compare(jobs=2, params=None):
+    """
+    Simulate the Yagi-Uda of yagi_trena.py with the polygon and the wire element model.
+
+    :param jobs: number of concurrent simulations
+    :param params: further `yagi_trena.build_model` arguments
+    :return: dict element model -> `sweep.run_point` result, with the mesh size `cells` and
+             the timestep `dt`
+    """
+    import cost_estimator
+    import sweep
+    import yagi_trena as yagi
+
+    points = [dict(params or {}, element_model=m) for m in ["polygon", "wire"]]
+    results = sweep.run_sweep(points, jobs=jobs)
+    res = {}
+    for point, r in zip(points, results):
+        _, csx, _, _ = yagi.build_model(record_nf2ff=False, **point)
+        lines = cost_estimator.mesh_lines(csx)
+        r.update(cells=cost_estimator.cell_count(lines), dt=cost_estimator.cfl_timestep(lines))
+        res[point["element_model"]] = r
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Equivalent radius of the Trena elements and model comparison")
+    parser.add_argument("--compare", action="store_true", help="simulate both element models and compare them")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="number of concurrent simulations")
+    parser.add_argument("--plan-mesh", action="store_true", help="mesh both models with mesh_planner.py")
+    args = parser.parse_args()
+
+    import yagi_trena as yagi
+
+    radius, center = equivalent_radius(yagi.Trena.points)
+    print("equivalent radius {:.3f} mm at x = {:.3f} mm, y = {:.3f} mm".format(radius, *center))
+    if args.compare:
+        res = compare(args.jobs, {"plan_mesh": True} if args.plan_mesh else None)
+        poly, wire = res["polygon"], res["wire"]
+        for name, r in res.items():
+            print("{:8s} resonance {:.4f} MHz, Zin {:.1f}{:+.1f}j Ohm, {:.1f} dB, {} cells, dt {:.3g} s".format(
+                name, r["f_res"] / 1e6, r["Zin"].real, r["Zin"].imag, r["s11_dB"], r["cells"], r["dt"]))
+        print("wire - polygon: resonance {:+.1f} kHz ({:+.3%}), Zin {:+.1f}{:+.1f}j Ohm".format(
+            (wire["f_res"] - poly["f_res"]) / 1e3, wire["f_res"] / poly["f_res"] - 1,
+            (wire["Zin"] - poly["Zin"]).real, (wire["Zin"] - poly["Zin"]).imag))
+        # the run time goes with the number of cells times the number of timesteps
+        print("cells x {:.2f}, timestep x {:.2f}, estimated speedup x {:.2f}".format(
+            wire["cells"] / poly["cells"], wire["dt"] / poly["dt"],
+            poly["cells"] / wire["cells"] * wire["dt"] / poly["dt"]))
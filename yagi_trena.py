@@ -2,8 +2,11 @@
 # Based on https://gist.github.com/oberstet/f492fe987d5d746cba5b0880e9f33d5b
 
 import os
+import sys
+import json
 import math
-from pprint import pprint, pformat
+import time
+from pprint import pformat
 
 import numpy as np
 from matplotlib import pyplot
@@ -14,6 +17,24 @@ from CSXCAD.CSProperties import CSPropMetal
 from openEMS import openEMS
 from openEMS.physical_constants import C0
 
+import analysis
+import analyze
+import cost_estimator
+import domain
+import early_stop
+import engine_tuner
+import fdtd_cache
+import hairpin
+import mesh_planner
+import mpi_run
+import symmetry
+import nf2ff_chunked
+import pattern_metrics
+import plots
+import result_store
+import vtk_export
+import wire_model
+
 # enable NF2FF recording, computation and plotting
 enable_nf2ff = True
 
@@ -23,6 +44,17 @@ enable_show_plots = True
 # fire up AppCSXCAD for viewing the model before running it
 enable_appcsxcad = True
 
+# reuse the results of an identical earlier simulation instead of running it again
+enable_cache = True
+
+# derive the mesh from the primitives of the model (mesh_planner.py) instead of the hand
+# placed lines in build_model
+enable_mesh_planner = False
+
+# only build the model and print the estimated cost of the simulation, also enabled by
+# passing --dry-run
+enable_dry_run = "--dry-run" in sys.argv
+
 # all units are in mm
 unit = 1e-3
 
@@ -49,6 +81,10 @@ hairpin_enable = True
 hairpin_wire_diameter = 2.26
 hairpin_length = 58
 hairpin_D = 10
+# "wires" models the hairpin in the simulation, "post" simulates the antenna without it and
+# applies it to the feed impedance as a shorted two-wire stub (hairpin.py), so a run of any
+# hairpin length is the same simulation; try lengths with ./hairpin.py results/yagi_trena
+hairpin_model = "wires"
 # =============================
 
 # excitation frequency and bandwidth
@@ -57,6 +93,42 @@ f0 = 145.825e6
 # excitation bandwidth
 fc = 0.3 * f0
 
+# FDTD engine settings: maximum number of timesteps, energy decay end criteria and
+# boundary conditions (xmin, xmax, ymin, ymax, zmin, zmax)
+nr_ts = 3e5
+end_criteria = 1e-4
+boundary_cond = ["MUR", "MUR", "MUR", "MUR", "MUR", "MUR"]
+
+# stop the simulation as soon as S11 and Zin in `early_stop_band` (Hz) stop changing, and
+# abort diverging runs (early_stop.py)
+enable_early_stop = False
+early_stop_band = (0.98 * f0, 1.02 * f0)
+
+# simulate only the z >= 0 half of the domain, with a PEC plane at z=0 (symmetry.py); the
+# antenna is mirror-symmetric about z=0 only, the boom and the Trena profile are not
+# symmetric about x=0 or y=0
+enable_symmetry = False
+symmetry_planes = [("z", "PEC")]
+sim_planes = symmetry_planes if enable_symmetry else []
+
+# PML boundaries of `pml_cells` cells instead of `boundary_cond`, on a domain sized from the
+# bounding box of the antenna: `domain_clearance` wavelengths (at f0) from the element tips to
+# the boundary, PML included, on every side instead of the `sim_box` cube (domain.py)
+enable_tight_domain = False
+pml_cells = 8
+domain_clearance = 0.25
+
+# run the engine on `mpi_ranks` MPI processes, the mesh split into slabs along the boom
+# (mpi_run.py); needs openEMS built with MPI support
+enable_mpi = False
+mpi_ranks = 4
+
+# model of the Trena elements: "polygon" extrudes the curved cross-section `Trena.points`,
+# "wire" is a round wire of the same equivalent radius (wire_model.py); neither the hand mesh
+# nor `enable_mesh_planner` (bounding boxes only) resolves the tape, so both models cost about
+# the same; compare them with ./wire_model.py --compare
+element_model = "polygon"
+
 # length factor to apply to reach fixed point of resonance frequency
 # being identical to excitation frequency
 # "Found resonance frequency at 500 MHz with -44 dB at 71 Ohm"
@@ -105,9 +177,24 @@ sim_box = np.array([1, 1, 1]) * 2.0 * lambda0
 # nf_ff_transition_distance = math.ceil(lambda0 / (2 * math.pi))
 nf_ff_transition_distance = 2 * lambda0
 
+# far-field angles (degrees), the far field is calculated at phi=0 degrees and at phi=90 degrees
+nf2ff_theta = np.arange(-180.0, 180.0, 1.0)
+nf2ff_phi = np.arange(-90, 90, 2)
+
+# frequencies at which the feed port is evaluated
+freq = np.linspace(f0 - fc, f0 + fc, 2001)
+
+# wavelength of minimum/maximum frequency used (in excitation) in simulation
+min_freq_lambda = round(C0 / (f0 - fc) / unit)
+max_freq_lambda = round(C0 / (f0 + fc) / unit)
+
+# distance of transition between near-field to far-field
+nf_ff_transition_distance = math.ceil(min_freq_lambda / (2 * math.pi))
+
+# simulation mesh resolution for far-field
+mesh_res_farfield = round(max_freq_lambda / 30)
+
 output_dir = os.path.abspath(os.path.join("results", "yagi_trena"))
-if not os.path.isdir(output_dir):
-    os.mkdir(output_dir)
 
 class Trena:
     thickness = 0.2
@@ -119,549 +206,461 @@ class Trena:
 # Radius of lumped port (driven feed port)
 feed_radius = Trena.thickness / (2*math.sqrt(2))
 
-fdtd = openEMS(NrTS=3e5, EndCriteria=1e-4)
-fdtd.SetGaussExcite(f0, fc)
-fdtd.SetBoundaryCond(["MUR", "MUR", "MUR", "MUR", "MUR", "MUR"])
-
-csx = ContinuousStructure()
-fdtd.SetCSX(csx)
-mesh = csx.GetGrid()
-mesh.SetDeltaUnit(unit)
-
-# create mesh and geometry for yagi; the yagi elements are oriented along the Z-axis (!)
-
-# **!: dense mesh in port region
-mesh.AddLine("z", np.linspace(-driven_gap / 2 - feed_overlap, driven_gap / 2 + feed_overlap, 5))
-
-# **!: dense mesh around ends of arms
-min_length = min(director_length, driven_length, reflector_length)
-max_length = max(director_length, driven_length, reflector_length)
-mesh.AddLine("z", np.linspace(-max_length / 2 - 5 * driven_wire_radius, -min_length / 2 + 5 * driven_wire_radius, 11))
-mesh.AddLine("z", np.linspace(min_length / 2 - 5 * driven_wire_radius, max_length / 2 + 5 * driven_wire_radius, 11))
-if hairpin_enable:
-    mesh.AddLine("z", [-hairpin_D/2, hairpin_D/2])
-# mesh.AddLine("z", [-driven_gap / 2 - driven_length / 2, driven_gap / 2 + driven_length / 2])
-mesh.AddLine("z", [-sim_box[0] / 2, 0, sim_box[0] / 2])
-mesh.SmoothMeshLines("z", max_res, ratio=1.4)
-
-mesh.AddLine("y", [-boom_shell_width/2 - Trena.thickness/2])
-mesh.AddLine("y", [-sim_box[1] / 2, 0, sim_box[1] / 2])
-mesh.SmoothMeshLines("y", max_res, ratio=1.4)
-
-if hairpin_enable:
-    mesh.AddLine("x", [hairpin_length])
-mesh.AddLine("x", [-reflector_dist, director_dist])
-mesh.AddLine("x", [-sim_box[2] / 2, 0, sim_box[2] / 2])
-mesh.SmoothMeshLines("x", max_res, ratio=1.4)
-
-driven_arm1: CSPropMetal = csx.AddMetal("driven_arm1")
-# port gap is part of the total driven length (!):
-#driven_arm1.AddWire([[0, 0], [0, 0], [-driven_gap / 2, -driven_length / 2]], radius=driven_wire_radius)
-driven_arm1.AddLinPoly(points=Trena.translate_to(0, 0), norm_dir='z', elevation=-driven_length/2, length=driven_length/2-driven_gap/2)
-driven_arm1.SetColor("#ff0000", 50)
-
-driven_arm2: CSPropMetal = csx.AddMetal("driven_arm2")
-# port gap is part of the total driven length (!):
-#driven_arm2.AddWire([[0, 0], [0, 0], [driven_gap / 2, driven_length / 2]], radius=driven_wire_radius)
-driven_arm2.AddLinPoly(points=Trena.translate_to(0, 0), norm_dir='z', elevation=driven_gap/2, length=driven_length/2-driven_gap/2)
-driven_arm2.SetColor("#ff0000", 50)
-
-if hairpin_enable:
-    hairpin: CSPropMetal = csx.AddMetal("hairpin")
-    hairpin.AddWire([[0, hairpin_length], [0, 0], [-hairpin_D/2, -hairpin_D/2]], radius=hairpin_wire_diameter/2)
-    hairpin.AddWire([[0, hairpin_length], [0, 0], [ hairpin_D/2,  hairpin_D/2]], radius=hairpin_wire_diameter/2)
-    hairpin.AddWire([[hairpin_length, hairpin_length], [0, 0], [-hairpin_D/2, hairpin_D/2]], radius=hairpin_wire_diameter/2)
-    hairpin.SetColor("#0000ff", 50)
-
-director_arm: CSPropMetal = csx.AddMetal("director_arm")
-director_arm.AddLinPoly(points=Trena.translate_to(director_dist, 0), norm_dir='z', elevation=-director_length/2, length=director_length)
-director_arm.SetColor("#ff0000", 50)
-
-reflector_arm: CSPropMetal = csx.AddMetal("reflector_arm")
-reflector_arm.AddLinPoly(points=Trena.translate_to(-reflector_dist, 0), norm_dir='z', elevation=-reflector_length/2, length=reflector_length)
-reflector_arm.SetColor("#ff0000", 50)
-
-boom = csx.AddMaterial('PVC')
-# sources:
-# - https://passive-components.eu/what-is-dielectric-constant-of-plastic-materials/
-# - https://matmake.com/properties/relative-permittivity-of-common-materials.html
-# - https://matmake.com/properties/magnetic-permeability-of-common-materials.html
-boom.SetMaterialProperty(epsilon=4, mue=1.000058)
-boom.AddCylindricalShell(start=[-reflector_dist-reflector_side_boom_additional_len,-boom_ext_radius-boom_shell_width/2-Trena.thickness/2,0], stop=[director_dist+director_side_boom_additional_len,-boom_ext_radius-boom_shell_width/2-Trena.thickness/2,0], radius=boom_ext_radius-boom_shell_width/2, shell_width=boom_shell_width)
-boom.SetColor("#00ff00", 50)
-
-feed = fdtd.AddLumpedPort(
-    1,
-    feed_resistance,
-    [-feed_radius, -feed_radius, -driven_gap / 2 - feed_overlap],
-    [feed_radius, feed_radius, driven_gap / 2 + feed_overlap],
-    "z",
-    1.0,
-    priority=5,
-)
-
-#########################################################################################
-# setup far-field recording
-#
-if enable_nf2ff:
-    # wavelength of minimum/maximum frequency used (in excitation) in simulation
-    min_freq_lambda = round(C0 / (f0 - fc) / unit)
-    max_freq_lambda = round(C0 / (f0 + fc) / unit)
+# radius and (x, y) center of the round wire equivalent to the Trena cross-section
+trena_wire_radius, trena_wire_center = wire_model.equivalent_radius(Trena.points)
 
-    # distance of transition between near-field to far-field
-    nf_ff_transition_distance = math.ceil(min_freq_lambda / (2 * math.pi))
 
-    # simulation mesh resolution for far-field
-    mesh_res_farfield = round(max_freq_lambda / 30)
+def add_element(prop, x, elevation, length, model=element_model):
+    """
+    Add a Trena element along z to a metal property.
 
-    # add the NF2FF recording box
-    start = [-nf_ff_transition_distance / 2] * 3
-    stop = [nf_ff_transition_distance / 2] * 3
-    nf2ff = fdtd.CreateNF2FFBox("nf2ff-box", start=start, stop=stop, opt_resolution=[mesh_res_farfield] * 3)
+    :param x: position of the element along the boom
+    :param elevation: z where the element starts
+    :param length: length of the element along z
+    :param model: "polygon" or "wire", see `element_model`
+    """
+    if model == "wire":
+        xc, yc = trena_wire_center
+        # the wire reaches into the boom, the metal wins there
+        prop.AddWire([[x + xc, x + xc], [yc, yc], [elevation, elevation + length]], radius=trena_wire_radius,
+                     priority=10)
+    elif model == "polygon":
+        prop.AddLinPoly(points=Trena.translate_to(x, 0), norm_dir='z', elevation=elevation, length=length)
+    else:
+        raise ValueError("unknown element model {!r}".format(model))
+
+
+def build_model(
+    director_length=director_length,
+    director_dist=director_dist,
+    driven_length=driven_length,
+    reflector_length=reflector_length,
+    reflector_dist=reflector_dist,
+    hairpin_enable=hairpin_enable,
+    hairpin_length=hairpin_length,
+    hairpin_D=hairpin_D,
+    hairpin_model=hairpin_model,
+    record_nf2ff=enable_nf2ff,
+    plan_mesh=enable_mesh_planner,
+    planes=sim_planes,
+    tight_domain=enable_tight_domain,
+    element_model=element_model,
+):
+    """
+    Create the openEMS simulation of the Yagi-Uda antenna.
+
+    All geometry arguments default to the antenna settings at the top of this file, so a
+    parameter sweep only has to pass the values it changes.
+
+    :param record_nf2ff: add the NF2FF recording box to the model
+    :param plan_mesh: derive the mesh from the primitives with `mesh_planner.plan`
+    :param planes: symmetry planes, see symmetry.py; the port impedance of the reduced
+                   model has to be multiplied by `symmetry.impedance_factor(planes)`
+    :param tight_domain: PML boundaries on a domain sized from the antenna, see domain.py
+    :param element_model: "polygon" or "wire" model of the Trena elements
+    :param hairpin_model: "wires" or "post", see `hairpin_model`; with "post" the hairpin is
+                          left out and has to be applied to the feed impedance
+                          with `hairpin.apply(freq, Zin, **post_hairpin(...))`
+    :return: tuple ``(fdtd, csx, feed, nf2ff)``, where ``nf2ff`` is None if not recorded
+    """
+    if hairpin_model not in ("wires", "post"):
+        raise ValueError("unknown hairpin model {!r}".format(hairpin_model))
+    hairpin_wires = hairpin_enable and hairpin_model == "wires"
+
+    fdtd = openEMS(NrTS=nr_ts, EndCriteria=end_criteria)
+    fdtd.SetGaussExcite(f0, fc)
+    fdtd.SetBoundaryCond(symmetry.boundary(domain.pml_boundary(pml_cells) if tight_domain else boundary_cond, planes))
+
+    csx = ContinuousStructure()
+    fdtd.SetCSX(csx)
+    mesh = csx.GetGrid()
+    mesh.SetDeltaUnit(unit)
+
+    # create mesh and geometry for yagi; the yagi elements are oriented along the Z-axis (!)
+
+    if not plan_mesh:
+        # **!: dense mesh in port region
+        mesh.AddLine("z", np.linspace(-driven_gap / 2 - feed_overlap, driven_gap / 2 + feed_overlap, 5))
+
+        # **!: dense mesh around ends of arms
+        min_length = min(director_length, driven_length, reflector_length)
+        max_length = max(director_length, driven_length, reflector_length)
+        mesh.AddLine("z", np.linspace(-max_length / 2 - 5 * driven_wire_radius, -min_length / 2 + 5 * driven_wire_radius, 11))
+        mesh.AddLine("z", np.linspace(min_length / 2 - 5 * driven_wire_radius, max_length / 2 + 5 * driven_wire_radius, 11))
+        if hairpin_wires:
+            mesh.AddLine("z", [-hairpin_D/2, hairpin_D/2])
+        # mesh.AddLine("z", [-driven_gap / 2 - driven_length / 2, driven_gap / 2 + driven_length / 2])
+        mesh.AddLine("z", [-sim_box[0] / 2, 0, sim_box[0] / 2])
+
+        mesh.AddLine("y", [-boom_shell_width/2 - Trena.thickness/2])
+        if element_model == "wire":
+            mesh.AddLine("y", [trena_wire_center[1]])
+        mesh.AddLine("y", [-sim_box[1] / 2, 0, sim_box[1] / 2])
+
+        if hairpin_wires:
+            mesh.AddLine("x", [hairpin_length])
+        mesh.AddLine("x", [-reflector_dist, director_dist])
+        mesh.AddLine("x", [-sim_box[2] / 2, 0, sim_box[2] / 2])
+        # with a tight domain the lines are smoothed once its boundaries are known (domain.fit_mesh)
+        if not tight_domain:
+            mesh.SmoothMeshLines("all", max_res, ratio=1.4)
+
+    # the lower arm is the image of the upper one with a PEC plane at z=0
+    if not symmetry.mirrored([0, 0, -driven_length / 2], [0, 0, -driven_gap / 2], planes):
+        driven_arm1: CSPropMetal = csx.AddMetal("driven_arm1")
+        # port gap is part of the total driven length (!):
+        #driven_arm1.AddWire([[0, 0], [0, 0], [-driven_gap / 2, -driven_length / 2]], radius=driven_wire_radius)
+        add_element(driven_arm1, 0, -driven_length/2, driven_length/2-driven_gap/2, element_model)
+        driven_arm1.SetColor("#ff0000", 50)
+
+    driven_arm2: CSPropMetal = csx.AddMetal("driven_arm2")
+    # port gap is part of the total driven length (!):
+    #driven_arm2.AddWire([[0, 0], [0, 0], [driven_gap / 2, driven_length / 2]], radius=driven_wire_radius)
+    add_element(driven_arm2, 0, driven_gap/2, driven_length/2-driven_gap/2, element_model)
+    driven_arm2.SetColor("#ff0000", 50)
+
+    if hairpin_wires:
+        hairpin: CSPropMetal = csx.AddMetal("hairpin")
+        if not symmetry.mirrored([0, 0, -hairpin_D / 2], [hairpin_length, 0, -hairpin_D / 2], planes):
+            hairpin.AddWire([[0, hairpin_length], [0, 0], [-hairpin_D/2, -hairpin_D/2]], radius=hairpin_wire_diameter/2)
+        hairpin.AddWire([[0, hairpin_length], [0, 0], [ hairpin_D/2,  hairpin_D/2]], radius=hairpin_wire_diameter/2)
+        hairpin.AddWire([[hairpin_length, hairpin_length], [0, 0], [-hairpin_D/2, hairpin_D/2]], radius=hairpin_wire_diameter/2)
+        hairpin.SetColor("#0000ff", 50)
+
+    director_arm: CSPropMetal = csx.AddMetal("director_arm")
+    add_element(director_arm, director_dist, -director_length/2, director_length, element_model)
+    director_arm.SetColor("#ff0000", 50)
+
+    reflector_arm: CSPropMetal = csx.AddMetal("reflector_arm")
+    add_element(reflector_arm, -reflector_dist, -reflector_length/2, reflector_length, element_model)
+    reflector_arm.SetColor("#ff0000", 50)
+
+    boom = csx.AddMaterial('PVC')
+    # sources:
+    # - https://passive-components.eu/what-is-dielectric-constant-of-plastic-materials/
+    # - https://matmake.com/properties/relative-permittivity-of-common-materials.html
+    # - https://matmake.com/properties/magnetic-permeability-of-common-materials.html
+    boom.SetMaterialProperty(epsilon=4, mue=1.000058)
+    boom.AddCylindricalShell(start=[-reflector_dist-reflector_side_boom_additional_len,-boom_ext_radius-boom_shell_width/2-Trena.thickness/2,0], stop=[director_dist+director_side_boom_additional_len,-boom_ext_radius-boom_shell_width/2-Trena.thickness/2,0], radius=boom_ext_radius-boom_shell_width/2, shell_width=boom_shell_width)
+    boom.SetColor("#00ff00", 50)
+
+    feed_start, feed_stop = symmetry.clip_box([-feed_radius, -feed_radius, -driven_gap / 2 - feed_overlap],
+                                              [feed_radius, feed_radius, driven_gap / 2 + feed_overlap], planes)
+    feed = fdtd.AddLumpedPort(
+        1,
+        feed_resistance / symmetry.impedance_factor(planes),
+        feed_start,
+        feed_stop,
+        "z",
+        1.0,
+        priority=5,
+    )
 
-    # smooth out mesh for far-field
-    # mesh.SmoothMeshLines("all", mesh_res_farfield, 1.4)
+    #########################################################################################
+    # setup far-field recording
+    #
+    nf2ff = None
+    if record_nf2ff:
+        # add the NF2FF recording box
+        start = [-nf_ff_transition_distance / 2] * 3
+        stop = [nf_ff_transition_distance / 2] * 3
+        # on the symmetry planes the box is open and mirrored, so the far-field is the one of the full antenna
+        nf2ff = fdtd.CreateNF2FFBox("nf2ff-box", opt_resolution=[mesh_res_farfield] * 3,
+                                    **symmetry.nf2ff_args(start, stop, planes))
+
+        # smooth out mesh for far-field
+        # mesh.SmoothMeshLines("all", mesh_res_farfield, 1.4)
+
+    box_start, box_stop = -sim_box / 2, sim_box / 2
+    if tight_domain:
+        nf2ff_box = (nf2ff.start, nf2ff.stop) if nf2ff is not None else ()
+        box_start, box_stop = domain.tight_bounds(csx, domain_clearance * C0 / f0 / unit, max_res, pml_cells, *nf2ff_box)
+    if plan_mesh:
+        mesh_planner.plan(csx, max_res, ratio=1.4,
+                          extra={axis: [box_start[n], 0, box_stop[n]] for n, axis in enumerate("xyz")}, verbose=False)
+    elif tight_domain:
+        domain.fit_mesh(mesh, box_start, box_stop, max_res, ratio=1.4)
+    symmetry.clip_mesh(mesh, planes)
+    return fdtd, csx, feed, nf2ff
+
+
+def post_hairpin(hairpin_enable=hairpin_enable, hairpin_length=hairpin_length, hairpin_D=hairpin_D,
+                 hairpin_model=hairpin_model, **params):
+    """
+    Hairpin left out of the model by `build_model` and applied to the feed impedance instead.
 
-#########################################################################################
-# fire up AppCSXCAD for viewing the model before running it
-#
-output_fn = os.path.join("models", "yagi_trena.xml")
-csx.Write2XML(output_fn)
-if enable_appcsxcad:
-    os.system('{} "{}"'.format(AppCSXCAD_BIN, output_fn))
+    Takes the same arguments as `build_model`.
 
-#########################################################################################
-#
-fdtd.Run(output_dir, verbose=3, cleanup=True)
+    :return: dict with the `length`, `D` and wire diameter `d` (mm) for `hairpin.apply`, or
+             None if the hairpin is disabled or part of the model
+    """
+    if not (hairpin_enable and hairpin_model == "post"):
+        return None
+    return {"length": hairpin_length, "D": hairpin_D, "d": hairpin_wire_diameter}
 
-# Found resonance frequency at 446.2 MHz with -42.5 dB at 71.1 Ohm
-# Dipole (lambda/2) length is 289.8 mm
-freq = np.linspace(f0 - fc, f0 + fc, 2001)
-feed.CalcPort(output_dir, freq)
-
-Zin = feed.uf_tot / feed.if_tot
-s11 = feed.uf_ref / feed.uf_inc
-s11_dB = 20.0 * np.log10(np.abs(s11))
-
-# Found resonance frequency at 446.1 MHz with -42.4 dB at 71.0 Ohm
-# Dipole (lambda/2) length is 289.8 mm
-print(s11_dB)
-print(freq)
-print(type(s11_dB), len(s11_dB))
-print(type(freq), len(freq))
-
-cutoff_db_resonance = -4
-cutoff_dbs = [cutoff_db_resonance, -1, -2, -3]
-cutoff_dbs_results = {}
-
-#idx = np.where((s11_dB < cutoff_db_resonance) & (s11_dB == np.min(s11_dB)))[0]
-idx = np.where((s11_dB == np.min(s11_dB)))[0]
-if not len(idx) == 1:
-    print("No resonance frequency found for far-field calculation!")
-else:
-    print("\n")
-    print("=" * 80)
-    print("")
-    print(
-        "Found resonance frequency at {} MHz with {} dB at {} Ohm".format(
-            round(freq[idx][0] / 1e6, 1),
-            round(s11_dB[idx][0], 1),
-            round(np.real(Zin[idx])[0], 1),
-        )
-    )
-    print("Driven length is {} mm".format(round(driven_length, 1)))
-    print("")
-    print("=" * 80)
-    print("")
-
-    cutoff_dbs_results["interest"] = {}
-    cutoff_interest_bw = round((446.2e6 - 446.0e6) / 1e6, 1)
-    for kf, f in [("lower", 446.0e6), ("center", 446.1e6), ("upper", 446.2e6)]:
-        # Calculate absolute differences
-        abs_diff = np.abs(freq - f)
-        # Find the index of the closest value
-        closest_index = np.argmin(abs_diff)
-        print(
-            "S11 at frequency {} MHz is {} dB at {} Ohm [index {}]".format(
-                round(f / 1e6, 1),
-                round(s11_dB[closest_index], 1),
-                round(np.real(Zin[closest_index]), 1),
-                closest_index,
-            )
-        )
-        cutoff_dbs_results["interest"][kf] = {
-            "idx": closest_index,
-            "freq": round(freq[closest_index] / 1e6, 1),
-            "s11": round(s11_dB[closest_index], 1),
-            "r": round(np.real(Zin[closest_index]), 1),
-            "bandwidth": cutoff_interest_bw,
-        }
-    print("")
-
-    for cutoff_db in cutoff_dbs:
-        idx_cutoff_lower = idx[0]
-        while idx_cutoff_lower >= 0 and s11_dB[idx_cutoff_lower] < cutoff_db:
-            idx_cutoff_lower -= 1
-        # print("cutoff_lower index: {}".format(idx_cutoff_lower))
-
-        idx_cutoff_upper = idx[0]
-        while idx_cutoff_upper <= len(s11_dB) and s11_dB[idx_cutoff_upper] < cutoff_db:
-            idx_cutoff_upper += 1
-        # print("cutoff_upper index: {}".format(idx_cutoff_upper))
 
-        print("")
-        print(
-            "S11 at frequency {} MHz is {} dB at {} Ohm".format(
-                round(freq[idx_cutoff_lower] / 1e6, 1),
-                round(s11_dB[idx_cutoff_lower], 1),
-                round(np.real(Zin[idx_cutoff_lower]), 1),
-            )
-        )
-        print(
-            "S11 at frequency {} MHz is {} dB at {} Ohm".format(
-                round(freq[idx_cutoff_upper] / 1e6, 1),
-                round(s11_dB[idx_cutoff_upper], 1),
-                round(np.real(Zin[idx_cutoff_upper]), 1),
-            )
-        )
+def fdtd_settings():
+    """
+    Engine settings that, together with the model XML, determine the result of a run.
+    """
+    boundary = domain.pml_boundary(pml_cells) if enable_tight_domain else boundary_cond
+    settings = dict(f0=f0, fc=fc, NrTS=nr_ts, EndCriteria=end_criteria, boundary=boundary)
+    if enable_early_stop:
+        settings["early_stop"] = [list(early_stop_band), early_stop.s11_tolerance, early_stop.zin_tolerance,
+                                  early_stop.stable_checks]
+    return settings
 
-        cutoff_dbs_results[cutoff_db] = {}
-        cutoff_dbs_results[cutoff_db]["lower"] = {
-            "idx": idx_cutoff_lower,
-            "freq": round(freq[idx_cutoff_lower] / 1e6, 1),
-            "s11": round(s11_dB[idx_cutoff_lower], 1),
-            "r": round(np.real(Zin[idx_cutoff_lower]), 1),
-        }
-        cutoff_dbs_results[cutoff_db]["upper"] = {
-            "idx": idx_cutoff_upper,
-            "freq": round(freq[idx_cutoff_upper] / 1e6, 1),
-            "s11": round(s11_dB[idx_cutoff_upper], 1),
-            "r": round(np.real(Zin[idx_cutoff_upper]), 1),
-        }
-        cutoff_dbs_results[cutoff_db]["bandwidth"] = round((freq[idx_cutoff_upper] - freq[idx_cutoff_lower]) / 1e6, 1)
-
-    print("=" * 80)
-    print("\n")
-
-#########################################################################################
-# plot the feed point impedance
-#
-pyplot.figure()
-pyplot.plot(freq / 1e6, np.real(Zin), "k-", linewidth=2, label=r"$\Re(Z_{in})$")
-pyplot.grid()
-pyplot.plot(freq / 1e6, np.imag(Zin), "r--", linewidth=2, label=r"$\Im(Z_{in})$")
-pyplot.title("feed point impedance")
-pyplot.xlabel("frequency (MHz)")
-pyplot.ylabel("impedance (Omega)")
-pyplot.legend()
-pyplot.savefig('fig_impedance.svg')
-
-#########################################################################################
-# plot reflection coefficient S11
-#
-pyplot.figure()
-pyplot.plot(freq / 1e6, s11_dB, "k-", linewidth=2, label="$S_{11}$")
-pyplot.grid()
-pyplot.title(
-    "Yagi-Uda for {} MHz\nAntenna Efficiency: S11 Reflection Coefficient vs Frequency\n".format(
-        round(f0 / 1e6, 1)
-    )
-)
-pyplot.ylabel("Reflection coefficient $S_{11}$ (dB)")
-pyplot.xlabel("Frequency (MHz)")
-# pyplot.legend()
-
-# Calculate alpha values based on s11_dB
-min_alpha = 0.05
-max_alpha = 0.8
-
-alpha_values = (s11_dB - cutoff_db_resonance) / (s11_dB.min() - cutoff_db_resonance)
-alpha_values = np.clip(alpha_values, 0, 1)  # Clip values between 0 and 1
-alpha_values = min_alpha - alpha_values * (min_alpha - max_alpha)
-
-
-# Add vertical lines colored based on s11_dB values
-idx_cutoff_lower = cutoff_dbs_results[cutoff_db_resonance]["lower"]["idx"]
-idx_cutoff_upper = cutoff_dbs_results[cutoff_db_resonance]["upper"]["idx"]
-
-res_cutoff_interest_lower = cutoff_dbs_results["interest"]["lower"]
-res_cutoff_interest_upper = cutoff_dbs_results["interest"]["upper"]
-
-pprint(res_cutoff_interest_lower)
-pprint(res_cutoff_interest_upper)
-
-# index of _maximum_ of S11 at both ends of frequency band of interest
-idx_cutoff_interest = (
-    res_cutoff_interest_lower["idx"]
-    if res_cutoff_interest_lower["s11"] > res_cutoff_interest_upper["s11"]
-    else res_cutoff_interest_upper["idx"]
-)
-print(">>" * 100, idx_cutoff_lower, idx_cutoff_upper, idx, idx_cutoff_interest)
-
-for i in range(len(freq)):
-    if idx_cutoff_lower <= i <= idx_cutoff_upper:
-        if i == idx_cutoff_lower or i == idx_cutoff_upper:
-            pyplot.axvline(x=freq[i] / 1e6, color="green", alpha=1.0, zorder=2)
-        elif i == idx:
-            pyplot.axvline(x=freq[i] / 1e6, color="blue", alpha=1.0, zorder=2)
-            pyplot.axhline(y=round(s11_dB[idx][0], 1), color="blue", alpha=1.0, zorder=2)
-        elif i == idx_cutoff_interest:
-            pyplot.axhline(y=round(s11_dB[i], 1), color="blue", alpha=1.0, zorder=2, linestyle="--")
-            pyplot.text(
-                round(freq[i] / 1e6, 1),
-                round(s11_dB[i], 1) + 1.0,
-                "{} MHz bandwidth @ {} dB".format(res_cutoff_interest_lower["bandwidth"], round(s11_dB[i], 1)),
-                ha="center",
-                zorder=4,
-                fontweight="bold",
-            )
-        elif i % 2:
-            pyplot.axvline(x=freq[i] / 1e6, color="green", alpha=alpha_values[i], zorder=0, linestyle="dotted")
-
-x = round(freq[idx][0] / 1e6, 1)
-for cutoff_db in cutoff_dbs:
-    pyplot.axhline(y=cutoff_db, color="green", alpha=1.0, linestyle="dotted")
-    pyplot.text(
-        x,
-        cutoff_db + 1.0,
-        "{} MHz bandwidth @ {} dB".format(cutoff_dbs_results[cutoff_db]["bandwidth"], cutoff_db),
-        ha="center",
-        zorder=4,
-        fontweight="bold",
-    )
 
-    idx_cutoff_lower = cutoff_dbs_results[cutoff_db]["lower"]["idx"]
-    idx_cutoff_upper = cutoff_dbs_results[cutoff_db]["upper"]["idx"]
-
-    # Add markers with text to specific coordinates
-    markers = [
-        {
-            "pos": (freq[idx_cutoff_lower] / 1e6, s11_dB[idx_cutoff_lower]),
-            "offset": [-4.0, -4.0],
-            "text": " {} MHz: {} dB\n@ {} Ohm".format(
-                round(freq[idx_cutoff_lower] / 1e6, 1),
-                round(s11_dB[idx_cutoff_lower], 1),
-                round(np.real(Zin[idx_cutoff_lower]), 1),
-            ),
-            "color": "red",
-            "ha": "right",
-        },
-        {
-            "pos": (freq[idx_cutoff_upper] / 1e6, s11_dB[idx_cutoff_upper]),
-            "offset": [4.0, -4.0],
-            "text": " {} MHz: {} dB\n@ {} Ohm".format(
-                round(freq[idx_cutoff_upper] / 1e6, 1),
-                round(s11_dB[idx_cutoff_upper], 1),
-                round(np.real(Zin[idx_cutoff_upper]), 1),
-            ),
-            "color": "red",
-            "ha": "left",
-        },
-        {
-            "pos": (freq[idx] / 1e6, s11_dB[idx]),
-            "offset": [2.0, 2.0],
-            "text": " {} MHz: {} dB\n@ {} Ohm".format(
-                round(freq[idx][0] / 1e6, 1), round(s11_dB[idx][0], 1), round(np.real(Zin[idx][0]), 1)
-            ),
-            "color": "blue",
-            "ha": "left",
-        },
-    ]
-
-    for marker in markers:
-        pyplot.scatter(marker["pos"][0], marker["pos"][1], color=marker["color"], zorder=3)
-        pyplot.text(
-            marker["pos"][0] + marker["offset"][0],
-            marker["pos"][1] + marker["offset"][1],
-            marker["text"],
-            ha=marker["ha"],
-            zorder=4,
-            fontweight="normal",
-        )
+def fdtd_runner(fdtd, jobs=1):
+    """
+    Function `run(sim_path, verbose)` running the simulation, on MPI and with the early stop
+    if enabled.
 
-pyplot.savefig('fig_reflection.svg')
+    :param jobs: number of simulations running at the same time, for the engine and thread
+                 count of `engine_tuner`
+    """
+    run = mpi_run.runner(fdtd, mpi_ranks) if enable_mpi else engine_tuner.runner(fdtd, jobs)
+    if not enable_early_stop:
+        return run
+    # no decision before the end of the Gaussian excitation
+    Z_ref = feed_resistance / symmetry.impedance_factor(sim_planes)
+    monitor = early_stop.S11Monitor(np.linspace(*early_stop_band, 201), Z_ref, min_time=9 / (math.pi * fc))
+    return lambda sim_path, verbose: early_stop.run_monitored(fdtd, sim_path, monitor, verbose, run=run)
 
-#########################################################################################
-# compute far-field from recording box and generate plots
-#
-if enable_nf2ff:
-    # Calculate the far field at phi=0 degrees and at phi=90 degrees
-    theta = np.arange(-180.0, 180.0, 1.0)
-    phi = np.arange(-90, 90, 2)
-    print("=" * 80)
-    print("\n")
-    print("Calculating the 3D far field...")
-
-    # https://docs.openems.de/python/openEMS/nf2ff.html#openEMS.nf2ff.nf2ff.CalcNF2FF
-    # CalcNF2FF(sim_path, freq, theta, phi, radius=1, center=[0, 0, 0], outfile=None, read_cached=False, verbose=0)
-
-    # theta/phi – array like – Theta/Phi angles to calculate the far-field
-    # radius – float – Radius to calculate the far-field (default is 1m)
-    nf2ff_radius = nf_ff_transition_distance
-    print("Analyzing far-field at radius {}".format(nf2ff_radius))
-
-    # 1) Analyze far-field for: single center frequency of interest
-    # Works!
-    #
-    # freqs_of_interest = [f0]
-    #
-    # Result:
-    #    nf2ff: Analysing far-field for 1 frequencies.
-    #    Radiated power: P_rad = 1.3781441597114614e-20 W
-    #    Directivity: D_max = -42.66256438449489 dBi
-    #    Efficiency: nu_rad = 101.85287356184361 %
-    #    Theta_HPBW = 43.0 °
-
-    # 2) Analyze far-field for: lower bound, center and upper bound frequency of interest
-    # Works!
-    #
-    # freqs_of_interest = [446.0e6, 446.1e6, 446.2e6]
-    #
-    # Result:
-    #    nf2ff: Analysing far-field for 3 frequencies.
-    #    Radiated power: P_rad = 1.3763972766838116e-20 W
-    #    Directivity: D_max = -42.662132139823896 dBi
-    #    Efficiency: nu_rad = 101.76329904670399 %
-    #    Theta_HPBW = 43.0 °
-
-    # 3) Analyze far-field for: all frequencies with S11 at least -10 dB
-    # Works!
-    #
-    idx_cutoff_lower = cutoff_dbs_results[cutoff_db_resonance]["lower"]["idx"]
-    idx_cutoff_upper = cutoff_dbs_results[cutoff_db_resonance]["upper"]["idx"]
-    freqs_of_interest = freq[idx_cutoff_lower: idx_cutoff_upper + 1]
-    #
-    # Result:
-    #    nf2ff: Analysing far-field for 1206 frequencies.
-    #    Radiated power: P_rad = 3.313485009786238e-21 W
-    #    Directivity: D_max = -42.46238526982907 dBi
-    #    Efficiency: nu_rad = 24.483622446993255 %
-    #    Theta_HPBW = 43.0 °
-
-    # 4) Analyze far-field for: all frequencies in excitation range [f0 - fc, f0 + fc]
-    # Does NOT work!
-    #
-    # OOM killed! - "nf2ff: Analysing far-field for 2001 frequencies."
-    #
-    # freqs_of_interest = freq
-
-    print("Analyzing far-field for {} frequencies:\n{}".format(len(freqs_of_interest), pformat(freqs_of_interest)))
-
-    nf2ff_res = nf2ff.CalcNF2FF(
-        sim_path=output_dir,
-        freq=freqs_of_interest,
-        theta=theta,
-        phi=phi,
-        radius=nf2ff_radius,
-        read_cached=True,
-        verbose=True,
-    )
 
-    Dmax_dB = 10 * np.log10(nf2ff_res.Dmax[0])
-    E_norm = 20.0 * np.log10(nf2ff_res.E_norm[0] / np.max(nf2ff_res.E_norm[0])) + 10 * np.log10(nf2ff_res.Dmax[0])
-    theta_HPBW = theta[np.where(np.squeeze(E_norm[:, phi == 0]) < Dmax_dB - 3)[0][0]]
+if __name__ == "__main__":
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
 
-    # Display power and directivity
-    print("Radiated power: P_rad = {} W".format(nf2ff_res.Prad[0]))
-    print("Directivity: D_max = {} dBi".format(Dmax_dB))
-    print("Efficiency: nu_rad = {} %".format(100 * nf2ff_res.Prad[0] / np.interp(f0, freq, feed.P_acc)))
-    print("Theta_HPBW = {} °".format(theta_HPBW))
+    fdtd, csx, feed, nf2ff = build_model()
+    mesh_planner.print_size(csx.GetGrid())
 
-    E_norm = 20.0 * np.log10(nf2ff_res.E_norm[0] / np.max(nf2ff_res.E_norm[0])) + 10 * np.log10(nf2ff_res.Dmax[0])
-    E_CPRH = 20.0 * np.log10(np.abs(nf2ff_res.E_cprh[0]) / np.max(nf2ff_res.E_norm[0])) + 10 * np.log10(
-        nf2ff_res.Dmax[0]
-    )
-    E_CPLH = 20.0 * np.log10(np.abs(nf2ff_res.E_cplh[0]) / np.max(nf2ff_res.E_norm[0])) + 10 * np.log10(
-        nf2ff_res.Dmax[0]
-    )
+    #########################################################################################
+    # fire up AppCSXCAD for viewing the model before running it
+    #
+    output_fn = os.path.join("models", "yagi_trena.xml")
+    csx.Write2XML(output_fn)
+    if enable_appcsxcad:
+        os.system('{} "{}"'.format(AppCSXCAD_BIN, output_fn))
 
-    # Plot the pattern
-    pyplot.figure()
-    pyplot.plot(theta, E_norm[:, phi == 0], "k-", linewidth=2, label="$|E|$")
-    pyplot.plot(theta, E_CPRH[:, phi == 0], "g--", linewidth=2, label="$|E_{CPRH}|$")
-    pyplot.plot(theta, E_CPLH[:, phi == 0], "r-.", linewidth=2, label="$|E_{CPLH}|$")
-    pyplot.grid()
-    pyplot.xlabel("Theta (deg)")
-    pyplot.ylabel("Directivity (dBi)")
-    pyplot.title("Frequency: {} GHz".format(nf2ff_res.freq[0] / 1e9))
-    pyplot.legend()
-    pyplot.savefig('fig_directivity.svg')
-
-#########################################################################################
-# show all plots
-#
-if enable_show_plots:
-    pyplot.show()
+    #########################################################################################
+    # estimate the cost of the simulation, stop here for a dry run
+    #
+    if enable_dry_run:
+        # the far-field frequencies depend on the S11 band, so all port frequencies give an upper bound
+        cost_estimator.report("yagi_trena", csx, fc, nr_ts, nf2ff, [mesh_res_farfield] * 3, len(freq),
+                              len(nf2ff_theta), len(nf2ff_phi))
+        sys.exit(0)
 
+    #########################################################################################
+    #
+    start_time = time.time()
+    run = fdtd_runner(fdtd)
+    if enable_cache:
+        cached = fdtd_cache.run_cached(fdtd, output_dir, output_fn, verbose=3, run=run, **fdtd_settings())
+    else:
+        run(output_dir, 3)
+        cached = False
+    if not cached:
+        cost_estimator.record_run("yagi_trena", output_dir, csx, fc, time.time() - start_time)
+    # everything analyze.py needs to reprocess the results without the engine
+    stub = post_hairpin()
+    analyze.write_info(output_dir, "Yagi-Uda", f0, fc, feed_resistance / symmetry.impedance_factor(sim_planes),
+                       sim_planes, nf2ff, nf_ff_transition_distance, nf2ff_theta, nf2ff_phi,
+                       interest_band=(446.0e6, 446.2e6), hairpin=stub)
+    params = dict(director_length=director_length, director_dist=director_dist, driven_length=driven_length,
+                  reflector_length=reflector_length, reflector_dist=reflector_dist, hairpin_enable=hairpin_enable,
+                  hairpin_length=hairpin_length, hairpin_D=hairpin_D, hairpin_model=hairpin_model,
+                  element_model=element_model)
+    with open(os.path.join(output_dir, "params.json"), "w") as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+
+    # Found resonance frequency at 446.2 MHz with -42.5 dB at 71.1 Ohm
+    # Dipole (lambda/2) length is 289.8 mm
+    feed.CalcPort(output_dir, freq)
+
+    # impedance and accepted power of the full antenna when only a part of it is simulated
+    Zin = feed.uf_tot / feed.if_tot * symmetry.impedance_factor(sim_planes)
+    P_acc = feed.P_acc * symmetry.power_factor(sim_planes)
+    s11 = feed.uf_ref / feed.uf_inc
+    if stub is not None:
+        # the lossless stub leaves the power accepted by the antenna, and so its gain, unchanged
+        Zin = hairpin.apply(freq, Zin, **stub)
+        s11 = hairpin.reflection(Zin, feed_resistance)
+    s11_dB = 20.0 * np.log10(np.abs(s11))
+
+    # Found resonance frequency at 446.1 MHz with -42.4 dB at 71.0 Ohm
+    # Dipole (lambda/2) length is 289.8 mm
+    print(s11_dB)
+    print(freq)
+    print(type(s11_dB), len(s11_dB))
+    print(type(freq), len(freq))
+
+    cutoff_db_resonance = analysis.cutoff_db_resonance
+    cutoff_dbs = analysis.cutoff_dbs
+    cutoff_dbs_results = {}
+
+    #idx = np.where((s11_dB < cutoff_db_resonance) & (s11_dB == np.min(s11_dB)))[0]
+    idx = np.where((s11_dB == np.min(s11_dB)))[0]
+    if not len(idx) == 1:
+        print("No resonance frequency found for far-field calculation!")
+    else:
+        print("\n")
+        print("=" * 80)
+        print("")
+        print(
+            "Found resonance frequency at {} MHz with {} dB at {} Ohm".format(
+                round(freq[idx][0] / 1e6, 1),
+                round(s11_dB[idx][0], 1),
+                round(np.real(Zin[idx])[0], 1),
+            )
+        )
+        print("Driven length is {} mm".format(round(driven_length, 1)))
+        print("")
+        print("=" * 80)
+        print("")
 
-#########################################################################################
-#########################################################################################
+        cutoff_dbs_results["interest"] = analysis.interest_band(freq, s11_dB, Zin, 446.0e6, 446.2e6)
+        for kf in ["lower", "center", "upper"]:
+            res = cutoff_dbs_results["interest"][kf]
+            print("S11 at frequency {} MHz is {} dB at {} Ohm [index {}]".format(res["freq"], res["s11"], res["r"], res["idx"]))
+        print("")
 
+        cutoff_dbs_results.update(analysis.bandwidths(freq, s11_dB, Zin, cutoff_dbs, idx[0]))
+        for cutoff_db in cutoff_dbs:
+            print("")
+            for edge in ["lower", "upper"]:
+                res = cutoff_dbs_results[cutoff_db][edge]
+                print("S11 at frequency {} MHz is {} dB at {} Ohm".format(res["freq"], res["s11"], res["r"]))
 
-def generatorFunc_DumpFF2VTK(farfield, t, a, filename):
-    """
-    Create `.vtk` file from openEMS far-field dump.
+        print("=" * 80)
+        print("\n")
 
-    @see https://github.com/thliebig/openEMS-Project/discussions/151
+    #########################################################################################
+    # plot the feed point impedance and the reflection coefficient S11
+    #
+    plots.plot_impedance('fig_impedance.svg', freq, Zin, fig=pyplot.figure() if enable_show_plots else None)
+    plots.plot_reflection('fig_reflection.svg', freq, s11_dB, Zin, cutoff_dbs_results, cutoff_dbs,
+                          cutoff_db_resonance, fig=pyplot.figure() if enable_show_plots else None)
 
-    :param farfield: 2D array of values of field
-    :param t: theta angles in radians
-    :param a: phi angles in radians
-    :param filename: output file name
-    :return:
-    """
+    #########################################################################################
+    # compute far-field from recording box and generate plots
+    #
+    if enable_nf2ff:
+        theta = nf2ff_theta
+        phi = nf2ff_phi
+        print("=" * 80)
+        print("\n")
+        print("Calculating the 3D far field...")
+
+        # https://docs.openems.de/python/openEMS/nf2ff.html#openEMS.nf2ff.nf2ff.CalcNF2FF
+        # CalcNF2FF(sim_path, freq, theta, phi, radius=1, center=[0, 0, 0], outfile=None, read_cached=False, verbose=0)
+
+        # theta/phi – array like – Theta/Phi angles to calculate the far-field
+        # radius – float – Radius to calculate the far-field (default is 1m)
+        nf2ff_radius = nf_ff_transition_distance
+        print("Analyzing far-field at radius {}".format(nf2ff_radius))
+
+        # 1) Analyze far-field for: single center frequency of interest
+        # Works!
+        #
+        # freqs_of_interest = [f0]
+        #
+        # Result:
+        #    nf2ff: Analysing far-field for 1 frequencies.
+        #    Radiated power: P_rad = 1.3781441597114614e-20 W
+        #    Directivity: D_max = -42.66256438449489 dBi
+        #    Efficiency: nu_rad = 101.85287356184361 %
+        #    Theta_HPBW = 43.0 °
+
+        # 2) Analyze far-field for: lower bound, center and upper bound frequency of interest
+        # Works!
+        #
+        # freqs_of_interest = [446.0e6, 446.1e6, 446.2e6]
+        #
+        # Result:
+        #    nf2ff: Analysing far-field for 3 frequencies.
+        #    Radiated power: P_rad = 1.3763972766838116e-20 W
+        #    Directivity: D_max = -42.662132139823896 dBi
+        #    Efficiency: nu_rad = 101.76329904670399 %
+        #    Theta_HPBW = 43.0 °
+
+        # 3) Analyze far-field for: all frequencies with S11 at least -10 dB
+        # Works!
+        #
+        idx_cutoff_lower = cutoff_dbs_results[cutoff_db_resonance]["lower"]["idx"]
+        idx_cutoff_upper = cutoff_dbs_results[cutoff_db_resonance]["upper"]["idx"]
+        freqs_of_interest = freq[idx_cutoff_lower: idx_cutoff_upper + 1]
+        #
+        # Result:
+        #    nf2ff: Analysing far-field for 1206 frequencies.
+        #    Radiated power: P_rad = 3.313485009786238e-21 W
+        #    Directivity: D_max = -42.46238526982907 dBi
+        #    Efficiency: nu_rad = 24.483622446993255 %
+        #    Theta_HPBW = 43.0 °
+
+        # 4) Analyze far-field for: all frequencies in excitation range [f0 - fc, f0 + fc]
+        # Does NOT work with a single nf2ff.CalcNF2FF call!
+        #
+        # OOM killed! - "nf2ff: Analysing far-field for 2001 frequencies."
+        #
+        # Works with nf2ff_chunked.calc_nf2ff, which bounds the memory in use by
+        # nf2ff_chunked.nf2ff_mem_budget and streams the results to disk.
+        #
+        # freqs_of_interest = freq
+
+        print("Analyzing far-field for {} frequencies:\n{}".format(len(freqs_of_interest), pformat(freqs_of_interest)))
+
+        nf2ff_res = nf2ff_chunked.calc_nf2ff(
+            nf2ff,
+            output_dir,
+            freqs_of_interest,
+            theta,
+            phi,
+            radius=nf2ff_radius,
+        )
 
-    with open(filename, "w") as outFile:
-        outFile.write(f"# vtk DataFile Version 3.0\n")
-        outFile.write(f"Structured Grid by python-interface of openEMS\n")
-        outFile.write(f"ASCII\n")
-        outFile.write(f"DATASET STRUCTURED_GRID\n")
-
-        outFile.write(f"DIMENSIONS 1 {len(t)} {len(a)}\n")
-        outFile.write(f"POINTS {len(t) * len(a)} double\n")
-
-        for na in range(len(a)):
-            for nt in range(len(t)):
-                val1 = farfield[nt][na] * math.sin(t[nt]) * math.cos(a[na])
-                val2 = farfield[nt][na] * math.sin(t[nt]) * math.sin(a[na])
-                val3 = farfield[nt][na] * math.cos(t[nt])
-                outFile.write(f"{val1} {val2} {val3}\n")
-
-        outFile.write(f"\n\n")
-        outFile.write(f"POINT_DATA {len(t) * len(a)}\n")
-        outFile.write(f"SCALARS gain double 1\n")
-        outFile.write(f"LOOKUP_TABLE default\n")
-        for na in range(len(a)):
-            for nt in range(len(t)):
-                outFile.write(f"{farfield[nt][na]}\n")
-
-
-#########################################################################################
-# dump radiation field to vtk file
-#
-if enable_nf2ff:
-    # Dump radiation field to vtk file
+        # beamwidths, front-to-back ratio, sidelobe level and gain at every analyzed frequency
+        metrics = pattern_metrics.metrics(nf2ff_res, freq, P_acc)
+        pattern_metrics.save(os.path.join(output_dir, "pattern_metrics.npz"), metrics)
+
+        # Display power and directivity
+        print("Radiated power: P_rad = {} W".format(nf2ff_res.Prad[0]))
+        print("Directivity: D_max = {} dBi".format(metrics.Dmax_dBi[0]))
+        print("Efficiency: nu_rad = {} %".format(100 * metrics.efficiency[0]))
+        print("Gain: G = {} dBi".format(metrics.gain_dBi[0]))
+        print("HPBW: E-plane {} °, H-plane {} °".format(metrics.hpbw_E[0], metrics.hpbw_H[0]))
+        print("Front-to-back ratio: {} dB".format(metrics.fb_dB[0]))
+        print("First sidelobe level: {} dB".format(metrics.sll_dB[0]))
+
+        # Plot the pattern
+        plots.plot_directivity('fig_directivity.svg', theta, phi, nf2ff_res,
+                               fig=pyplot.figure() if enable_show_plots else None)
+
+        # Plot the maximum directivity over all analyzed frequencies
+        if len(nf2ff_res.freq) > 1:
+            plots.plot_directivity_freq('fig_directivity_freq.svg', nf2ff_res,
+                                        fig=pyplot.figure() if enable_show_plots else None)
+
+    #########################################################################################
+    # keep the port, bandwidths and far-field metrics in the result store
     #
-    # AttributeError: 'nf2ff' object has no attribute 'P_rad'
-    # AttributeError: 'nf2ff' object has no attribute 'Prad'
+    result_store.record("Yagi-Uda", params, freq, Zin, s11, cutoff_dbs, farfield=metrics if enable_nf2ff else None,
+                        sim_path=output_dir)
+
+    #########################################################################################
+    # show all plots
+    #
+    if enable_show_plots:
+        pyplot.show()
+
+    #########################################################################################
+    # dump all radiation patterns of the analyzed frequency into one binary VTK file
     #
-    # directivity = nf2ff.P_rad[0]/nf2ff.Prad*4*pi
-    # directivity = nf2ff.Prad[0] / nf2ff.Prad * 4 * math.pi
-    # directivity_CPRH = np.abs(nf2ff.E_cprh[0]) ** 2 / np.max(nf2ff.E_norm[0][:]) ** 2 * nf2ff.Dmax[0]
-    # directivity_CPLH = np.abs(nf2ff.E_cplh[0]) ** 2 / np.max(nf2ff.E_norm[0][:]) ** 2 * nf2ff.Dmax[0]
-
-    # use E_norm, E_CPRH, E_CPLH defined above ^
-    directivity = E_norm
-    directivity_CPRH = E_CPRH
-    directivity_CPLH = E_CPLH
-
-    generatorFunc_DumpFF2VTK(directivity, nf2ff.theta, nf2ff.phi, os.path.join(output_dir, "3D_Pattern.vtk"))
-    generatorFunc_DumpFF2VTK(directivity_CPRH, nf2ff.theta, nf2ff.phi, os.path.join(output_dir, "3D_Pattern_CPRH.vtk"))
-    generatorFunc_DumpFF2VTK(directivity_CPLH, nf2ff.theta, nf2ff.phi, os.path.join(output_dir, "3D_Pattern_CPLH.vtk"))
-
-    # AttributeError: 'nf2ff' object has no attribute 'Dmax'
-    # E_far_normalized = E_norm / np.max(E_norm) * nf2ff.Dmax[0]
-    E_far_normalized = E_norm / np.max(E_norm) * nf2ff_res.Dmax[0]
-
-    generatorFunc_DumpFF2VTK(E_far_normalized, nf2ff.theta, nf2ff.phi,
-                             os.path.join(output_dir, "3D_Pattern_E_norm.vtk"))
+    if enable_nf2ff:
+        vtk_export.write_vts(
+            os.path.join(output_dir, "3D_Pattern.vts"),
+            theta,
+            phi,
+            vtk_export.pattern_arrays(nf2ff_res, [0]),
+        )